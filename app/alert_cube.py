@@ -0,0 +1,190 @@
+"""
+All-time alert aggregate cube along the dashboard's drill-down path:
+account -> service -> region -> resource -> alert type.
+
+Every node holds occurrence and distinct counts per severity under the
+alert_counters field names, so db.counted_alerts reads either. Nodes are
+kept in a dict by path, and each node's child values in another, so a node
+and its children are dict lookups; a resource's nodes are indexed by
+resource id for /api/resource/{id}. The cube is updated as alerts are
+committed in this process, snapshotted to disk so a restart serves clicks
+straight away, and rebuilt from the alerts table (see db.build_alert_cube),
+which stays the source of truth.
+
+Optional: set ALERT_CUBE=1 to enable it.
+"""
+
+import os
+import json
+import logging
+import threading
+import time
+from .hot_store import scanned
+
+logger = logging.getLogger(__name__)
+
+ALERT_CUBE_ENABLED = os.environ.get("ALERT_CUBE", "0") == "1"
+ALERT_CUBE_SNAPSHOT = os.environ.get("ALERT_CUBE_SNAPSHOT", "alert_cube.json")
+
+# Snapshot to disk this often while there are changes (0 never)
+ALERT_CUBE_SNAPSHOT_SECONDS = int(os.environ.get("ALERT_CUBE_SNAPSHOT_SECONDS", "60"))
+
+# Rebuild from DynamoDB this often (0 only at startup), for alerts committed
+# by another process such as app.process_queue; drill-downs lag those commits
+# by up to this long
+ALERT_CUBE_REFRESH_SECONDS = int(os.environ.get("ALERT_CUBE_REFRESH_SECONDS", "300"))
+
+LEVELS = ('account_id', 'service', 'region', 'resource_id', 'alert_type')
+DEFAULTS = {'region': 'us-east-1'}
+SNAPSHOT_VERSION = 1
+
+def _bumps(alert, occurrences, distinct):
+    severity = alert.get('severity', 'medium')
+    bumps = {'total_alerts': occurrences, f"{severity}_alerts": occurrences}
+    if distinct:
+        bumps['distinct_alerts'] = 1
+        bumps[f"distinct_{severity}_alerts"] = 1
+    return bumps
+
+class AlertCube:
+    def __init__(self, enabled=ALERT_CUBE_ENABLED, snapshot_path=ALERT_CUBE_SNAPSHOT):
+        self.enabled = enabled
+        self.snapshot_path = snapshot_path
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.dirty = False
+        # Occurrences committed while a build is reading DynamoDB, replayed onto its result
+        self._building = None
+        # {alert id: last_seen} of the alerts counted by add_alerts, while building
+        self._last_seen = {}
+        self._reset()
+
+    def _reset(self):
+        self._nodes = {(): {}}
+        self._children = {}
+        self._resources = {}
+
+    def _add_path(self, path, bumps):
+        """Add bumps to the node at path and all its ancestors"""
+        for depth in range(len(path) + 1):
+            node = path[:depth]
+            counts = self._nodes.get(node)
+            if counts is None:
+                counts = self._nodes[node] = {}
+                self._children.setdefault(node[:-1], set()).add(node[-1])
+                if depth == 4:
+                    self._resources.setdefault(node[3], set()).add(node)
+            for field, amount in bumps.items():
+                counts[field] = counts.get(field, 0) + amount
+
+    def _add(self, alert, occurrences, distinct):
+        path = tuple(alert.get(level) or DEFAULTS.get(level, '') for level in LEVELS)
+        self._add_path(path, _bumps(alert, occurrences, distinct))
+
+    def add(self, occurrences):
+        """Add occurrences, an iterable of (alert, count, repeat_of); repeats
+        (with the id of the open alert they were folded into) add no distinct alert"""
+        if not self.enabled:
+            return
+        rows = list(occurrences)
+        with self._lock:
+            if self._building is not None:
+                self._building.extend(rows)
+            if self.loaded:
+                for alert, count, repeat_of in rows:
+                    self._add(alert, count, not repeat_of)
+                self.dirty = self.dirty or bool(rows)
+
+    def clear(self):
+        """Empty the cube, e.g. after the alerts table is truncated"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._reset()
+            self.loaded = True
+            self.dirty = True
+            # A build in progress read alerts that are gone now
+            self._building = None
+
+    def begin_build(self):
+        """Start recording added occurrences until finish_build() swaps in a rebuilt cube"""
+        with self._lock:
+            self._building = []
+        return AlertCube(enabled=True, snapshot_path=None)
+
+    def add_alerts(self, alerts):
+        """Count stored alert items, each with its occurrence_count; for a cube being built"""
+        for alert in alerts:
+            self._add(alert, int(alert.get('occurrence_count', 1)), True)
+            self._last_seen[alert['id']] = alert.get('last_seen') or alert.get('timestamp', '')
+
+    def finish_build(self, built):
+        """Replace the contents with a cube from begin_build(), plus what was added
+        meanwhile; returns False, keeping the contents, if the cube was cleared since"""
+        with self._lock:
+            if self._building is None:
+                return False
+            pending, self._building = self._building, None
+            for alert, count, repeat_of in pending:
+                # Occurrences the scan already counted are not counted twice
+                if not scanned(alert, alert.get('last_seen', ''), repeat_of, built._last_seen):
+                    built._add(alert, count, not repeat_of)
+            self._nodes, self._children, self._resources = built._nodes, built._children, built._resources
+            self.loaded = True
+            self.dirty = True
+        return True
+
+    def node(self, *path):
+        """Counts at a path such as (account, service), or None if nothing was counted there"""
+        if not self.loaded:
+            return None
+        with self._lock:
+            counts = self._nodes.get(tuple(path))
+            return dict(counts) if counts is not None else None
+
+    def children(self, *path):
+        """{child value: counts} of the node at path"""
+        with self._lock:
+            return {value: dict(self._nodes[tuple(path) + (value,)])
+                    for value in self._children.get(tuple(path), ())}
+
+    def resource_nodes(self, resource_id):
+        """Paths (account, service, region, resource) of a resource's nodes"""
+        with self._lock:
+            return list(self._resources.get(resource_id, ()))
+
+    def save_snapshot(self):
+        """Write the cube to snapshot_path if it changed since the last snapshot; returns whether it did"""
+        if not self.snapshot_path or not self.loaded or not self.dirty:
+            return False
+        with self._lock:
+            nodes = [[list(path), dict(counts)] for path, counts in self._nodes.items()]
+            self.dirty = False
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': SNAPSHOT_VERSION, 'saved_at': time.time(), 'nodes': nodes}, f)
+        os.replace(tmp_path, self.snapshot_path)
+        return True
+
+    def load_snapshot(self):
+        """Fill the cube from snapshot_path; returns whether there was one to load"""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        with open(self.snapshot_path) as f:
+            snapshot = json.load(f)
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            logger.warning(f"Ignoring alert cube snapshot {self.snapshot_path}: unknown version")
+            return False
+        with self._lock:
+            self._reset()
+            for path, counts in snapshot['nodes']:
+                path = tuple(path)
+                self._nodes[path] = counts
+                if path:
+                    self._children.setdefault(path[:-1], set()).add(path[-1])
+                if len(path) == 4:
+                    self._resources.setdefault(path[3], set()).add(path)
+            self.loaded = True
+        return True
+
+alert_cube = AlertCube()
@@ -0,0 +1,71 @@
+"""
+Alert correlation: collapses repeat notifications for the same problem into one alert
+"""
+
+import os
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from . import db
+
+# Repeats of an alert within this many minutes of its last occurrence are
+# counted on the open alert instead of creating a new one (0 disables)
+CORRELATION_WINDOW_MINUTES = float(os.environ.get("ALERT_CORRELATION_WINDOW_MINUTES", "30"))
+
+# Alert fields that identify "the same problem". Counters, time series, the hot
+# store and the alert cube count a repeat under its own attributes, so every
+# attribute they group by must be here for a repeat to match its open alert
+FINGERPRINT_FIELDS = ('account_id', 'service', 'region', 'resource_id', 'alert_type', 'severity')
+
+# Fingerprints cached before expired entries are pruned
+MAX_CACHED_FINGERPRINTS = 10000
+
+def alert_fingerprint(alert):
+    """Stable fingerprint of an alert's account, service, region, resource, type and severity"""
+    key = "|".join(str(alert.get(field, '')) for field in FINGERPRINT_FIELDS)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+class Correlator:
+    """Finds the open alert a new occurrence repeats.
+
+    Alerts this process has opened or repeated are cached by fingerprint, so
+    a flapping alarm doesn't cost an index query per notification; anything
+    else is looked up on the alerts fingerprint index.
+    """
+
+    def __init__(self, window_minutes=CORRELATION_WINDOW_MINUTES):
+        self.window = timedelta(minutes=window_minutes)
+        self.open_alerts = {}  # fingerprint -> (alert_id, last_seen)
+        self.lock = threading.Lock()
+
+    def correlate(self, alert):
+        """Stamp the alert with its fingerprint and return the id of the open alert it repeats, or None"""
+        fingerprint = alert_fingerprint(alert)
+        alert['fingerprint'] = fingerprint
+        if self.window <= timedelta(0):
+            return None
+
+        seen = datetime.fromisoformat(alert['last_seen'])
+        with self.lock:
+            cached = self.open_alerts.get(fingerprint)
+        if cached and seen - cached[1] <= self.window:
+            return cached[0]
+
+        open_alert = db.find_open_alert(fingerprint, (seen - self.window).isoformat())
+        return open_alert['id'] if open_alert else None
+
+    def remember(self, fingerprint, alert_id, last_seen):
+        """Record that alert_id is open for fingerprint as of last_seen"""
+        seen = datetime.fromisoformat(last_seen)
+        with self.lock:
+            self.open_alerts[fingerprint] = (alert_id, seen)
+            if len(self.open_alerts) > MAX_CACHED_FINGERPRINTS:
+                cutoff = seen - self.window
+                self.open_alerts = {fp: entry for fp, entry in self.open_alerts.items() if entry[1] >= cutoff}
+
+    def forget(self, fingerprint, alert_id):
+        """Drop a cached open alert, e.g. because writing it failed"""
+        with self.lock:
+            cached = self.open_alerts.get(fingerprint)
+            if cached and cached[0] == alert_id:
+                del self.open_alerts[fingerprint]
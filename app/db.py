@@ -1,9 +1,20 @@
 import os
+import time
+import zlib
+import json
+import base64
 import boto3
+from boto3.dynamodb.conditions import Key, Attr
+from botocore.exceptions import ClientError
 import uuid
-from datetime import datetime
+import random
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any
 from .models import Alert, SeverityLevel
+from . import payload_store, sharding
+from .hot_store import hot_store
+from .alert_cube import alert_cube
 import requests
 
 # DynamoDB setup
@@ -18,47 +29,553 @@ def get_dynamodb_client():
         aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY", "fakeSecretAccessKey")
     )
 
+# Table schemas, keyed by table name
+TABLE_SCHEMAS = {
+    'alerts': {
+        'KeySchema': [
+            {'AttributeName': 'id', 'KeyType': 'HASH'},
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'id', 'AttributeType': 'S'},
+            {'AttributeName': 'account_service', 'AttributeType': 'S'},
+            {'AttributeName': 'resource_id', 'AttributeType': 'S'},
+            {'AttributeName': 'severity_shard', 'AttributeType': 'S'},
+            {'AttributeName': 'fingerprint', 'AttributeType': 'S'},
+            {'AttributeName': 'last_seen', 'AttributeType': 'S'},
+        ],
+        'GlobalSecondaryIndexes': [
+            {
+                # Alert lists read an account's service or a resource by
+                # last_seen, newest first, so a time window reads only the
+                # alerts with an occurrence in it (including correlated alerts
+                # that are still firing); account_service is "<account_id>#<service>"
+                'IndexName': 'account-service-seen-index',
+                'KeySchema': [
+                    {'AttributeName': 'account_service', 'KeyType': 'HASH'},
+                    {'AttributeName': 'last_seen', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {'ProjectionType': 'ALL'},
+                'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+            },
+            {
+                'IndexName': 'resource-seen-index',
+                'KeySchema': [
+                    {'AttributeName': 'resource_id', 'KeyType': 'HASH'},
+                    {'AttributeName': 'last_seen', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {'ProjectionType': 'ALL'},
+                'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+            },
+            {
+                # Alerts of a severity by last_seen; severity_shard is the
+                # severity with a write shard suffix (see sharding)
+                'IndexName': 'severity-seen-index',
+                'KeySchema': [
+                    {'AttributeName': 'severity_shard', 'KeyType': 'HASH'},
+                    {'AttributeName': 'last_seen', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {'ProjectionType': 'ALL'},
+                'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+            },
+            {
+                # Correlation looks up the latest alert with a fingerprint
+                'IndexName': 'fingerprint-index',
+                'KeySchema': [
+                    {'AttributeName': 'fingerprint', 'KeyType': 'HASH'},
+                    {'AttributeName': 'last_seen', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {'ProjectionType': 'KEYS_ONLY'},
+                'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+            }
+        ],
+        'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+    },
+    'webhook_queue': {
+        'KeySchema': [
+            {'AttributeName': 'id', 'KeyType': 'HASH'},
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'id', 'AttributeType': 'S'},
+            {'AttributeName': 'status_shard', 'AttributeType': 'S'},
+            {'AttributeName': 'timestamp', 'AttributeType': 'S'},
+            {'AttributeName': 'date_shard', 'AttributeType': 'S'},
+            {'AttributeName': 'schedule_key', 'AttributeType': 'S'},
+            {'AttributeName': 'pending_shard', 'AttributeType': 'S'},
+        ],
+        'GlobalSecondaryIndexes': [
+            {
+                # status_shard and date_shard are the status and date with a
+                # write shard suffix (see sharding), so no single status or
+                # day takes every write
+                'IndexName': 'status-shard-index',
+                'KeySchema': [
+                    {'AttributeName': 'status_shard', 'KeyType': 'HASH'},
+                    {'AttributeName': 'timestamp', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {'ProjectionType': 'ALL'},
+                'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+            },
+            {
+                'IndexName': 'date-shard-index',
+                'KeySchema': [
+                    {'AttributeName': 'date_shard', 'KeyType': 'HASH'},
+                    {'AttributeName': 'timestamp', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {'ProjectionType': 'ALL'},
+                'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+            },
+            {
+                # Consumers pick up pending items by priority once next_attempt_at
+                # has passed; schedule_key is "<priority>#<next_attempt_at>".
+                # Sparse: pending_shard only exists while an item is pending, so
+                # pickup reads only the backlog, and sharding spreads the writes
+                # over PENDING_SHARDS partitions instead of one "pending" key
+                'IndexName': 'pending-shard-index',
+                'KeySchema': [
+                    {'AttributeName': 'pending_shard', 'KeyType': 'HASH'},
+                    {'AttributeName': 'schedule_key', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {'ProjectionType': 'ALL'},
+                'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+            }
+        ],
+        'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+    },
+    # Processed and discarded webhooks moved out of webhook_queue by compaction;
+    # same items and read indexes, so history is listed like the queue
+    'webhook_history': {
+        'KeySchema': [
+            {'AttributeName': 'id', 'KeyType': 'HASH'},
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'id', 'AttributeType': 'S'},
+            {'AttributeName': 'status_shard', 'AttributeType': 'S'},
+            {'AttributeName': 'timestamp', 'AttributeType': 'S'},
+            {'AttributeName': 'date_shard', 'AttributeType': 'S'},
+        ],
+        'GlobalSecondaryIndexes': [
+            {
+                'IndexName': 'status-shard-index',
+                'KeySchema': [
+                    {'AttributeName': 'status_shard', 'KeyType': 'HASH'},
+                    {'AttributeName': 'timestamp', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {'ProjectionType': 'ALL'},
+                'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+            },
+            {
+                'IndexName': 'date-shard-index',
+                'KeySchema': [
+                    {'AttributeName': 'date_shard', 'KeyType': 'HASH'},
+                    {'AttributeName': 'timestamp', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {'ProjectionType': 'ALL'},
+                'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+            }
+        ],
+        'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+    },
+    # Webhook payloads (raw_data, agent_interpretation), kept apart from the
+    # queue metadata so listings and index reads don't pay for them
+    'webhook_payloads': {
+        'KeySchema': [
+            {'AttributeName': 'id', 'KeyType': 'HASH'},
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'id', 'AttributeType': 'S'},
+        ],
+        'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+    },
+    # Aggregate alert counts per hour (H#...) and day (D#...) bucket and scope
+    'alert_counters': {
+        'KeySchema': [
+            {'AttributeName': 'bucket', 'KeyType': 'HASH'},
+            {'AttributeName': 'scope', 'KeyType': 'RANGE'},
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'bucket', 'AttributeType': 'S'},
+            {'AttributeName': 'scope', 'AttributeType': 'S'},
+        ],
+        'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+    },
+    # Progress of resumable bulk operations, keyed by run id
+    'job_checkpoints': {
+        'KeySchema': [
+            {'AttributeName': 'id', 'KeyType': 'HASH'},
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'id', 'AttributeType': 'S'},
+        ],
+        'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+    },
+    # Alert counts per series ("<resolution>#<ALL, or dimension#value>") and
+    # point time; see timeseries
+    'alert_timeseries': {
+        'KeySchema': [
+            {'AttributeName': 'series', 'KeyType': 'HASH'},
+            {'AttributeName': 't', 'KeyType': 'RANGE'},
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'series', 'AttributeType': 'S'},
+            {'AttributeName': 't', 'AttributeType': 'S'},
+        ],
+        'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+    }
+}
+
+# Attributes DynamoDB deletes items by once their epoch-seconds value has passed
+TABLE_TTL = {
+    'alert_timeseries': 'expires_at',
+}
+
+# Pending webhook priorities, most urgent first, and each one's weighted
+# share of a consumer batch
+PRIORITY_CRITICAL = 0
+PRIORITY_HIGH = 1
+PRIORITY_NORMAL = 2
+DEFAULT_PRIORITY = PRIORITY_NORMAL
+PRIORITY_WEIGHTS = {PRIORITY_CRITICAL: 6, PRIORITY_HIGH: 3, PRIORITY_NORMAL: 1}
+
+def schedule_key(priority, next_attempt_at):
+    """Sort key of a pending webhook on the pending index"""
+    return f"{int(priority)}#{next_attempt_at}"
+
+# Partitions of the pending-shard-index. Raising it is safe; lowering it
+# hides pending items in the dropped shards until they are rescheduled
+PENDING_SHARDS = int(os.environ.get("PENDING_SHARDS", "4"))
+
+def pending_shard(webhook_id):
+    """Shard of a pending webhook on the pending-shard-index"""
+    # crc32 rather than hash() so every process agrees
+    return str(zlib.crc32(webhook_id.encode('utf-8')) % PENDING_SHARDS)
+
+def status_shard(webhook_id, status):
+    """Key of a webhook on the status-shard-index"""
+    return sharding.sharded_key(status, webhook_id)
+
+def webhook_shard_keys(item):
+    """status_shard and date_shard for a queue item with id, status and timestamp (or date)"""
+    date = item.get('date') or str(item.get('timestamp', ''))[:10] or 'unknown'
+    return {
+        'status_shard': status_shard(item['id'], item.get('status', 'unknown')),
+        'date_shard': sharding.sharded_key(date, item['id'])
+    }
+
+def webhook_shard_values(item):
+    """webhook_shard_keys as :status_shard/:date_shard expression values"""
+    return {f":{name}": value for name, value in webhook_shard_keys(item).items()}
+
+def alert_index_keys(alert):
+    """Derived attributes an alert needs for its indexes; an alert without
+    last_seen was only seen at its timestamp"""
+    return {
+        'account_service': f"{alert['account_id']}#{alert['service']}",
+        'severity_shard': sharding.sharded_key(alert.get('severity', 'medium'), alert['id']),
+        'last_seen': alert.get('last_seen') or alert['timestamp']
+    }
+
+def pending_schedule(webhook_id, priority, next_attempt_at):
+    """Queue item attributes that put a pending webhook on the schedule"""
+    return {
+        'priority': priority,
+        'next_attempt_at': next_attempt_at,
+        'schedule_key': schedule_key(priority, next_attempt_at),
+        'pending_shard': pending_shard(webhook_id)
+    }
+
+# Indexes dropped from TABLE_SCHEMAS, deleted from existing tables
+RETIRED_INDEXES = {
+    # Replaced by the last_seen-ordered account-service-seen-index, resource-seen-index
+    # and severity-seen-index
+    'alerts': ['account-service-index', 'resource-index', 'account-service-time-index', 'resource-time-index',
+               'severity-time-index'],
+    # Replaced by the sharded pending-shard-index, status-shard-index and date-shard-index
+    'webhook_queue': ['status-schedule-index', 'status-timestamp-index', 'date-index'],
+    'webhook_history': ['status-timestamp-index', 'date-index'],
+}
+
+# Tables known to exist, so hot paths don't list tables on every call
+_known_tables = set()
+
+def ensure_table(table_name, dynamodb=None):
+    """Create a table from TABLE_SCHEMAS if it doesn't exist and return it.
+    
+    Existing tables get any indexes added to their schema since they were
+    created; items already in them are only indexed once backfill_indexes runs.
+    """
+    dynamodb = dynamodb or get_dynamodb_client()
+    if table_name in _known_tables:
+        return dynamodb.Table(table_name)
+    
+    existing_tables = [table.name for table in dynamodb.tables.all()]
+    if table_name not in existing_tables:
+        print(f"Creating {table_name} table as it doesn't exist")
+        table = dynamodb.create_table(TableName=table_name, **TABLE_SCHEMAS[table_name])
+        # Wait for table to be created
+        table.meta.client.get_waiter('table_exists').wait(TableName=table_name)
+        if table_name in TABLE_TTL:
+            table.meta.client.update_time_to_live(
+                TableName=table_name,
+                TimeToLiveSpecification={'Enabled': True, 'AttributeName': TABLE_TTL[table_name]}
+            )
+        print("Table created:", table_name)
+    else:
+        _add_missing_indexes(table_name, dynamodb)
+    
+    _known_tables.add(table_name)
+    return dynamodb.Table(table_name)
+
+# update_table errors when another process is already adding or deleting an index
+INDEX_UPDATE_CONFLICTS = ('ResourceInUseException', 'LimitExceededException')
+
+def _index_attribute_definitions(schema, gsi):
+    """Definitions of one index's key attributes; update_table rejects definitions the call doesn't use"""
+    names = {key['AttributeName'] for key in gsi['KeySchema']}
+    return [definition for definition in schema['AttributeDefinitions'] if definition['AttributeName'] in names]
+
+def _add_missing_indexes(table_name, dynamodb):
+    """Create GSIs that are in the schema but not yet on the table, and delete retired ones.
+    
+    An update another process is already making is left to it.
+    """
+    schema = TABLE_SCHEMAS[table_name]
+    table = dynamodb.Table(table_name)
+    existing = {gsi['IndexName'] for gsi in (table.global_secondary_indexes or [])}
+    
+    for gsi in schema.get('GlobalSecondaryIndexes', []):
+        if gsi['IndexName'] in existing:
+            continue
+        print(f"Adding index {gsi['IndexName']} to {table_name}")
+        # DynamoDB only allows one index creation per update
+        try:
+            table.meta.client.update_table(
+                TableName=table_name,
+                AttributeDefinitions=_index_attribute_definitions(schema, gsi),
+                GlobalSecondaryIndexUpdates=[{'Create': gsi}]
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] not in INDEX_UPDATE_CONFLICTS:
+                raise
+            print(f"Skipped adding index {gsi['IndexName']} to {table_name}: {e.response['Error']['Code']}")
+            continue
+        _wait_for_index(table_name, gsi['IndexName'], dynamodb)
+        if gsi['IndexName'] in INDEX_BACKFILLS:
+            print(f"Existing {table_name} items are missing from {gsi['IndexName']} until backfill_indexes runs")
+    
+    # Retired indexes go once their replacements are in place
+    for index_name in RETIRED_INDEXES.get(table_name, []):
+        if index_name in existing:
+            print(f"Deleting retired index {index_name} from {table_name}")
+            try:
+                table.meta.client.update_table(
+                    TableName=table_name,
+                    GlobalSecondaryIndexUpdates=[{'Delete': {'IndexName': index_name}}]
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] not in INDEX_UPDATE_CONFLICTS + ('ResourceNotFoundException',):
+                    raise
+                print(f"Skipped deleting index {index_name} from {table_name}: {e.response['Error']['Code']}")
+                continue
+            _wait_for_index(table_name, index_name, dynamodb)
+
+def _wait_for_index(table_name, index_name, dynamodb, timeout=300):
+    """Wait until a newly created GSI is active, or a deleted one is gone"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        table = dynamodb.Table(table_name)
+        statuses = {gsi['IndexName']: gsi.get('IndexStatus') for gsi in (table.global_secondary_indexes or [])}
+        if statuses.get(index_name) in (None, 'ACTIVE'):
+            return
+        time.sleep(2)
+    print(f"Index {index_name} on {table_name} is still building")
+
+def _backfill_schedule_key(table, progress=None):
+    """Make pending items created before the pending index visible to consumers; returns the number updated"""
+    scan_kwargs = {
+        'FilterExpression': '#status = :pending AND (attribute_not_exists(schedule_key) OR attribute_not_exists(pending_shard))',
+        'ExpressionAttributeNames': {'#status': 'status', '#ts': 'timestamp', '#priority': 'priority'},
+        'ExpressionAttributeValues': {':pending': 'pending'},
+        'ProjectionExpression': 'id, #ts, next_attempt_at, #priority'
+    }
+    updated = 0
+    while True:
+        response = table.scan(**scan_kwargs)
+        items = response.get('Items', [])
+        for item in items:
+            priority = item.get('priority', DEFAULT_PRIORITY)
+            next_attempt_at = item.get('next_attempt_at') or item.get('timestamp') or datetime.now().isoformat()
+            table.update_item(
+                Key={'id': item['id']},
+                UpdateExpression="SET #priority = :priority, next_attempt_at = :next_attempt_at, schedule_key = :schedule_key, pending_shard = :pending_shard",
+                ExpressionAttributeNames={'#priority': 'priority'},
+                ExpressionAttributeValues={
+                    ':priority': priority,
+                    ':next_attempt_at': next_attempt_at,
+                    ':schedule_key': schedule_key(priority, next_attempt_at),
+                    ':pending_shard': pending_shard(item['id'])
+                }
+            )
+        updated += len(items)
+        if progress and items:
+            progress(len(items))
+        if 'LastEvaluatedKey' not in response:
+            return updated
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def _backfill_shard_keys(table, progress=None):
+    """Give items created before the sharded indexes their status_shard and date_shard; returns the number updated"""
+    scan_kwargs = {
+        'FilterExpression': 'attribute_not_exists(status_shard) OR attribute_not_exists(date_shard)',
+        'ExpressionAttributeNames': {'#status': 'status', '#date': 'date', '#ts': 'timestamp'},
+        'ProjectionExpression': 'id, #status, #date, #ts'
+    }
+    updated = 0
+    while True:
+        response = table.scan(**scan_kwargs)
+        items = response.get('Items', [])
+        for item in items:
+            table.update_item(
+                Key={'id': item['id']},
+                UpdateExpression="SET status_shard = :status_shard, date_shard = :date_shard",
+                ExpressionAttributeValues=webhook_shard_values(item)
+            )
+        updated += len(items)
+        if progress and items:
+            progress(len(items))
+        if 'LastEvaluatedKey' not in response:
+            return updated
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def _backfill_alert_index_keys(table, progress=None):
+    """Give alerts created before the seen indexes their keys; returns the number updated"""
+    scan_kwargs = {
+        'FilterExpression': 'attribute_not_exists(account_service) OR attribute_not_exists(severity_shard) OR attribute_not_exists(last_seen)',
+        'ExpressionAttributeNames': {'#service': 'service', '#ts': 'timestamp'},
+        'ProjectionExpression': 'id, account_id, #service, severity, #ts, last_seen'
+    }
+    updated = 0
+    while True:
+        response = table.scan(**scan_kwargs)
+        items = response.get('Items', [])
+        for item in items:
+            keys = alert_index_keys(item)
+            table.update_item(
+                Key={'id': item['id']},
+                UpdateExpression="SET account_service = :account_service, severity_shard = :severity_shard, last_seen = if_not_exists(last_seen, :last_seen)",
+                ConditionExpression='attribute_exists(id)',
+                ExpressionAttributeValues={':account_service': keys['account_service'],
+                                           ':severity_shard': keys['severity_shard'],
+                                           ':last_seen': keys['last_seen']}
+            )
+        updated += len(items)
+        if progress and items:
+            progress(len(items))
+        if 'LastEvaluatedKey' not in response:
+            return updated
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+# Data migrations that index items written before an index was added
+INDEX_BACKFILLS = {
+    'account-service-seen-index': _backfill_alert_index_keys,
+    'resource-seen-index': _backfill_alert_index_keys,
+    'severity-seen-index': _backfill_alert_index_keys,
+    'pending-shard-index': _backfill_schedule_key,
+    'status-shard-index': _backfill_shard_keys,
+    'date-shard-index': _backfill_shard_keys,
+}
+
+def backfill_indexes(progress=None):
+    """Give existing items the keys of indexes added to their tables since they were written.
+    
+    A migration to run once after startup adds indexes, rather than at every
+    start: each backfill scans its whole table, but only updates items still
+    missing their keys, so it is safe to repeat or to run while the app is
+    serving. progress(count) is called as items are updated. Returns the
+    number updated per table.
+    """
+    dynamodb = get_dynamodb_client()
+    updated = {}
+    for table_name, schema in TABLE_SCHEMAS.items():
+        backfills = dict.fromkeys(INDEX_BACKFILLS[gsi['IndexName']] for gsi in schema.get('GlobalSecondaryIndexes', [])
+                                  if gsi['IndexName'] in INDEX_BACKFILLS)
+        if not backfills:
+            continue
+        table = ensure_table(table_name, dynamodb)
+        updated[table_name] = sum(backfill(table, progress) for backfill in backfills)
+        print(f"Backfilled index keys of {updated[table_name]} {table_name} items")
+    return updated
+
 def create_tables():
     """Create DynamoDB tables if they don't exist"""
     dynamodb = get_dynamodb_client()
+    for table_name in TABLE_SCHEMAS:
+        ensure_table(table_name, dynamodb)
+
+# Parallel scan segments used when a table is emptied item by item
+TRUNCATE_SEGMENTS = int(os.environ.get("TRUNCATE_SEGMENTS", "8"))
+
+def truncate_table(table_name, recreate=True, segments=TRUNCATE_SEGMENTS, progress=None):
+    """Delete every item in a table; returns the method used, item count and timing.
     
-    # Check if table exists
+    Tables in TABLE_SCHEMAS are dropped and recreated (with their indexes),
+    which takes seconds whatever their size; the count is then DynamoDB's
+    approximate ItemCount. Other tables, or recreate=False, are emptied by a
+    parallel segmented scan of their keys with batch deletes, which counts
+    exactly. progress(count) is called as items are deleted.
+    """
+    dynamodb = get_dynamodb_client()
+    start = time.perf_counter()
     existing_tables = [table.name for table in dynamodb.tables.all()]
+    if table_name not in existing_tables:
+        return {"table": table_name, "method": "none", "count": 0, "exact": True, "seconds": 0.0}
     
-    if 'alerts' not in existing_tables:
-        table = dynamodb.create_table(
-            TableName='alerts',
-            KeySchema=[
-                {'AttributeName': 'id', 'KeyType': 'HASH'},
-            ],
-            AttributeDefinitions=[
-                {'AttributeName': 'id', 'AttributeType': 'S'},
-                {'AttributeName': 'account_id', 'AttributeType': 'S'},
-                {'AttributeName': 'service', 'AttributeType': 'S'},
-                {'AttributeName': 'resource_id', 'AttributeType': 'S'},
-            ],
-            GlobalSecondaryIndexes=[
-                {
-                    'IndexName': 'account-service-index',
-                    'KeySchema': [
-                        {'AttributeName': 'account_id', 'KeyType': 'HASH'},
-                        {'AttributeName': 'service', 'KeyType': 'RANGE'}
-                    ],
-                    'Projection': {'ProjectionType': 'ALL'},
-                    'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-                },
-                {
-                    'IndexName': 'resource-index',
-                    'KeySchema': [
-                        {'AttributeName': 'resource_id', 'KeyType': 'HASH'},
-                    ],
-                    'Projection': {'ProjectionType': 'ALL'},
-                    'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-                }
-            ],
-            ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-        )
-        print("Table created:", table.table_name)
+    if recreate and table_name in TABLE_SCHEMAS:
+        table = dynamodb.Table(table_name)
+        count = table.item_count
+        table.delete()
+        table.meta.client.get_waiter('table_not_exists').wait(TableName=table_name)
+        _known_tables.discard(table_name)
+        ensure_table(table_name, dynamodb)
+        if progress:
+            progress(count)
+        method, exact = "recreate", False
+    else:
+        key_names = [key['AttributeName'] for key in dynamodb.Table(table_name).key_schema]
+        segments = max(1, segments)
+        with ThreadPoolExecutor(max_workers=segments, thread_name_prefix=f"truncate-{table_name}") as executor:
+            futures = [executor.submit(_delete_segment, table_name, key_names, segment, segments, progress)
+                       for segment in range(segments)]
+            count = sum(future.result() for future in futures)
+        method, exact = "scan", True
+    
+    seconds = time.perf_counter() - start
+    print(f"Truncated {table_name} ({method}): {count} items in {seconds:.2f}s")
+    return {"table": table_name, "method": method, "count": count, "exact": exact, "seconds": round(seconds, 3)}
+
+def _delete_segment(table_name, key_names, segment, segments, progress):
+    """Scan one segment's keys and batch-delete them; returns the number deleted"""
+    # Own resource per thread; boto3 resources aren't thread-safe
+    table = get_dynamodb_client().Table(table_name)
+    names = {f"#k{i}": name for i, name in enumerate(key_names)}
+    scan_kwargs = {
+        'Segment': segment,
+        'TotalSegments': segments,
+        'ProjectionExpression': ', '.join(names),
+        'ExpressionAttributeNames': names
+    }
+    deleted = 0
+    with table.batch_writer() as batch:
+        while True:
+            response = table.scan(**scan_kwargs)
+            items = response.get('Items', [])
+            for item in items:
+                batch.delete_item(Key={name: item[name] for name in key_names})
+            deleted += len(items)
+            if progress and items:
+                progress(len(items))
+            if 'LastEvaluatedKey' not in response:
+                return deleted
+            scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
 
 def seed_sample_data():
     """Seed sample alert data"""
@@ -145,13 +662,252 @@ def seed_sample_data():
     
     with table.batch_writer() as batch:
         for item in sample_data:
-            batch.put_item(Item=item)
+            batch.put_item(Item={**item, **alert_index_keys(item)})
+    count_alerts(sample_data)
     
     print(f"Seeded {len(sample_data)} sample alerts")
 
 # Data access functions
-def get_account_service_summary():
-    """Get summary of alerts by account and service"""
+def alert_weight(item, count_mode='occurrences'):
+    """How much an alert row adds to summary counts.
+    
+    "occurrences" counts every notification folded into the alert by
+    correlation; "distinct" counts each alert once.
+    """
+    if count_mode == 'distinct':
+        return 1
+    return int(item.get('occurrence_count', 1))
+
+def encode_cursor(key):
+    """Opaque page cursor for an index key"""
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Index key of an encode_cursor cursor; ValueError if it isn't one"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, dict) or 'id' not in key:
+        raise ValueError("Invalid cursor")
+    return key
+
+def _until_timestamp(until):
+    """An inclusive until as a timestamp; an until without a time covers that whole day"""
+    if until and len(until) == 10:
+        return f"{until}T23:59:59.999999"
+    return until
+
+def _seen_filter(until, filters=None):
+    """filters plus, with until, alerts opened by then: together with last_seen >= since
+    on a seen index, the alerts with an occurrence between since and until"""
+    if not until:
+        return filters
+    opened = Attr('timestamp').lte(_until_timestamp(until))
+    return opened if filters is None else filters & opened
+
+def _query_alerts(index_name, key_name, key_value, since=None, until=None, filters=None, limit=None, cursor=None):
+    """Alerts under one key of a seen index, most recently seen first.
+    
+    Reads only the alerts seen since since, and keeps those opened by until
+    (see _seen_filter). filters is an Attr condition applied on top.
+    Returns (items, cursor), where cursor resumes after the last item
+    returned, or is None once the range is exhausted.
+    """
+    table = ensure_table('alerts')
+    key = Key(key_name).eq(key_value)
+    if since:
+        key &= Key('last_seen').gte(since)
+    query_kwargs = {'IndexName': index_name, 'KeyConditionExpression': key, 'ScanIndexForward': False}
+    filters = _seen_filter(until, filters)
+    if filters is not None:
+        query_kwargs['FilterExpression'] = filters
+    if cursor:
+        query_kwargs['ExclusiveStartKey'] = decode_cursor(cursor)
+    
+    items = []
+    while True:
+        if limit:
+            query_kwargs['Limit'] = limit
+        response = table.query(**query_kwargs)
+        items.extend(response['Items'])
+        last_key = response.get('LastEvaluatedKey')
+        if limit and len(items) >= limit:
+            more = len(items) > limit or last_key is not None
+            items = items[:limit]
+            last = items[-1]
+            next_key = {'id': last['id'], key_name: last[key_name], 'last_seen': last['last_seen']}
+            return items, encode_cursor(next_key) if more else None
+        if not last_key:
+            return items, None
+        query_kwargs['ExclusiveStartKey'] = last_key
+
+def _add_remediation(items):
+    for item in items:
+        item['remediation'] = get_remediation_action(item['service'], item['alert_type'], item['severity'])
+    return items
+
+# Units of a window such as "1h" or "7d"
+WINDOW_UNITS = {'h': timedelta(hours=1), 'd': timedelta(days=1)}
+
+def window_since(window, now=None):
+    """Start of a window like "1h", "24h" or "7d" that ends now; ValueError for anything else"""
+    try:
+        amount = int(window[:-1])
+        unit = WINDOW_UNITS[window[-1]]
+    except (ValueError, KeyError, IndexError, TypeError):
+        raise ValueError(f"Invalid window {window!r}: use hours or days, e.g. 1h, 24h or 7d")
+    if amount < 1:
+        raise ValueError(f"Invalid window {window!r}: must be at least 1h")
+    return ((now or datetime.now()) - amount * unit).isoformat()
+
+def _local_time(value):
+    when = datetime.fromisoformat(value)
+    if when.tzinfo:
+        when = when.astimezone().replace(tzinfo=None)
+    return when
+
+def _window_buckets(since, until=None, now=None):
+    """Counter buckets that cover since (down to its hour) until until (to the
+    end of its hour, or of its day for a bare date) or now: a day bucket for
+    each whole day and hour buckets for the rest"""
+    hour = _local_time(since).replace(minute=0, second=0, microsecond=0)
+    end = (_local_time(_until_timestamp(until)) if until else now or datetime.now())
+    end = end.replace(minute=0, second=0, microsecond=0)
+    buckets = []
+    while hour <= end:
+        if hour.hour == 0 and hour + timedelta(hours=23) <= end:
+            buckets.append(f"D#{hour:%Y-%m-%d}")
+            hour += timedelta(days=1)
+        else:
+            buckets.append(f"H#{hour:%Y-%m-%dT%H}")
+            hour += timedelta(hours=1)
+    return buckets
+
+def get_window_counts(prefix, since, until=None):
+    """Counters of every scope starting with prefix, summed over the buckets from since to until or now.
+    
+    since is an ISO timestamp or date, counted from the start of its hour;
+    until is inclusive, to the end of its hour. Returns {scope: {field: count}}.
+    """
+    buckets = _window_buckets(since, until)
+    client = ensure_table('alert_counters').meta.client
+    
+    def read(bucket):
+        query_kwargs = {
+            'TableName': 'alert_counters',
+            'KeyConditionExpression': "#bucket = :bucket AND begins_with(#scope, :prefix)",
+            'ExpressionAttributeNames': {'#bucket': 'bucket', '#scope': 'scope'},
+            'ExpressionAttributeValues': {':bucket': bucket, ':prefix': prefix}
+        }
+        items = []
+        while True:
+            response = client.query(**query_kwargs)
+            items.extend(response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                return items
+            query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    
+    counts = {}
+    with ThreadPoolExecutor(max_workers=8, thread_name_prefix="window") as executor:
+        for items in executor.map(read, buckets):
+            for item in items:
+                totals = counts.setdefault(_unsharded_scope(item['scope']), {})
+                for field, value in item.items():
+                    if field not in ('bucket', 'scope'):
+                        totals[field] = totals.get(field, 0) + int(value)
+    return counts
+
+def counted_alerts(counts, count_mode):
+    """total/medium/high/critical alert counts from a scope's counters"""
+    prefix = 'distinct_' if count_mode == 'distinct' else ''
+    return {
+        'total_alerts': counts.get('distinct_alerts' if prefix else 'total_alerts', 0),
+        'medium_alerts': counts.get(f"{prefix}medium_alerts", 0),
+        'high_alerts': counts.get(f"{prefix}high_alerts", 0),
+        'critical_alerts': counts.get(f"{prefix}critical_alerts", 0)
+    }
+
+def load_hot_store():
+    """Fill the hot store from the alerts table: alerts since its horizon, or all
+    of them. Returns the number of rows held, or None when it's disabled."""
+    if not hot_store.enabled:
+        return None
+    start = hot_store.horizon()
+    hot_store.begin_load()
+    table = ensure_table('alerts')
+    scan_kwargs = {
+        'ProjectionExpression': "id, #ts, last_seen, occurrence_count, account_id, service, #region, resource_id, alert_type, severity",
+        'ExpressionAttributeNames': {'#ts': 'timestamp', '#region': 'region'}
+    }
+    if start:
+        scan_kwargs['FilterExpression'] = Attr('timestamp').gte(start)
+    alerts = []
+    while True:
+        response = table.scan(**scan_kwargs)
+        alerts.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    rows = hot_store.load(alerts, start)
+    print(f"Loaded {len(alerts)} alerts into the hot store")
+    return rows
+
+def build_alert_cube(page_size=1000):
+    """Rebuild the alert cube from the alerts table, a page at a time. Returns
+    the number of alerts counted, or None when the cube is disabled."""
+    if not alert_cube.enabled:
+        return None
+    built = alert_cube.begin_build()
+    table = ensure_table('alerts')
+    scan_kwargs = {
+        'ProjectionExpression': "id, #ts, last_seen, occurrence_count, account_id, service, #region, resource_id, alert_type, severity",
+        'ExpressionAttributeNames': {'#ts': 'timestamp', '#region': 'region'},
+        'Limit': page_size
+    }
+    count = 0
+    while True:
+        response = table.scan(**scan_kwargs)
+        built.add_alerts(response['Items'])
+        count += len(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    if alert_cube.finish_build(built):
+        print(f"Built the alert cube from {count} alerts")
+    return count
+
+def _cube_children(parents, name, count_mode, **fields):
+    """Rows for the alert cube children of the nodes at parents: name holds the
+    child value, children with the same values (and fields) are merged"""
+    rows = {}
+    for parent in parents:
+        for value, counts in alert_cube.children(*parent).items():
+            row_fields = {name: value, **{field: parent[index] for field, index in fields.items()}}
+            key = tuple(row_fields.values())
+            merged = rows.setdefault(key, {})
+            for field, amount in counts.items():
+                merged[field] = merged.get(field, 0) + amount
+            merged['_fields'] = row_fields
+    return [{**merged.pop('_fields'), **counted_alerts(merged, count_mode)} for merged in rows.values()]
+
+def get_account_service_summary(count_mode='occurrences', since=None):
+    """Get summary of alerts by account and service; with since, of the occurrences since then, from the hourly counters"""
+    if not since and alert_cube.node() is not None:
+        services = [(account_id, service) for account_id in alert_cube.children()
+                    for service in alert_cube.children(account_id)]
+        return _cube_children(services, 'region', count_mode, account_id=0, service=1)
+    rows = hot_store.summarize(('account_id', 'service', 'region'), since=since, count_mode=count_mode)
+    if rows is not None:
+        return rows
+    if since:
+        rows = []
+        for scope, counts in get_window_counts("S#", since).items():
+            _, account_id, service, region = scope.split('#', 3)
+            rows.append({'account_id': account_id, 'service': service, 'region': region,
+                         **counted_alerts(counts, count_mode)})
+        return rows
+    
     dynamodb = get_dynamodb_client()
     table = dynamodb.Table('alerts')
     
@@ -178,14 +934,15 @@ def get_account_service_summary():
                     'critical_alerts': 0
                 }
             
-            summary[key]['total_alerts'] += 1
+            weight = alert_weight(item, count_mode)
+            summary[key]['total_alerts'] += weight
             severity = item.get('severity', 'medium')
             if severity == 'medium':
-                summary[key]['medium_alerts'] += 1
+                summary[key]['medium_alerts'] += weight
             elif severity == 'high':
-                summary[key]['high_alerts'] += 1
+                summary[key]['high_alerts'] += weight
             elif severity == 'critical':
-                summary[key]['critical_alerts'] += 1
+                summary[key]['critical_alerts'] += weight
         
         result = list(summary.values())
         print(f"Returning {len(result)} summary records")
@@ -195,37 +952,51 @@ def get_account_service_summary():
         # Return empty list instead of raising exception
         return []
 
-def get_service_resources(account_id: str, service: str, region: str = None):
-    """Get resources for a specific account and service with alert counts"""
-    dynamodb = get_dynamodb_client()
-    table = dynamodb.Table('alerts')
+def _check_range(since, until):
+    """ValueError for an until without a since: windowed counts are summed from since on"""
+    if until and not since:
+        raise ValueError("until needs since (or window)")
+
+def get_service_resources(account_id: str, service: str, region: str = None, count_mode='occurrences',
+                          since: str = None, until: str = None):
+    """Get resources for a specific account and service with alert counts.
     
+    With since (and until), counts only the occurrences between them, from
+    the hot store when it holds the range and the hourly counters otherwise.
+    """
+    _check_range(since, until)
     try:
-        # Build filter expression based on whether region is provided
+        # The alert cube (all time) or the hot store answer first when they hold the range
+        match = {'account_id': account_id, 'service': service}
         if region and region != 'all':
-            # Use ExpressionAttributeNames for reserved keyword 'region'
-            filter_expr = "account_id = :account_id AND service = :service AND #r = :region"
-            expr_values = {
-                ':account_id': account_id,
-                ':service': service,
-                ':region': region
-            }
-            expr_names = {'#r': 'region'}
+            match['region'] = region
+        if not since and alert_cube.node() is not None:
+            regions = [region] if 'region' in match else alert_cube.children(account_id, service)
+            rows = _cube_children([(account_id, service, item_region) for item_region in regions],
+                                  'resource_id', count_mode, region=2)
         else:
-            filter_expr = "account_id = :account_id AND service = :service"
-            expr_values = {
-                ':account_id': account_id,
-                ':service': service
-            }
-            expr_names = {}
-        
-        response = table.scan(
-            FilterExpression=filter_expr,
-            ExpressionAttributeValues=expr_values,
-            ExpressionAttributeNames=expr_names if expr_names else None
-        )
-        
-        items = response['Items']
+            rows = hot_store.summarize(('resource_id', 'region'), since=since, until=until, count_mode=count_mode,
+                                       **match)
+        if rows:
+            return [dict(row, service=service) for row in rows]
+        if rows is not None:
+            items = []
+        elif since:
+            prefix = f"R#{account_id}#{service}#"
+            if region and region != 'all':
+                prefix += f"{region}#"
+            rows = []
+            for scope, counts in get_window_counts(prefix, since, until).items():
+                item_region, resource_id = scope[len(f"R#{account_id}#{service}#"):].split('#', 1)
+                rows.append({'resource_id': resource_id, 'service': service, 'region': item_region,
+                             **counted_alerts(counts, count_mode)})
+            if rows:
+                return rows
+            items = []
+        else:
+            filters = Attr('region').eq(region) if region and region != 'all' else None
+            items, _ = _query_alerts('account-service-seen-index', 'account_service', f"{account_id}#{service}",
+                                     filters=filters)
         
         # If no items found, return a default item to avoid undefined values
         if not items:
@@ -257,14 +1028,15 @@ def get_service_resources(account_id: str, service: str, region: str = None):
                     'critical_alerts': 0
                 }
             
-            summary[key]['total_alerts'] += 1
+            weight = alert_weight(item, count_mode)
+            summary[key]['total_alerts'] += weight
             severity = item.get('severity', 'medium')
             if severity == 'medium':
-                summary[key]['medium_alerts'] += 1
+                summary[key]['medium_alerts'] += weight
             elif severity == 'high':
-                summary[key]['high_alerts'] += 1
+                summary[key]['high_alerts'] += weight
             elif severity == 'critical':
-                summary[key]['critical_alerts'] += 1
+                summary[key]['critical_alerts'] += weight
         
         return list(summary.values())
     except Exception as e:
@@ -280,19 +1052,21 @@ def get_service_resources(account_id: str, service: str, region: str = None):
             'critical_alerts': 0
         }]
 
-def get_resource_alerts(resource_id: str):
-    """Get alert types and counts for a specific resource"""
-    dynamodb = get_dynamodb_client()
-    table = dynamodb.Table('alerts')
-    
-    response = table.scan(
-        FilterExpression="resource_id = :resource_id",
-        ExpressionAttributeValues={
-            ':resource_id': resource_id
-        }
-    )
+def get_resource_alerts(resource_id: str, count_mode='occurrences', since: str = None, until: str = None):
+    """Get alert types and counts for a specific resource; since and until as for get_service_resources"""
+    _check_range(since, until)
+    if not since and alert_cube.node() is not None:
+        return _cube_children(alert_cube.resource_nodes(resource_id), 'alert_type', count_mode)
+    rows = hot_store.summarize(('alert_type',), since=since, until=until, count_mode=count_mode,
+                               resource_id=resource_id)
+    if rows is not None:
+        return rows
+    if since:
+        prefix = f"T#{resource_id}#"
+        return [{'alert_type': scope[len(prefix):], **counted_alerts(counts, count_mode)}
+                for scope, counts in get_window_counts(prefix, since, until).items()]
     
-    items = response['Items']
+    items, _ = _query_alerts('resource-seen-index', 'resource_id', resource_id)
     
     # Process items to create alert type summary
     summary = {}
@@ -307,42 +1081,41 @@ def get_resource_alerts(resource_id: str):
                 'critical_alerts': 0
             }
         
-        summary[alert_type]['total_alerts'] += 1
+        weight = alert_weight(item, count_mode)
+        summary[alert_type]['total_alerts'] += weight
         severity = item.get('severity', 'medium')
         if severity == 'medium':
-            summary[alert_type]['medium_alerts'] += 1
+            summary[alert_type]['medium_alerts'] += weight
         elif severity == 'high':
-            summary[alert_type]['high_alerts'] += 1
+            summary[alert_type]['high_alerts'] += weight
         elif severity == 'critical':
-            summary[alert_type]['critical_alerts'] += 1
+            summary[alert_type]['critical_alerts'] += weight
     
     return list(summary.values())
 
-def get_alert_details(resource_id: str, alert_type: str, severity: str):
-    """Get detailed information about specific alerts"""
-    dynamodb = get_dynamodb_client()
-    table = dynamodb.Table('alerts')
+def get_alert_details(resource_id: str, alert_type: str, severity: str, since: str = None, until: str = None,
+                      limit: int = None, cursor: str = None):
+    """Get detailed information about specific alerts, most recently seen first.
     
-    # Filter by resource_id, alert_type and severity - ensure we only get alerts of the specified severity
-    response = table.scan(
-        FilterExpression="resource_id = :resource_id AND alert_type = :alert_type AND severity = :severity",
-        ExpressionAttributeValues={
-            ':resource_id': resource_id,
-            ':alert_type': alert_type,
-            ':severity': severity
-        }
-    )
-    
-    items = response['Items']
+    Returns (alerts, cursor); see _query_alerts.
+    """
+    # Only alerts of the specified type and severity
+    filters = Attr('alert_type').eq(alert_type) & Attr('severity').eq(severity)
+    items, next_cursor = _query_alerts('resource-seen-index', 'resource_id', resource_id, since, until,
+                                       filters, limit, cursor)
     
     # Add remediation recommendations based on alert type and severity
-    for item in items:
-        item['remediation'] = get_remediation_action(item['service'], item['alert_type'], item['severity'])
-    
-    return items
+    return _add_remediation(items), next_cursor
 
-def get_alerts_by_severity(severity: str):
-    """Get all alerts of a specific severity across all accounts and services"""
+def get_alerts_by_severity(severity: str, since: str = None):
+    """Get all alerts of a specific severity across all accounts and services; with since, only those seen since then, most recently seen first"""
+    if since:
+        ensure_table('alerts')
+        items = sharding.query_shards(_shard_client(), 'alerts', 'severity-seen-index', 'severity_shard',
+                                      sharding.shard_keys(severity), 'last_seen', "#sort >= :since",
+                                      {':since': since}, forward=False)
+        return _add_remediation(items)
+    
     dynamodb = get_dynamodb_client()
     table = dynamodb.Table('alerts')
     
@@ -354,153 +1127,516 @@ def get_alerts_by_severity(severity: str):
         }
     )
     
-    items = response['Items']
-    
     # Add remediation recommendations
-    for item in items:
-        item['remediation'] = get_remediation_action(item['service'], item['alert_type'], item['severity'])
-    
-    return items
+    return _add_remediation(response['Items'])
 
-def get_filtered_alerts(account_id: str, service: str, region: str, severity: str):
-    """Get alerts filtered by account, service, region and severity"""
-    dynamodb = get_dynamodb_client()
-    table = dynamodb.Table('alerts')
+def get_filtered_alerts(account_id: str, service: str, region: str, severity: str, since: str = None,
+                        until: str = None, limit: int = None, cursor: str = None):
+    """Get alerts filtered by account, service, region and severity, most recently seen first.
+    
+    Returns (alerts, cursor); see _query_alerts.
+    """
+    filters = Attr('severity').eq(severity)
+    # Add region filter if provided
+    if region and region != 'all':
+        filters &= Attr('region').eq(region)
     
     try:
-        # Build filter expression
-        filter_expr = "account_id = :account_id AND service = :service AND severity = :severity"
-        expr_values = {
-            ':account_id': account_id,
-            ':service': service,
-            ':severity': severity
-        }
-        expr_names = {}
-        
-        # Add region filter if provided
-        if region and region != 'all':
-            filter_expr += " AND #r = :region"
-            expr_values[':region'] = region
-            expr_names['#r'] = 'region'
-        
-        # Execute the query
-        response = table.scan(
-            FilterExpression=filter_expr,
-            ExpressionAttributeValues=expr_values,
-            ExpressionAttributeNames=expr_names if expr_names else None
-        )
-        
-        items = response['Items']
-        
-        # Add remediation recommendations
-        for item in items:
-            item['remediation'] = get_remediation_action(item['service'], item['alert_type'], item['severity'])
-        
-        return items
+        items, next_cursor = _query_alerts('account-service-seen-index', 'account_service', f"{account_id}#{service}",
+                                           since, until, filters, limit, cursor)
+    except ValueError:
+        raise
     except Exception as e:
         print(f"Error in get_filtered_alerts: {e}")
-        return []
+        return [], None
+    
+    # Add remediation recommendations
+    return _add_remediation(items), next_cursor
 
-def get_webhook_queue_items(status=None, date=None, limit=50):
-    """Get webhook queue items, optionally filtered by status and/or date"""
+def find_open_alert(fingerprint, since):
+    """Get the key of the latest alert with this fingerprint seen at or after since, or None"""
     dynamodb = get_dynamodb_client()
+    table = ensure_table('alerts', dynamodb)
+
+    response = table.query(
+        IndexName='fingerprint-index',
+        KeyConditionExpression=Key('fingerprint').eq(fingerprint) & Key('last_seen').gte(since),
+        ScanIndexForward=False,
+        Limit=1
+    )
+    items = response.get('Items', [])
+    return items[0] if items else None
+
+# Queue item attributes returned by listings; payloads are in webhook_payloads
+WEBHOOK_METADATA_FIELDS = ['id', 'timestamp', 'date', 'status', 'source', 'processed_at', 'error_message',
+                           'attempts', 'priority', 'next_attempt_at', 'alert_id']
+
+def get_webhook_queue_items(status=None, date=None, limit=50, history=False):
+    """Get webhook queue item metadata, newest first, optionally filtered by status and/or date.
     
-    # Check if table exists and create it if it doesn't
-    existing_tables = [table.name for table in dynamodb.tables.all()]
-    if 'webhook_queue' not in existing_tables:
-        print("Creating webhook_queue table as it doesn't exist")
-        queue_table = dynamodb.create_table(
-            TableName='webhook_queue',
-            KeySchema=[
-                {'AttributeName': 'id', 'KeyType': 'HASH'},
-            ],
-            AttributeDefinitions=[
-                {'AttributeName': 'id', 'AttributeType': 'S'},
-                {'AttributeName': 'status', 'AttributeType': 'S'},
-                {'AttributeName': 'timestamp', 'AttributeType': 'S'},
-                {'AttributeName': 'date', 'AttributeType': 'S'},
-            ],
-            GlobalSecondaryIndexes=[
-                {
-                    'IndexName': 'status-timestamp-index',
-                    'KeySchema': [
-                        {'AttributeName': 'status', 'KeyType': 'HASH'},
-                        {'AttributeName': 'timestamp', 'KeyType': 'RANGE'}
-                    ],
-                    'Projection': {'ProjectionType': 'ALL'},
-                    'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-                },
-                {
-                    'IndexName': 'date-index',
-                    'KeySchema': [
-                        {'AttributeName': 'date', 'KeyType': 'HASH'},
-                    ],
-                    'Projection': {'ProjectionType': 'ALL'},
-                    'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-                }
-            ],
-            ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-        )
-        # Wait for table to be created
-        queue_table.meta.client.get_waiter('table_exists').wait(TableName='webhook_queue')
-        print("webhook_queue table created successfully")
+    With history, lists compacted webhooks from webhook_history instead.
+    """
+    dynamodb = get_dynamodb_client()
+    table_name = 'webhook_history' if history else 'webhook_queue'
     
-    table = dynamodb.Table('webhook_queue')
+    # Create the table if it doesn't exist
+    table = ensure_table(table_name, dynamodb)
     
     try:
         # For debugging
         print(f"Getting webhook queue items with status={status}, date={date}, limit={limit}")
         
-        # Use scan instead of query for simplicity and to avoid index issues
-        if status and date and isinstance(date, str):
-            # Filter by both status and date
-            response = table.scan(
-                FilterExpression='#status = :status AND #date = :date',
-                ExpressionAttributeNames={'#status': 'status', '#date': 'date'},
-                ExpressionAttributeValues={':status': status, ':date': date},
-                Limit=limit
-            )
-        elif status:
-            # Filter by status only
-            response = table.scan(
-                FilterExpression='#status = :status',
-                ExpressionAttributeNames={'#status': 'status'},
-                ExpressionAttributeValues={':status': status},
-                Limit=limit
-            )
+        read_kwargs = projection_kwargs(WEBHOOK_METADATA_FIELDS)
+        if status:
+            # Dates are the first part of the ISO timestamps the index is sorted by
+            sort_condition, values = None, None
+            if date and isinstance(date, str):
+                sort_condition, values = "begins_with(#sort, :date)", {':date': date}
+            items = sharding.query_shards(_shard_client(), table_name, 'status-shard-index', 'status_shard',
+                                          sharding.shard_keys(status), 'timestamp', sort_condition, values,
+                                          forward=False, limit=limit, **read_kwargs)
         elif date and isinstance(date, str):
-            # Filter by date only
-            response = table.scan(
-                FilterExpression='#date = :date',
-                ExpressionAttributeNames={'#date': 'date'},
-                ExpressionAttributeValues={':date': date},
-                Limit=limit
-            )
+            items = sharding.query_shards(_shard_client(), table_name, 'date-shard-index', 'date_shard',
+                                          sharding.shard_keys(date), 'timestamp', forward=False, limit=limit,
+                                          **read_kwargs)
         else:
             # Scan all items
-            response = table.scan(Limit=limit)
-        
-        items = response.get('Items', [])
+            items = table.scan(Limit=limit, **read_kwargs).get('Items', [])
+            items.sort(key=lambda item: item.get('timestamp', ''), reverse=True)
         print(f"Found {len(items)} webhook queue items")
         
-        # For debugging, print the first item if available
-        if items:
-            print(f"First item: {items[0]}")
-        
         return items
     except Exception as e:
         print(f"Error in get_webhook_queue_items: {e}")
         return []
 
+# DynamoDB limit on keys in a single BatchGetItem call
+MAX_BATCH_GET_KEYS = 100
+
+def projection_kwargs(fields):
+    """ProjectionExpression arguments for a list of attribute names (always including id)"""
+    if not fields:
+        return {}
+    names = {f"#p{i}": field for i, field in enumerate(dict.fromkeys(['id', *fields]))}
+    return {'ProjectionExpression': ', '.join(names), 'ExpressionAttributeNames': names}
+
+def put_webhook(queue_item, raw_data):
+    """Store a new webhook: its payload in webhook_payloads (compressed or offloaded
+    when large; see payload_store), then its queue item"""
+    dynamodb = get_dynamodb_client()
+    payload = {'id': queue_item['id'], **payload_store.encode_payload(raw_data)}
+    ensure_table('webhook_payloads', dynamodb).put_item(Item=payload)
+    ensure_table('webhook_queue', dynamodb).put_item(Item={**queue_item, **webhook_shard_keys(queue_item)})
+
+def get_webhook_payloads(webhook_ids):
+    """Payloads (raw_data, agent_interpretation) by webhook id; missing ids are left out.
+    
+    Falls back to the legacy postmark_data table for raw data stored there.
+    """
+    ensure_table('webhook_payloads')
+    payloads = batch_get_items('webhook_payloads', webhook_ids)
+    for payload in payloads.values():
+        raw_data = payload_store.decode_payload(payload)
+        payload.pop('raw_data_z', None)
+        payload.pop('raw_data_ref', None)
+        if raw_data is not None:
+            payload['raw_data'] = raw_data
+    legacy = [webhook_id for webhook_id in webhook_ids if 'raw_data' not in payloads.get(webhook_id, {})]
+    if legacy:
+        try:
+            for webhook_id, item in batch_get_items('postmark_data', legacy).items():
+                payloads.setdefault(webhook_id, {'id': webhook_id})['raw_data'] = item.get('raw_data', {})
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ResourceNotFoundException':
+                raise
+    return payloads
+
+def get_webhook_payload(webhook_id):
+    """One webhook's payload, or None; items queued before payloads were split out keep raw_data inline"""
+    payload = get_webhook_payloads([webhook_id]).get(webhook_id, {})
+    if 'raw_data' not in payload:
+        item = get_webhook_item(webhook_id, fields=['raw_data', 'agent_interpretation'])
+        if item is not None and 'raw_data' in item:
+            payload = {**item, **payload, 'raw_data': item['raw_data']}
+    return payload or None
+
+def save_webhook_texts(texts):
+    """Cache text extracted from HTML bodies (webhook id -> text) on the webhooks' payloads.
+
+    Webhooks without a payload item (queued before payloads were split out)
+    are skipped.
+    """
+    dynamodb = get_dynamodb_client()
+    table = ensure_table('webhook_payloads', dynamodb)
+    for webhook_id, text in texts.items():
+        try:
+            table.update_item(
+                Key={'id': webhook_id},
+                UpdateExpression="SET html_text = :text",
+                ConditionExpression="attribute_exists(id)",
+                ExpressionAttributeValues={':text': text}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+def get_webhook_queue_item(webhook_id, fields=None):
+    """Get one webhook queue item by id, optionally only some attributes; None if missing"""
+    dynamodb = get_dynamodb_client()
+    table = ensure_table('webhook_queue', dynamodb)
+    response = table.get_item(Key={'id': webhook_id}, **projection_kwargs(fields))
+    return response.get('Item')
+
+def get_webhook_item(webhook_id, fields=None):
+    """Get a webhook by id from the queue or, once compacted, from history; None if missing"""
+    item = get_webhook_queue_item(webhook_id, fields)
+    if item is None:
+        dynamodb = get_dynamodb_client()
+        table = ensure_table('webhook_history', dynamodb)
+        item = table.get_item(Key={'id': webhook_id}, **projection_kwargs(fields)).get('Item')
+    return item
+
+def batch_get_items(table_name, ids, fields=None):
+    """Get items by id with BatchGetItem; returns a dict of id -> item, leaving out missing ids.
+    
+    fields limits the attributes read, as with get_webhook_queue_item.
+    """
+    dynamodb = get_dynamodb_client()
+    ids = list(dict.fromkeys(ids))
+    found = {}
+    for start in range(0, len(ids), MAX_BATCH_GET_KEYS):
+        request = {table_name: {'Keys': [{'id': item_id} for item_id in ids[start:start + MAX_BATCH_GET_KEYS]],
+                                **projection_kwargs(fields)}}
+        attempt = 0
+        while request:
+            response = dynamodb.batch_get_item(RequestItems=request)
+            for item in response.get('Responses', {}).get(table_name, []):
+                found[item['id']] = item
+            # Retry throttled keys with backoff
+            request = response.get('UnprocessedKeys')
+            if request:
+                attempt += 1
+                time.sleep(min(1.0, 0.05 * (2 ** attempt)))
+    return found
+
+def _shard_client():
+    # The resource's client is thread-safe; resources themselves aren't
+    return get_dynamodb_client().meta.client
+
+def _pending_shard_keys():
+    return [str(shard) for shard in range(PENDING_SHARDS)]
+
+def _due_pending_webhooks(priority, now, limit):
+    """Due pending items of one priority, in next_attempt_at order, from every shard in parallel"""
+    return sharding.query_shards(
+        _shard_client(), 'webhook_queue', 'pending-shard-index', 'pending_shard', _pending_shard_keys(),
+        'schedule_key', "#sort BETWEEN :low AND :high",
+        {':low': f"{priority}#", ':high': schedule_key(priority, now)}, limit=limit
+    )
+
+def get_pending_webhooks(limit=10):
+    """Get pending webhook queue items that are due, most urgent first.
+    
+    Each priority gets a share of the batch in proportion to PRIORITY_WEIGHTS,
+    so critical items go first without starving the rest; share a priority
+    can't use goes to the most urgent priorities with items left.
+    """
+    ensure_table('webhook_queue')
+
+    now = datetime.now().isoformat()
+    due = {priority: _due_pending_webhooks(priority, now, limit) for priority in PRIORITY_WEIGHTS}
+
+    total_weight = sum(PRIORITY_WEIGHTS.values())
+    picked = {priority: due[priority][:max(1, limit * weight // total_weight)]
+              for priority, weight in PRIORITY_WEIGHTS.items()}
+    spare = limit - sum(len(items) for items in picked.values())
+    for priority in sorted(due):
+        if spare <= 0:
+            break
+        extra = due[priority][len(picked[priority]):len(picked[priority]) + spare]
+        picked[priority].extend(extra)
+        spare -= len(extra)
+
+    return [item for priority in sorted(picked) for item in picked[priority]][:limit]
+
+def iter_pending_webhook_ids(page_size=100):
+    """Yield pages of pending webhook ids that are due, most urgent first.
+
+    Priorities are read in turn, each page holding one index page from
+    every shard of the pending index. Only items due when the run starts
+    are read, so items still backing off after a failure wait for their
+    next_attempt_at. Each id is yielded once, even if a failure reschedules
+    it further along the index while the pages are being read.
+    """
+    ensure_table('webhook_queue')
+    per_shard = max(1, page_size // PENDING_SHARDS)
+    now = datetime.now().isoformat()
+    seen = set()
+    for priority in sorted(PRIORITY_WEIGHTS):
+        rounds = sharding.page_shards(
+            _shard_client(), 'webhook_queue', 'pending-shard-index', 'pending_shard', _pending_shard_keys(),
+            'schedule_key', "#sort BETWEEN :low AND :high",
+            {':low': f"{priority}#", ':high': schedule_key(priority, now)},
+            ProjectionExpression='id, schedule_key', Limit=per_shard
+        )
+        for responses, _ in rounds:
+            items = [item for response in responses.values() for item in response.get('Items', []) if item['id'] not in seen]
+            if items:
+                ids = [item['id'] for item in sorted(items, key=lambda item: item['schedule_key'])]
+                seen.update(ids)
+                yield ids
+
+def iter_webhook_ids(status=None, date_from=None, date_to=None, source=None, error_contains=None,
+                     cursor=None, page_size=100):
+    """Yield (ids, cursor) pages of webhook queue ids matching the filters.
+    
+    Reads every shard of the status index when a status is given, of the
+    date index per day for a date range without one, and scans otherwise;
+    source and error_contains are applied as filters, so pages may be short
+    or empty. Dates are YYYY-MM-DD and inclusive. Each cursor is
+    JSON-serializable; passing it back resumes after its page.
+    """
+    ensure_table('webhook_queue')
+    day_end = f"{date_to}T23:59:59.999999" if date_to else None
+    
+    # The shard queries go through the client, so filters are written out with placeholders
+    filters, names, values = [], {}, {}
+    if source:
+        filters.append("#source = :source")
+        names['#source'] = 'source'
+        values[':source'] = source
+    if error_contains:
+        filters.append("contains(#error, :error)")
+        names['#error'] = 'error_message'
+        values[':error'] = error_contains
+    
+    if status:
+        sort_condition = None
+        if date_from and date_to:
+            sort_condition = "#sort BETWEEN :from AND :to"
+            values.update({':from': date_from, ':to': day_end})
+        elif date_from:
+            sort_condition = "#sort >= :from"
+            values[':from'] = date_from
+        elif date_to:
+            sort_condition = "#sort <= :to"
+            values[':to'] = day_end
+        partitions = [('status-shard-index', 'status_shard', sharding.shard_keys(status), sort_condition)]
+    elif date_from:
+        day = datetime.strptime(date_from, "%Y-%m-%d").date()
+        last_day = datetime.strptime(date_to, "%Y-%m-%d").date() if date_to else datetime.now().date()
+        partitions = []
+        while day <= last_day:
+            partitions.append(('date-shard-index', 'date_shard', sharding.shard_keys(day.isoformat()), None))
+            day += timedelta(days=1)
+    else:
+        if date_to:
+            filters.append("#date <= :to")
+            names['#date'] = 'date'
+            values[':to'] = date_to
+        partitions = [None]
+    
+    read_kwargs = {'ProjectionExpression': 'id', 'Limit': page_size}
+    if filters:
+        read_kwargs.update(FilterExpression=' AND '.join(filters), ExpressionAttributeNames=names)
+    
+    cursor = cursor or {}
+    first = int(cursor.get('partition', 0))
+    for index in range(first, len(partitions)):
+        # Cursors from before the indexes were sharded carry a single 'key'; those restart the partition
+        resume = cursor.get('keys') if index == first else None
+        if partitions[index] is None:
+            client = _shard_client()
+            scan_kwargs = dict(read_kwargs, TableName='webhook_queue')
+            if values:
+                scan_kwargs['ExpressionAttributeValues'] = values
+            if index == first and cursor.get('key'):
+                scan_kwargs['ExclusiveStartKey'] = cursor['key']
+            while True:
+                response = client.scan(**scan_kwargs)
+                ids = [item['id'] for item in response.get('Items', [])]
+                last_key = response.get('LastEvaluatedKey')
+                if last_key:
+                    yield ids, {'partition': index, 'key': last_key}
+                    scan_kwargs['ExclusiveStartKey'] = last_key
+                else:
+                    yield ids, {'partition': index + 1}
+                    break
+            continue
+        
+        index_name, hash_attr, keys, sort_condition = partitions[index]
+        # Every shard reads a share of the page
+        shard_kwargs = dict(read_kwargs, Limit=max(1, page_size // len(keys)))
+        rounds = sharding.page_shards(_shard_client(), 'webhook_queue', index_name, hash_attr, keys,
+                                      'timestamp', sort_condition, values or None, resume, **shard_kwargs)
+        for responses, start_keys in rounds:
+            ids = [item['id'] for response in responses.values() for item in response.get('Items', [])]
+            if start_keys:
+                yield ids, {'partition': index, 'keys': start_keys}
+            else:
+                yield ids, {'partition': index + 1}
+
+def reset_webhooks_to_pending(webhook_ids):
+    """Put webhooks back on the schedule, due now at their priority with a fresh
+    attempt count; returns the ids that exist (and were reset).
+    
+    Compacted webhooks are moved back from history first.
+    """
+    dynamodb = get_dynamodb_client()
+    found = batch_get_items('webhook_queue', webhook_ids, fields=['priority'])
+    missing = [webhook_id for webhook_id in webhook_ids if webhook_id not in found]
+    if missing:
+        found.update(restore_webhooks(missing))
+    now = datetime.now().isoformat()
+    client = dynamodb.meta.client
+    
+    def reset(item):
+        # The resource's client is thread-safe; resources themselves aren't
+        try:
+            client.update_item(
+                TableName='webhook_queue',
+                Key={'id': item['id']},
+                UpdateExpression="SET #status = :status, status_shard = :status_shard, processed_at = :now, next_attempt_at = :now, schedule_key = :schedule_key, pending_shard = :pending_shard, attempts = :attempts",
+                ConditionExpression="attribute_exists(id)",
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={
+                    ':status': 'pending',
+                    ':status_shard': status_shard(item['id'], 'pending'),
+                    ':now': now,
+                    ':schedule_key': schedule_key(item.get('priority', DEFAULT_PRIORITY), now),
+                    ':pending_shard': pending_shard(item['id']),
+                    ':attempts': 0
+                }
+            )
+            return item['id']
+        except client.exceptions.ConditionalCheckFailedException:
+            # Deleted since it was read
+            return None
+    
+    with ThreadPoolExecutor(max_workers=8, thread_name_prefix="reset") as executor:
+        reset_ids = set(executor.map(reset, found.values()))
+    return [webhook_id for webhook_id in webhook_ids if webhook_id in reset_ids]
+
+def save_checkpoint(checkpoint_id, **fields):
+    """Record the progress of a resumable operation"""
+    dynamodb = get_dynamodb_client()
+    table = ensure_table('job_checkpoints', dynamodb)
+    table.put_item(Item={'id': checkpoint_id, 'updated_at': datetime.now().isoformat(), **fields})
+
+def get_checkpoint(checkpoint_id):
+    """Get a saved checkpoint, or None"""
+    dynamodb = get_dynamodb_client()
+    table = ensure_table('job_checkpoints', dynamodb)
+    return table.get_item(Key={'id': checkpoint_id}).get('Item')
+
+# Statuses compaction moves to webhook_history; dead letters stay in the queue until handled
+COMPACTABLE_STATUSES = ('processed', 'discarded')
+
+# Age (by received timestamp) after which terminal webhooks are compacted
+HISTORY_AFTER_HOURS = float(os.environ.get("WEBHOOK_HISTORY_AFTER_HOURS", "24"))
+
+def _move_webhooks(items, source, target, status_condition=True):
+    """Copy items to target, then delete them from source; returns the ids moved.
+
+    With status_condition, an item is only deleted while its status is
+    unchanged; an item that changed since it was read (e.g. reset for
+    reprocessing) stays in source and its copy is removed from target.
+    """
+    dynamodb = get_dynamodb_client()
+    with dynamodb.Table(target).batch_writer() as batch:
+        for item in items:
+            batch.put_item(Item=item)
+    client = dynamodb.meta.client
+
+    def delete(item):
+        kwargs = {'TableName': source, 'Key': {'id': item['id']}}
+        if status_condition:
+            kwargs.update(ConditionExpression="#status = :status",
+                          ExpressionAttributeNames={'#status': 'status'},
+                          ExpressionAttributeValues={':status': item['status']})
+        try:
+            client.delete_item(**kwargs)
+            return item['id']
+        except client.exceptions.ConditionalCheckFailedException:
+            client.delete_item(TableName=target, Key={'id': item['id']})
+            return None
+
+    with ThreadPoolExecutor(max_workers=8, thread_name_prefix="move") as executor:
+        return [webhook_id for webhook_id in executor.map(delete, items) if webhook_id]
+
+def compact_webhook_queue(older_than_hours=HISTORY_AFTER_HOURS, page_size=100, progress=None):
+    """Move processed and discarded webhooks received more than older_than_hours
+    ago from webhook_queue to webhook_history.
+
+    Payloads stay in webhook_payloads, so history items keep their details.
+    progress(count) is called after each page. Returns
+    {moved, skipped, cutoff, seconds}.
+    """
+    start = time.monotonic()
+    dynamodb = get_dynamodb_client()
+    ensure_table('webhook_queue', dynamodb)
+    ensure_table('webhook_history', dynamodb)
+    cutoff = (datetime.now() - timedelta(hours=older_than_hours)).isoformat()
+    moved = 0
+    skipped = 0
+
+    for status in COMPACTABLE_STATUSES:
+        keys = sharding.shard_keys(status)
+        rounds = sharding.page_shards(_shard_client(), 'webhook_queue', 'status-shard-index', 'status_shard', keys,
+                                      'timestamp', "#sort < :cutoff", {':cutoff': cutoff},
+                                      Limit=max(1, page_size // len(keys)))
+        for responses, _ in rounds:
+            items = [item for response in responses.values() for item in response.get('Items', [])]
+            if items:
+                count = len(_move_webhooks(items, 'webhook_queue', 'webhook_history'))
+                moved += count
+                skipped += len(items) - count
+                if progress:
+                    progress(len(items))
+
+    print(f"Compacted webhook_queue: {moved} moved to history, {skipped} changed since read")
+    return {'moved': moved, 'skipped': skipped, 'cutoff': cutoff, 'seconds': round(time.monotonic() - start, 3)}
+
+def count_compactable_webhooks(older_than_hours=HISTORY_AFTER_HOURS):
+    """Count the webhooks compact_webhook_queue would move now"""
+    ensure_table('webhook_queue')
+    cutoff = (datetime.now() - timedelta(hours=older_than_hours)).isoformat()
+    return sum(
+        sharding.count_shards(_shard_client(), 'webhook_queue', 'status-shard-index', 'status_shard',
+                              sharding.shard_keys(status), 'timestamp', "#sort < :cutoff", {':cutoff': cutoff})
+        for status in COMPACTABLE_STATUSES
+    )
+
+def restore_webhooks(webhook_ids):
+    """Move webhooks back from history to the queue; returns a dict of id -> item for those found"""
+    ensure_table('webhook_history')
+    items = batch_get_items('webhook_history', webhook_ids)
+    if not items:
+        return {}
+    restored = _move_webhooks(list(items.values()), 'webhook_history', 'webhook_queue', status_condition=False)
+    return {webhook_id: items[webhook_id] for webhook_id in restored}
+
+def count_pending_webhooks():
+    """Count pending webhook queue items across the shards of the pending index"""
+    ensure_table('webhook_queue')
+    return sharding.count_shards(_shard_client(), 'webhook_queue', 'pending-shard-index', 'pending_shard',
+                                 _pending_shard_keys())
+
 def update_webhook_status(webhook_id, status, error_message=None):
-    """Update the status of a webhook queue item"""
+    """Update the status of a webhook queue item.
+    
+    Setting a webhook back to pending makes it due immediately (at its
+    priority) with a fresh attempt count; any other status takes it off the
+    schedule.
+    """
     dynamodb = get_dynamodb_client()
     table = dynamodb.Table('webhook_queue')
     
     try:
-        update_expr = "SET #status = :status, processed_at = :processed_at"
+        update_expr = "SET #status = :status, status_shard = :status_shard, processed_at = :processed_at"
         expr_attr_values = {
             ':status': status,
+            ':status_shard': status_shard(webhook_id, status),
             ':processed_at': datetime.now().isoformat()
         }
         
@@ -508,6 +1644,18 @@ def update_webhook_status(webhook_id, status, error_message=None):
             update_expr += ", error_message = :error"
             expr_attr_values[':error'] = error_message
         
+        if status == 'pending':
+            response = table.get_item(Key={'id': webhook_id}, ProjectionExpression='#priority',
+                                      ExpressionAttributeNames={'#priority': 'priority'})
+            priority = response.get('Item', {}).get('priority', DEFAULT_PRIORITY)
+            update_expr += ", next_attempt_at = :next_attempt_at, schedule_key = :schedule_key, pending_shard = :pending_shard, attempts = :attempts"
+            expr_attr_values[':next_attempt_at'] = expr_attr_values[':processed_at']
+            expr_attr_values[':schedule_key'] = schedule_key(priority, expr_attr_values[':processed_at'])
+            expr_attr_values[':pending_shard'] = pending_shard(webhook_id)
+            expr_attr_values[':attempts'] = 0
+        else:
+            update_expr += " REMOVE next_attempt_at, schedule_key, pending_shard"
+        
         table.update_item(
             Key={'id': webhook_id},
             UpdateExpression=update_expr,
@@ -520,37 +1668,390 @@ def update_webhook_status(webhook_id, status, error_message=None):
         print(f"Error updating webhook status: {e}")
         return False
 
-def get_webhook_stats(date=None):
-    """Get webhook queue statistics, optionally filtered by date"""
+# Retry policy for webhooks that fail processing
+MAX_WEBHOOK_ATTEMPTS = int(os.environ.get("WEBHOOK_MAX_ATTEMPTS", "5"))
+RETRY_BASE_SECONDS = float(os.environ.get("WEBHOOK_RETRY_BASE_SECONDS", "5"))
+RETRY_MAX_SECONDS = float(os.environ.get("WEBHOOK_RETRY_MAX_SECONDS", "3600"))
+
+def retry_delay(attempts):
+    """Exponential backoff with full jitter for the given number of failed attempts"""
+    return random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** attempts)))
+
+def record_webhook_failure(webhook_id, error_message, attempts=None, priority=None):
+    """Schedule a failed webhook for retry, or dead-letter it after MAX_WEBHOOK_ATTEMPTS.
+    
+    attempts is the number of attempts made before this one; it and the
+    webhook's priority are read from the item when not given. Returns the new
+    status ("pending" or "dead_letter").
+    """
+    dynamodb = get_dynamodb_client()
+    table = dynamodb.Table('webhook_queue')
+    
+    if attempts is None or priority is None:
+        response = table.get_item(Key={'id': webhook_id}, ProjectionExpression='attempts, #priority',
+                                  ExpressionAttributeNames={'#priority': 'priority'})
+        item = response.get('Item', {})
+        attempts = item.get('attempts', 0) if attempts is None else attempts
+        priority = item.get('priority', DEFAULT_PRIORITY) if priority is None else priority
+    attempts = int(attempts) + 1
+    
+    now = datetime.now()
+    expr_attr_values = {
+        ':attempts': attempts,
+        ':error': error_message,
+        ':processed_at': now.isoformat()
+    }
+    if attempts >= MAX_WEBHOOK_ATTEMPTS:
+        status = 'dead_letter'
+        update_expr = "SET #status = :status, status_shard = :status_shard, attempts = :attempts, error_message = :error, processed_at = :processed_at REMOVE next_attempt_at, schedule_key, pending_shard"
+    else:
+        status = 'pending'
+        update_expr = "SET #status = :status, status_shard = :status_shard, attempts = :attempts, error_message = :error, processed_at = :processed_at, next_attempt_at = :next_attempt_at, schedule_key = :schedule_key, pending_shard = :pending_shard"
+        expr_attr_values[':next_attempt_at'] = (now + timedelta(seconds=retry_delay(attempts))).isoformat()
+        expr_attr_values[':schedule_key'] = schedule_key(priority, expr_attr_values[':next_attempt_at'])
+        expr_attr_values[':pending_shard'] = pending_shard(webhook_id)
+    expr_attr_values[':status'] = status
+    expr_attr_values[':status_shard'] = status_shard(webhook_id, status)
+    
+    table.update_item(
+        Key={'id': webhook_id},
+        UpdateExpression=update_expr,
+        ExpressionAttributeNames={'#status': 'status'},
+        ExpressionAttributeValues=expr_attr_values
+    )
+    return status
+
+def get_dead_letter_webhooks(limit=50):
+    """Get dead-lettered webhook queue items, most recent first"""
+    ensure_table('webhook_queue')
+    
+    try:
+        return sharding.query_shards(
+            _shard_client(), 'webhook_queue', 'status-shard-index', 'status_shard', sharding.shard_keys('dead_letter'),
+            'timestamp', forward=False, limit=limit, **projection_kwargs(WEBHOOK_METADATA_FIELDS)
+        )
+    except Exception as e:
+        print(f"Error in get_dead_letter_webhooks: {e}")
+        return []
+
+# DynamoDB limit on actions in a single TransactWriteItems call
+MAX_TRANSACT_ITEMS = 100
+TRANSACTION_RETRIES = 3
+
+def counter_scopes(alert):
+    """Aggregate counter scopes an alert contributes to: its account/service/region,
+    its resource within that, and its alert type on the resource.
+    
+    Processing lanes are keyed by account/resource, so only the
+    account/service/region counters are shared between lanes; they carry a
+    write shard of the resource (see sharding) so concurrent transactions
+    rarely touch the same item.
+    """
+    region = alert.get('region', 'us-east-1')
+    return [
+        sharding.sharded_key(f"S#{alert['account_id']}#{alert['service']}#{region}",
+                             f"{alert['account_id']}/{alert['resource_id']}"),
+        f"R#{alert['account_id']}#{alert['service']}#{region}#{alert['resource_id']}",
+        f"T#{alert['resource_id']}#{alert['alert_type']}"
+    ]
+
+def _unsharded_scope(scope):
+    """A counter scope without its write shard suffix"""
+    if scope.startswith('S#') and scope.count('#') == 4:
+        return scope.rsplit('#', 1)[0]
+    return scope
+
+def counter_buckets(timestamp):
+    """Time buckets an occurrence at an ISO timestamp is counted in: its hour and its day"""
+    return [f"H#{timestamp[:13]}", f"D#{timestamp[:10]}"]
+
+def counter_keys(alert, timestamp):
+    """(bucket, scope) of every counter an occurrence of an alert at timestamp bumps"""
+    return [(bucket, scope) for bucket in counter_buckets(timestamp) for scope in counter_scopes(alert)]
+
+def _add_counts(counters, alert, timestamp, occurrences, distinct):
+    """Add an alert's occurrences (and, if distinct, the alert itself) to counters,
+    a dict of (bucket, scope) -> {field: amount}"""
+    severity = alert.get('severity', 'medium')
+    amounts = {'total_alerts': occurrences, f"{severity}_alerts": occurrences}
+    if distinct:
+        amounts.update({'distinct_alerts': 1, f"distinct_{severity}_alerts": 1})
+    for key in counter_keys(alert, timestamp):
+        bumps = counters.setdefault(key, {})
+        for field, amount in amounts.items():
+            bumps[field] = bumps.get(field, 0) + amount
+
+def _counter_update(key, bumps):
+    """Build an ADD update for one counter item"""
+    bucket, scope = key
+    names = {}
+    values = {}
+    adds = []
+    for i, (field, amount) in enumerate(sorted(bumps.items())):
+        names[f"#c{i}"] = field
+        values[f":c{i}"] = amount
+        adds.append(f"#c{i} :c{i}")
+    return {
+        'Update': {
+            'TableName': 'alert_counters',
+            'Key': {'bucket': bucket, 'scope': scope},
+            'UpdateExpression': "ADD " + ", ".join(adds),
+            'ExpressionAttributeNames': names,
+            'ExpressionAttributeValues': values
+        }
+    }
+
+def count_alerts(alerts):
+    """Add alerts written outside commit_alerts (sample data, rebuilds) to the
+    counters, each with its occurrence_count at its timestamp"""
+    counters = {}
+    for alert in alerts:
+        _add_counts(counters, alert, alert['timestamp'], int(alert.get('occurrence_count', 1)), True)
+    client = ensure_table('alert_counters').meta.client
+    with ThreadPoolExecutor(max_workers=8, thread_name_prefix="counters") as executor:
+        list(executor.map(lambda key: client.update_item(**_counter_update(key, counters[key])['Update']), counters))
+    return len(counters)
+
+def rebuild_alert_counters(progress=None):
+    """Recompute alert_counters from the alerts table; returns {alerts, counters}"""
+    truncate_table('alert_counters')
+    table = ensure_table('alerts')
+    alerts = []
+    scan_kwargs = {}
+    while True:
+        response = table.scan(**scan_kwargs)
+        alerts.extend(response['Items'])
+        if progress:
+            progress(len(response['Items']))
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return {'alerts': len(alerts), 'counters': count_alerts(alerts)}
+
+def _commit_alert_id(commit):
+    """The alert a commit writes: the open alert it repeats, or its own new alert"""
+    return commit.get('repeat_of') or commit['alert']['id']
+
+def _alert_writes(commits):
+    """Collect one write per alert touched by a group of commits.
+    
+    A transaction may only touch each item once, so repeats of an alert
+    opened or repeated earlier in the same group are folded into one write.
+    """
+    writes = {}
+    for commit in commits:
+        alert = commit['alert']
+        alert_id = _commit_alert_id(commit)
+        if alert_id not in writes:
+            writes[alert_id] = {'alert': alert, 'new': not commit.get('repeat_of'), 'occurrences': 0, 'last_seen': ''}
+        write = writes[alert_id]
+        write['occurrences'] += 1
+        write['last_seen'] = max(write['last_seen'], alert['last_seen'])
+        write['message'] = alert['message']
+    return writes
+
+def _alert_write_action(alert_id, write):
+    """Put a new alert, or add occurrences to an open one"""
+    if write['new']:
+        item = dict(write['alert'], **alert_index_keys(write['alert']))
+        item.update(occurrence_count=write['occurrences'], last_seen=write['last_seen'], message=write['message'])
+        return {
+            'Put': {
+                'TableName': 'alerts',
+                'Item': item,
+                'ConditionExpression': 'attribute_not_exists(id)'
+            }
+        }
+    return {
+        'Update': {
+            'TableName': 'alerts',
+            'Key': {'id': alert_id},
+            'UpdateExpression': "SET last_seen = :last_seen, message = :message ADD occurrence_count :occurrences",
+            'ConditionExpression': 'attribute_exists(id)',
+            'ExpressionAttributeValues': {
+                ':last_seen': write['last_seen'],
+                ':message': write['message'],
+                ':occurrences': write['occurrences']
+            }
+        }
+    }
+
+def _webhook_processed_action(commit):
+    """Mark-processed action for one webhook"""
+    return {
+        'Update': {
+            'TableName': 'webhook_queue',
+            'Key': {'id': commit['webhook_id']},
+            'UpdateExpression': "SET #status = :status, status_shard = :status_shard, processed_at = :processed_at, alert_id = :alert_id REMOVE next_attempt_at, schedule_key, pending_shard",
+            'ConditionExpression': 'attribute_exists(id) AND #status <> :status',
+            'ExpressionAttributeNames': {'#status': 'status'},
+            'ExpressionAttributeValues': {
+                ':status': 'processed',
+                ':status_shard': status_shard(commit['webhook_id'], 'processed'),
+                ':processed_at': datetime.now().isoformat(),
+                ':alert_id': _commit_alert_id(commit)
+            }
+        }
+    }
+
+def _webhook_interpretation_action(commit):
+    """Store the agent interpretation with the webhook's payload"""
+    return {
+        'Update': {
+            'TableName': 'webhook_payloads',
+            'Key': {'id': commit['webhook_id']},
+            'UpdateExpression': "SET agent_interpretation = :agent_interpretation",
+            'ExpressionAttributeValues': {':agent_interpretation': commit['agent_interpretation']}
+        }
+    }
+
+def _transaction_for(commits):
+    """Build the TransactItems for a group of commits, merging counter bumps per scope.
+    
+    Counters count every occurrence in total_alerts/<severity>_alerts and only
+    newly opened alerts in distinct_alerts/distinct_<severity>_alerts.
+    """
+    actions = [_alert_write_action(alert_id, write) for alert_id, write in _alert_writes(commits).items()]
+    actions.extend(_webhook_processed_action(commit) for commit in commits)
+    counters = {}
+    for commit in commits:
+        alert = commit['alert']
+        _add_counts(counters, alert, alert['last_seen'], 1, not commit.get('repeat_of'))
+    actions.extend(_counter_update(key, bumps) for key, bumps in counters.items())
+    # Last, so a single commit's alert and webhook actions stay at 0 and 1
+    actions.extend(_webhook_interpretation_action(commit) for commit in commits)
+    return actions
+
+def _group_commits(commits):
+    """Split commits into groups whose transactions stay within the action limit"""
+    group = []
+    alert_ids = set()
+    counters = set()
+    for commit in commits:
+        keys = set(counter_keys(commit['alert'], commit['alert']['last_seen']))
+        new_alert_ids = alert_ids | {_commit_alert_id(commit)}
+        new_counters = counters | keys
+        # An alert write per alert id, a status and an interpretation update per webhook, and one per counter
+        if group and len(new_alert_ids) + 2 * (len(group) + 1) + len(new_counters) > MAX_TRANSACT_ITEMS:
+            yield group
+            group = []
+            new_alert_ids = {_commit_alert_id(commit)}
+            new_counters = keys
+        group.append(commit)
+        alert_ids = new_alert_ids
+        counters = new_counters
+    if group:
+        yield group
+
+def _execute_transaction(client, actions):
+    """Run a transaction, retrying conflicts with other in-flight transactions"""
+    for attempt in range(TRANSACTION_RETRIES):
+        try:
+            client.transact_write_items(TransactItems=actions)
+            return
+        except client.exceptions.TransactionCanceledException as e:
+            reasons = [r.get('Code') for r in e.response.get('CancellationReasons', [])]
+            if 'TransactionConflict' not in reasons or attempt == TRANSACTION_RETRIES - 1:
+                raise
+            time.sleep(0.05 * (2 ** attempt))
+
+def _commit_failure(error, commit):
+    """Classify a failed single-commit transaction (alert write, then webhook update)"""
+    reasons = []
+    if hasattr(error, 'response'):
+        reasons = [r.get('Code') for r in error.response.get('CancellationReasons', [])]
+    if len(reasons) > 1 and reasons[1] == 'ConditionalCheckFailed':
+        return "duplicate"
+    if reasons and reasons[0] == 'ConditionalCheckFailed':
+        if commit.get('repeat_of'):
+            return f"error: open alert {commit['repeat_of']} no longer exists"
+        return "duplicate"
+    return f"error: {error}"
+
+def commit_alerts(commits):
+    """Write alerts, webhook status and interpretation, and counter bumps transactionally.
+
+    Each commit is a dict with 'alert', 'webhook_id' and 'agent_interpretation',
+    plus 'repeat_of' (an open alert id) when correlation folded the alert into
+    an existing one. Commits are grouped into as few TransactWriteItems calls
+    as the action limit allows. Returns a dict of webhook_id -> "processed",
+    "duplicate" (the alert or processed status was already written) or
+    "error: <message>".
+    """
     dynamodb = get_dynamodb_client()
+    ensure_table('alerts', dynamodb)
+    ensure_table('alert_counters', dynamodb)
+    ensure_table('webhook_payloads', dynamodb)
+    client = dynamodb.meta.client
+
+    results = {}
+    for group in _group_commits(commits):
+        try:
+            _execute_transaction(client, _transaction_for(group))
+            for commit in group:
+                results[commit['webhook_id']] = "processed"
+            continue
+        except Exception as e:
+            if len(group) == 1:
+                results[group[0]['webhook_id']] = _commit_failure(e, group[0])
+                continue
+            print(f"Transaction for {len(group)} alerts failed, committing individually: {e}")
+
+        # One item cancelled the whole group; retry each on its own
+        for commit in group:
+            try:
+                _execute_transaction(client, _transaction_for([commit]))
+                results[commit['webhook_id']] = "processed"
+            except Exception as e:
+                results[commit['webhook_id']] = _commit_failure(e, commit)
+
+    return results
+
+def commit_alert(alert, webhook_id, agent_interpretation, repeat_of=None):
+    """Transactionally commit a single alert; see commit_alerts"""
+    commit = {
+        'alert': alert,
+        'webhook_id': webhook_id,
+        'agent_interpretation': agent_interpretation
+    }
+    if repeat_of:
+        commit['repeat_of'] = repeat_of
+    return commit_alerts([commit])[webhook_id]
+
+def get_webhook_stats(date=None, history=False):
+    """Get webhook queue statistics, optionally filtered by date; with history, of compacted webhooks"""
+    dynamodb = get_dynamodb_client()
+    table_name = 'webhook_history' if history else 'webhook_queue'
     
     # Check if table exists first
     existing_tables = [table.name for table in dynamodb.tables.all()]
-    if 'webhook_queue' not in existing_tables:
-        print("webhook_queue table doesn't exist for stats")
+    if table_name not in existing_tables:
+        print(f"{table_name} table doesn't exist for stats")
         return {
             'total': 0,
             'pending': 0,
             'processed': 0,
             'error': 0,
+            'dead_letter': 0,
             'dates': {}
         }
     
-    table = dynamodb.Table('webhook_queue')
+    table = ensure_table(table_name, dynamodb)
     
     try:
-        # Use scan instead of query for simplicity
+        # Only status and date are needed; read every page
+        read_kwargs = projection_kwargs(['status', 'date'])
         if date:
-            response = table.scan(
-                FilterExpression='#date = :date',
-                ExpressionAttributeNames={'#date': 'date'},
-                ExpressionAttributeValues={':date': date}
-            )
+            items = sharding.query_shards(_shard_client(), table_name, 'date-shard-index', 'date_shard',
+                                          sharding.shard_keys(date), 'timestamp', **read_kwargs)
         else:
-            # Scan all items
-            response = table.scan()
-        
-        items = response['Items']
+            items = []
+            while True:
+                response = table.scan(**read_kwargs)
+                items.extend(response['Items'])
+                if 'LastEvaluatedKey' not in response:
+                    break
+                read_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
         
         # Calculate statistics
         stats = {
@@ -558,6 +2059,7 @@ def get_webhook_stats(date=None):
             'pending': 0,
             'processed': 0,
             'error': 0,
+            'dead_letter': 0,
             'dates': {}
         }
         
@@ -572,6 +2074,8 @@ def get_webhook_stats(date=None):
                 stats['processed'] += 1
             elif status == 'error':
                 stats['error'] += 1
+            elif status == 'dead_letter':
+                stats['dead_letter'] += 1
             
             # Update date-specific counts
             if item_date not in stats['dates']:
@@ -579,7 +2083,8 @@ def get_webhook_stats(date=None):
                     'total': 0,
                     'pending': 0,
                     'processed': 0,
-                    'error': 0
+                    'error': 0,
+                    'dead_letter': 0
                 }
             
             stats['dates'][item_date]['total'] += 1
@@ -589,6 +2094,8 @@ def get_webhook_stats(date=None):
                 stats['dates'][item_date]['processed'] += 1
             elif status == 'error':
                 stats['dates'][item_date]['error'] += 1
+            elif status == 'dead_letter':
+                stats['dates'][item_date]['dead_letter'] += 1
         
         return stats
     except Exception as e:
@@ -598,6 +2105,7 @@ def get_webhook_stats(date=None):
             'pending': 0,
             'processed': 0,
             'error': 0,
+            'dead_letter': 0,
             'dates': {}
         }
 
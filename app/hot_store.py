@@ -0,0 +1,255 @@
+"""
+In-process hot store: recent alert occurrences in columnar, dictionary-encoded
+NumPy arrays, so summary and drill-down counts are vectorized group-bys
+instead of DynamoDB reads and Python loops.
+
+Each row is one or more occurrences of an alert: its account, service, region,
+resource, alert type and severity as int32 codes into per-column value lists,
+the occurrence time as int64 microseconds, the occurrence count and whether
+the row opened the alert. DynamoDB stays the
+source of truth: the store is loaded from the alerts table (see
+db.load_hot_store), appended to as alerts are committed in this process, and
+answers only queries that fall inside what it holds; callers read DynamoDB
+when it returns None.
+
+Optional: set HOT_STORE=1 to enable it; it needs numpy.
+"""
+
+import os
+import logging
+import threading
+from datetime import datetime, timedelta
+
+try:
+    import numpy as np
+except ImportError:  # the store stays disabled without numpy
+    np = None
+
+logger = logging.getLogger(__name__)
+
+HOT_STORE_ENABLED = os.environ.get("HOT_STORE", "0") == "1"
+
+# Days of occurrences held; 0 holds every alert, so all-time queries are answered too
+HOT_STORE_DAYS = int(os.environ.get("HOT_STORE_DAYS", "7"))
+
+# Reload from DynamoDB this often (0 never), for alerts committed by another
+# process such as app.process_queue
+HOT_STORE_REFRESH_SECONDS = int(os.environ.get("HOT_STORE_REFRESH_SECONDS", "0"))
+
+# Dictionary-encoded columns, named after the alert attributes they hold
+COLUMNS = ('account_id', 'service', 'region', 'resource_id', 'alert_type', 'severity')
+DEFAULTS = {'region': 'us-east-1', 'severity': 'medium'}
+SEVERITIES = ('medium', 'high', 'critical')
+
+INITIAL_CAPACITY = 1024
+EPOCH = datetime(1970, 1, 1)
+
+def to_micros(value):
+    """Naive local ISO timestamp or date as microseconds since the epoch, the way alerts store them"""
+    when = datetime.fromisoformat(value)
+    if when.tzinfo:
+        when = when.astimezone().replace(tzinfo=None)
+    return (when - EPOCH) // timedelta(microseconds=1)
+
+def until_micros(until):
+    """to_micros for an inclusive until; a bare date covers that whole day"""
+    if len(until) == 10:
+        until = f"{until}T23:59:59.999999"
+    return to_micros(until)
+
+def scanned(alert, timestamp, repeat_of, last_seen):
+    """Whether an occurrence added during a reload is already in the scanned alerts,
+    given {alert id: last_seen} of the scanned items: its alert was read, and
+    for a repeat, as seen at or after the repeat"""
+    alert_id = repeat_of or alert.get('id')
+    return alert_id in last_seen and (not repeat_of or last_seen[alert_id] >= timestamp)
+
+class HotStore:
+    def __init__(self, days=HOT_STORE_DAYS, enabled=HOT_STORE_ENABLED):
+        self.days = days
+        self.enabled = enabled and np is not None
+        if enabled and np is None:
+            logger.warning("HOT_STORE=1 but numpy is not installed; the hot store is disabled")
+        self._lock = threading.Lock()
+        self.loaded = False
+        # Rows added while a load is reading DynamoDB, replayed onto its result
+        self._loading = None
+        self._reset()
+
+    def _reset(self, start=None):
+        self._codes = {name: {} for name in COLUMNS}
+        self._values = {name: [] for name in COLUMNS}
+        self._size = 0
+        self.start = start
+        if self.enabled:
+            self._arrays = {name: np.zeros(INITIAL_CAPACITY, dtype=np.int32) for name in COLUMNS}
+            self._arrays['ts'] = np.zeros(INITIAL_CAPACITY, dtype=np.int64)
+            self._arrays['occurrences'] = np.zeros(INITIAL_CAPACITY, dtype=np.int32)
+            self._arrays['distinct'] = np.zeros(INITIAL_CAPACITY, dtype=np.int8)
+
+    def horizon(self, now=None):
+        """Earliest occurrence the store should hold, as an ISO timestamp (None: everything)"""
+        if not self.days:
+            return None
+        return ((now or datetime.now()) - timedelta(days=self.days)).isoformat()
+
+    def __len__(self):
+        return self._size
+
+    def begin_load(self):
+        """Start buffering added rows until load() replaces the contents"""
+        with self._lock:
+            self._loading = []
+
+    def load(self, alerts, start):
+        """Replace the contents with alerts (items read from DynamoDB since start).
+        Each alert's occurrences are counted at its timestamp."""
+        with self._lock:
+            pending, self._loading = self._loading or [], None
+            self._reset(start)
+            last_seen = {}
+            rows = []
+            for alert in alerts:
+                last_seen[alert['id']] = alert.get('last_seen') or alert['timestamp']
+                rows.append((alert, alert['timestamp'], int(alert.get('occurrence_count', 1)), None))
+            # Occurrences the scan already counted are not added twice
+            rows.extend(row for row in pending if not scanned(row[0], row[1], row[3], last_seen))
+            self._append(rows)
+            self.loaded = True
+        return self._size
+
+    def clear(self):
+        """Empty the store, e.g. after the alerts table is truncated"""
+        with self._lock:
+            self._reset(self.horizon())
+            if self._loading is not None:
+                self._loading = []
+
+    def add(self, occurrences):
+        """Add occurrences, an iterable of (alert, ISO timestamp, count, repeat_of),
+        where repeat_of is the id of the open alert a repeat was folded into"""
+        if not self.enabled:
+            return
+        rows = list(occurrences)
+        with self._lock:
+            if self._loading is not None:
+                self._loading.extend(rows)
+            elif self.loaded:
+                self._evict()
+                self._append(rows)
+
+    def _encode(self, name, value):
+        codes = self._codes[name]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self._values[name])
+            self._values[name].append(value)
+        return code
+
+    def _grow(self, size):
+        capacity = len(self._arrays['ts'])
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name, array in self._arrays.items():
+            grown = np.zeros(capacity, dtype=array.dtype)
+            grown[:self._size] = array[:self._size]
+            self._arrays[name] = grown
+
+    def _append(self, rows):
+        start = to_micros(self.start) if self.start else None
+        self._grow(self._size + len(rows))
+        arrays = self._arrays
+        i = self._size
+        for alert, timestamp, count, repeat_of in rows:
+            ts = to_micros(timestamp)
+            if start is not None and ts < start:
+                continue
+            for name in COLUMNS:
+                arrays[name][i] = self._encode(name, alert.get(name) or DEFAULTS.get(name, ''))
+            arrays['ts'][i] = ts
+            arrays['occurrences'][i] = count
+            arrays['distinct'][i] = 0 if repeat_of else 1
+            i += 1
+        self._size = i
+
+    def _evict(self, now=None):
+        """Drop rows older than the horizon, at most once an hour"""
+        horizon = self.horizon(now)
+        if not horizon or (self.start and horizon < (datetime.fromisoformat(self.start) + timedelta(hours=1)).isoformat()):
+            return
+        cutoff = to_micros(horizon)
+        keep = self._arrays['ts'][:self._size] >= cutoff
+        # New arrays rather than in place, so snapshots taken by queries stay valid
+        for name, array in self._arrays.items():
+            kept = array[:self._size][keep]
+            self._arrays[name] = np.zeros(max(INITIAL_CAPACITY, len(kept) * 2), dtype=array.dtype)
+            self._arrays[name][:len(kept)] = kept
+        self._size = int(keep.sum())
+        self.start = horizon
+
+    def covers(self, since=None):
+        """Whether the store holds every occurrence from since (None: all time) on"""
+        if not self.enabled or not self.loaded:
+            return False
+        if self.start is None:
+            return True
+        return since is not None and to_micros(since) >= to_micros(self.start)
+
+    def summarize(self, by, since=None, until=None, count_mode='occurrences', **filters):
+        """Alert counts grouped by the columns in by, or None if the store can't answer.
+
+        Counts the occurrences since/until, or with count_mode "distinct" the
+        alerts opened between them, as the alert counters do; filters are
+        column values to match. Rows have the by columns plus total/medium/
+        high/critical_alerts.
+        """
+        if not self.covers(since):
+            return None
+        with self._lock:
+            size = self._size
+            # Appends write past size and evictions swap in new arrays, so these views stay consistent
+            arrays = {name: array[:size] for name, array in self._arrays.items()}
+            values = {name: list(self._values[name]) for name in by}
+            filter_codes = {name: self._codes[name].get(value) for name, value in filters.items()}
+            severity_codes = {name: self._codes['severity'].get(name) for name in SEVERITIES}
+        if any(code is None for code in filter_codes.values()):
+            return []
+
+        mask = np.ones(size, dtype=bool)
+        for name, code in filter_codes.items():
+            mask &= arrays[name] == code
+        times = arrays['ts']
+        if since:
+            mask &= times >= to_micros(since)
+        if until:
+            mask &= times <= until_micros(until)
+        weights = (arrays['distinct'] if count_mode == 'distinct' else arrays['occurrences'])[mask].astype(np.int64)
+        if not len(weights):
+            return []
+
+        # One int64 key per row: the by codes in mixed radix
+        keys = np.zeros(len(weights), dtype=np.int64)
+        for name in by:
+            keys = keys * max(1, len(values[name])) + arrays[name][mask]
+        groups, inverse = np.unique(keys, return_inverse=True)
+        counts = {'total_alerts': np.bincount(inverse, weights=weights, minlength=len(groups))}
+        severities = arrays['severity'][mask]
+        for name, code in severity_codes.items():
+            counts[f"{name}_alerts"] = (np.bincount(inverse, weights=weights * (severities == code), minlength=len(groups))
+                                        if code is not None else np.zeros(len(groups)))
+
+        columns = {}
+        remaining = groups
+        for name in reversed(by):
+            cardinality = max(1, len(values[name]))
+            columns[name] = remaining % cardinality
+            remaining = remaining // cardinality
+        return [
+            {**{name: values[name][int(columns[name][i])] for name in by},
+             **{field: int(count[i]) for field, count in counts.items()}}
+            for i in range(len(groups))
+        ]
+
+hot_store = HotStore()
@@ -0,0 +1,78 @@
+"""
+Fast HTML-to-text conversion for alert email bodies
+"""
+
+import os
+import re
+from html import unescape
+
+# HTML read per body; anything after this is ignored
+HTML_TEXT_MAX_INPUT = int(os.environ.get("HTML_TEXT_MAX_INPUT", str(1024 * 1024)))
+
+# Text kept per body; tokenizing stops once this much has been produced
+HTML_TEXT_MAX_CHARS = int(os.environ.get("HTML_TEXT_MAX_CHARS", "20000"))
+
+# One token per match: a comment, a declaration/processing instruction, or a tag with its name
+_TOKEN = re.compile(r'<!--.*?(?:-->|$)|<[!?][^>]*>?|<(/?)([a-zA-Z][a-zA-Z0-9]*)[^>]*>?', re.S)
+
+# Elements whose contents are never text
+_SKIPPED = {'script', 'style', 'head', 'title', 'template', 'noscript'}
+
+# Elements that start a new line
+_BLOCKS = {
+    'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt', 'fieldset',
+    'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li',
+    'main', 'nav', 'ol', 'p', 'pre', 'section', 'table', 'tbody', 'thead', 'tfoot', 'tr', 'ul'
+}
+
+# Table cells are separated by a tab so label/value rows stay on one line
+_CELLS = {'td', 'th'}
+
+_SPACES = re.compile(r'[ \t\r\f\v\xa0]+')
+_BLANK_LINES = re.compile(r'[ \t]*\n[ \t\n]*')
+
+def html_to_text(html, max_chars=HTML_TEXT_MAX_CHARS, max_input=HTML_TEXT_MAX_INPUT):
+    """Plain text of an HTML body, up to max_chars.
+
+    Tokenizes the markup in a single pass, drops scripts, styles and
+    comments, breaks lines at block elements and decodes entities. Stops as
+    soon as max_chars of text have been produced, and reads no more than
+    max_input characters of HTML.
+    """
+    if not html:
+        return ''
+    html = html[:max_input]
+    parts = []
+    produced = 0
+    skip_until = None
+    pos = 0
+    for match in _TOKEN.finditer(html):
+        if skip_until is None and match.start() > pos:
+            text = _SPACES.sub(' ', unescape(html[pos:match.start()]).replace('\n', ' '))
+            parts.append(text)
+            produced += len(text)
+            if produced >= max_chars:
+                break
+        pos = match.end()
+
+        name = match.group(2)
+        if name is None:
+            continue
+        name = name.lower()
+        closing = match.group(1) == '/'
+        if skip_until is not None:
+            if closing and name == skip_until:
+                skip_until = None
+        elif name in _SKIPPED and not closing:
+            skip_until = name
+        elif name in _BLOCKS:
+            parts.append('\n')
+        elif name in _CELLS and not closing:
+            parts.append('\t')
+    else:
+        if skip_until is None and pos < len(html):
+            parts.append(_SPACES.sub(' ', unescape(html[pos:]).replace('\n', ' ')))
+
+    text = ''.join(parts).replace(' \t', '\t').replace('\t ', '\t')
+    text = _BLANK_LINES.sub('\n', text).strip()
+    return text[:max_chars]
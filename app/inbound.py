@@ -0,0 +1,234 @@
+"""
+Streaming parser for inbound webhook bodies: attachment contents are decoded
+straight into the blob store as the body arrives, so only the rest of the
+message (headers, subject, text) is held in memory
+"""
+
+import os
+import re
+import json
+import binascii
+from .payload_store import BlobWriter, delete_blob
+
+# Largest request body accepted, attachments included
+MAX_WEBHOOK_BODY_BYTES = int(os.environ.get("MAX_WEBHOOK_BODY_BYTES", str(50 * 1024 * 1024)))
+
+# Largest total of string data kept in memory (everything but attachment contents)
+MAX_WEBHOOK_INLINE_BYTES = int(os.environ.get("MAX_WEBHOOK_INLINE_BYTES", str(2 * 1024 * 1024)))
+
+_STRING_SPECIAL = re.compile(rb'["\\]')
+_SCALAR_END = re.compile(rb'[,\]}\s]')
+_WHITESPACE = b' \t\r\n'
+
+class PayloadTooLarge(ValueError):
+    """The body, or the part of it kept in memory, is over its limit"""
+
+class _Base64Sink:
+    """Decodes a JSON-escaped base64 string into a blob as it streams in"""
+
+    def __init__(self):
+        self.blob = BlobWriter()
+        self.remainder = b''
+
+    def write(self, raw):
+        # Base64 only needs "\/" unescaped; escaped line breaks are dropped
+        data = self.remainder + raw.replace(b'\\/', b'/').replace(b'\\n', b'').replace(b'\\r', b'')
+        usable = len(data) - len(data) % 4
+        self.remainder = data[usable:]
+        if usable:
+            self.blob.write(binascii.a2b_base64(data[:usable]))
+
+    def close(self):
+        if self.remainder:
+            self.blob.write(binascii.a2b_base64(self.remainder + b'=' * (-len(self.remainder) % 4)))
+        return self.blob.close(), self.blob.size
+
+    def abort(self):
+        self.blob.abort()
+
+class _Container:
+    __slots__ = ('value', 'key', 'expect')
+
+    def __init__(self, value, expect):
+        self.value = value
+        self.key = None  # object: key of the value being parsed
+        self.expect = expect
+
+class InboundParser:
+    """Incremental JSON parser; feed() it body chunks, then close() for the document.
+
+    Each Attachments[].Content string is base64-decoded into the blob store
+    while it is parsed and replaced by ContentRef (its digest) and
+    ContentSize; every other value is built as json.loads would.
+    """
+
+    def __init__(self, max_inline_bytes=MAX_WEBHOOK_INLINE_BYTES):
+        self.max_inline_bytes = max_inline_bytes
+        self.inline_bytes = 0
+        self.stack = []
+        self.result = None
+        self.done = False
+        self.string = None  # raw bytes of the open string, or a _Base64Sink
+        self.string_is_key = False
+        self.scalar = None  # raw bytes of an open number or literal
+        self.pending = b''  # a backslash held back until its escaped byte arrives
+        self.attachments = []  # (digest, size) of each stored attachment
+        self.created_blobs = []  # digests of the attachments stored as new blobs
+
+    def feed(self, chunk):
+        data = self.pending + chunk if self.pending else chunk
+        self.pending = b''
+        i = 0
+        n = len(data)
+        while i < n:
+            if self.string is not None:
+                match = _STRING_SPECIAL.search(data, i)
+                if match is None:
+                    self._string_bytes(data[i:])
+                    return
+                j = match.start()
+                if data[j] == 0x5c:  # backslash: keep an escape and its byte together
+                    if j + 1 == n:
+                        self._string_bytes(data[i:j])
+                        self.pending = data[j:]
+                        return
+                    self._string_bytes(data[i:j + 2])
+                    i = j + 2
+                else:
+                    self._string_bytes(data[i:j])
+                    self._end_string()
+                    i = j + 1
+            elif self.scalar is not None:
+                match = _SCALAR_END.search(data, i)
+                if match is None:
+                    self.scalar += data[i:]
+                    return
+                self.scalar += data[i:match.start()]
+                self._end_scalar()
+                i = match.start()
+            else:
+                c = data[i]
+                if c not in _WHITESPACE:
+                    self._token(c)
+                i += 1
+
+    def close(self):
+        """Finish parsing and return the document"""
+        if self.scalar is not None and not self.stack:
+            self._end_scalar()
+        if not self.done or self.string is not None or self.pending:
+            self.abort()
+            raise ValueError("Incomplete JSON body")
+        return self.result
+
+    def abort(self):
+        """Drop a partly streamed attachment"""
+        if isinstance(self.string, _Base64Sink):
+            self.string.abort()
+            self.string = None
+
+    def discard(self):
+        """Drop a partly streamed attachment and delete the blobs this body stored,
+        when the webhook is rejected; blobs that already existed are kept for
+        the webhooks that share them"""
+        self.abort()
+        for digest in self.created_blobs:
+            delete_blob(digest)
+        self.created_blobs = []
+
+    def _token(self, c):
+        top = self.stack[-1] if self.stack else None
+        if c == 0x22:  # "
+            if top is not None and top.expect in ('key', 'key_or_end'):
+                self._start_string(is_key=True)
+            else:
+                self._expect_value()
+                self._start_string(is_key=False)
+        elif c == 0x7b:  # {
+            self._expect_value()
+            self.stack.append(_Container({}, 'key_or_end'))
+        elif c == 0x5b:  # [
+            self._expect_value()
+            self.stack.append(_Container([], 'value_or_end'))
+        elif c in (0x7d, 0x5d):  # } ]
+            closes = dict if c == 0x7d else list
+            if top is None or not isinstance(top.value, closes) or top.expect not in ('comma_or_end', 'key_or_end', 'value_or_end'):
+                raise ValueError(f"Unexpected {chr(c)!r}")
+            self.stack.pop()
+            self._add_value(top.value)
+        elif c == 0x3a:  # :
+            if top is None or top.expect != 'colon':
+                raise ValueError("Unexpected ':'")
+            top.expect = 'value'
+        elif c == 0x2c:  # ,
+            if top is None or top.expect != 'comma_or_end':
+                raise ValueError("Unexpected ','")
+            top.expect = 'key' if isinstance(top.value, dict) else 'value'
+        elif c in b'-0123456789tfn':
+            self._expect_value()
+            self.scalar = bytearray([c])
+        else:
+            raise ValueError(f"Unexpected {chr(c)!r}")
+
+    def _expect_value(self):
+        if self.done:
+            raise ValueError("Data after the JSON document")
+        if self.stack and self.stack[-1].expect not in ('value', 'value_or_end'):
+            raise ValueError("Expected a key or separator")
+
+    def _in_attachment_content(self):
+        stack = self.stack
+        return (len(stack) == 3 and isinstance(stack[0].value, dict) and stack[0].key == 'Attachments'
+                and isinstance(stack[1].value, list) and isinstance(stack[2].value, dict)
+                and stack[2].key == 'Content')
+
+    def _start_string(self, is_key):
+        self.string_is_key = is_key
+        self.string = _Base64Sink() if not is_key and self._in_attachment_content() else bytearray()
+
+    def _string_bytes(self, raw):
+        if not raw:
+            return
+        if isinstance(self.string, _Base64Sink):
+            self.string.write(raw)
+            return
+        self.inline_bytes += len(raw)
+        if self.inline_bytes > self.max_inline_bytes:
+            raise PayloadTooLarge(f"More than {self.max_inline_bytes} bytes of non-attachment data")
+        self.string += raw
+
+    def _end_string(self):
+        string, self.string = self.string, None
+        if isinstance(string, _Base64Sink):
+            digest, size = string.close()
+            self.attachments.append((digest, size))
+            if string.blob.created:
+                self.created_blobs.append(digest)
+            top = self.stack[-1]
+            top.value['ContentSize'] = size
+            top.key = 'ContentRef'
+            self._add_value(digest)
+            return
+        value = json.loads(b'"' + bytes(string) + b'"')
+        if self.string_is_key:
+            top = self.stack[-1]
+            top.key = value
+            top.expect = 'colon'
+        else:
+            self._add_value(value)
+
+    def _end_scalar(self):
+        scalar, self.scalar = self.scalar, None
+        self._add_value(json.loads(bytes(scalar)))
+
+    def _add_value(self, value):
+        if not self.stack:
+            self.result = value
+            self.done = True
+            return
+        top = self.stack[-1]
+        if isinstance(top.value, dict):
+            top.value[top.key] = value
+        else:
+            top.value.append(value)
+        top.expect = 'comma_or_end'
@@ -0,0 +1,170 @@
+"""
+Background jobs for long admin operations, with progress, throughput and ETA
+"""
+
+import os
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Jobs run at the same time; the rest wait in the executor's queue
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+
+# Finished jobs kept for polling before the oldest are dropped
+MAX_FINISHED_JOBS = 100
+
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+class JobCancelled(Exception):
+    """Raised inside a job's work when cancellation was requested"""
+
+class Job:
+    """One submitted operation.
+
+    The work function is called as fn(job, *args) and reports progress with
+    set_total() and advance(); advance() raises JobCancelled once the job is
+    cancelled, so work stops at its next progress report. Whatever fn
+    returns becomes the job's result.
+    """
+
+    def __init__(self, kind, description=""):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.description = description
+        self.status = "queued"
+        self.total = None
+        self.done = 0
+        self.result = None
+        self.error = None
+        self.submitted_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self.started_clock = None
+        self.finished_clock = None
+        self.cancel_requested = threading.Event()
+        self.lock = threading.Lock()
+
+    def set_total(self, total):
+        with self.lock:
+            self.total = total
+
+    def advance(self, count=1):
+        """Record finished units of work; raises JobCancelled if the job was cancelled"""
+        with self.lock:
+            self.done += count
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        if self.cancel_requested.is_set():
+            raise JobCancelled()
+
+    def cancel(self):
+        """Ask the job to stop; queued jobs never start"""
+        self.cancel_requested.set()
+
+    def run(self, fn, args):
+        if self.cancel_requested.is_set():
+            self._finish("cancelled")
+            return
+        with self.lock:
+            self.status = "running"
+            self.started_at = datetime.now()
+            self.started_clock = time.monotonic()
+        try:
+            result = fn(self, *args)
+        except JobCancelled:
+            self._finish("cancelled")
+        except Exception as e:
+            logger.exception(f"Job {self.id} ({self.kind}) failed")
+            self._finish("failed", error=str(e))
+        else:
+            self._finish("succeeded", result=result)
+
+    def _finish(self, status, result=None, error=None):
+        with self.lock:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished_at = datetime.now()
+            self.finished_clock = time.monotonic()
+
+    def to_dict(self):
+        """Snapshot of the job with throughput and ETA"""
+        with self.lock:
+            elapsed = None
+            throughput = None
+            eta = None
+            if self.started_clock is not None:
+                elapsed = (self.finished_clock or time.monotonic()) - self.started_clock
+                if elapsed > 0 and self.done:
+                    throughput = self.done / elapsed
+                    if self.total is not None and self.status == "running":
+                        eta = max(0, self.total - self.done) / throughput
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "description": self.description,
+                "status": self.status,
+                "cancel_requested": self.cancel_requested.is_set(),
+                "total": self.total,
+                "done": self.done,
+                "percent": round(100 * self.done / self.total, 1) if self.total else None,
+                "elapsed_seconds": round(elapsed, 2) if elapsed is not None else None,
+                "items_per_second": round(throughput, 1) if throughput is not None else None,
+                "eta_seconds": round(eta, 1) if eta is not None else None,
+                "submitted_at": self.submitted_at.isoformat(),
+                "started_at": self.started_at.isoformat() if self.started_at else None,
+                "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+                "result": self.result,
+                "error": self.error
+            }
+
+class JobManager:
+    """Runs jobs on a background executor and keeps them for polling.
+
+    Jobs belong to this process: they outlive the request that submitted
+    them, but not a restart of the app.
+    """
+
+    def __init__(self, workers=JOB_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="job")
+        self.jobs = {}  # id -> Job, in submission order
+        self.lock = threading.Lock()
+
+    def submit(self, kind, fn, *args, description=""):
+        """Queue fn(job, *args) and return the job"""
+        job = Job(kind, description)
+        with self.lock:
+            self._prune()
+            self.jobs[job.id] = job
+        self.executor.submit(job.run, fn, args)
+        logger.info(f"Submitted job {job.id} ({kind})")
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        """Jobs, newest first"""
+        with self.lock:
+            return list(reversed(self.jobs.values()))
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+        return job
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in FINISHED_STATUSES]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+# Process-wide job manager used by the API
+job_manager = JobManager()
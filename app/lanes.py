@@ -0,0 +1,52 @@
+"""
+Hash-partitioned processing lanes: work for one key always runs on the same
+lane, in submission order, while different lanes run in parallel
+"""
+
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from .correlation import Correlator
+
+# Default number of lanes
+PROCESSING_LANES = int(os.environ.get("PROCESSING_LANES", str(os.cpu_count() or 4)))
+
+class Lane:
+    """A single worker thread plus the caches only it touches"""
+
+    def __init__(self, index):
+        self.index = index
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"lane-{index}")
+        self.correlator = Correlator()
+
+class LanePool:
+    """Routes work to lanes by a stable hash of its partition key"""
+
+    def __init__(self, lanes=PROCESSING_LANES):
+        self.lanes = [Lane(i) for i in range(max(1, lanes))]
+
+    def lane_for(self, key):
+        # crc32 rather than hash() so the mapping is the same in every process
+        return self.lanes[zlib.crc32(key.encode('utf-8')) % len(self.lanes)]
+
+    def submit(self, key, fn, *args):
+        """Run fn(lane, *args) on the lane for key; returns a Future"""
+        lane = self.lane_for(key)
+        return lane.executor.submit(fn, lane, *args)
+
+    def run_partitioned(self, keyed_items, fn):
+        """Split (key, item) pairs by lane and run fn(lane, items) on each lane.
+
+        Items keep their relative order within a lane. Blocks until every
+        lane is done and returns the results in lane order.
+        """
+        partitions = {}
+        for key, item in keyed_items:
+            partitions.setdefault(self.lane_for(key).index, []).append(item)
+        futures = [self.lanes[index].executor.submit(fn, self.lanes[index], items)
+                   for index, items in sorted(partitions.items())]
+        return [future.result() for future in futures]
+
+    def shutdown(self, wait=True):
+        for lane in self.lanes:
+            lane.executor.shutdown(wait=wait)
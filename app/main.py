@@ -1,4 +1,5 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
@@ -6,11 +7,17 @@ import logging
 import os
 import json
 import uuid
+import time
+import threading
 from datetime import datetime
 from . import db
-from .models import AlertSummary, ResourceSummary, AlertTypeSummary
+from .hot_store import hot_store, HOT_STORE_REFRESH_SECONDS
+from .alert_cube import alert_cube, ALERT_CUBE_SNAPSHOT_SECONDS, ALERT_CUBE_REFRESH_SECONDS
+from .webhook_processor import classify_priority
+from .inbound import InboundParser, PayloadTooLarge, MAX_WEBHOOK_BODY_BYTES
+from .models import AlertSummary, ResourceSummary, AlertTypeSummary, CountMode
 # Import routes after fixing the syntax issues
-from .routes import webhook_routes, queue_dashboard, webhook_api, process_routes, data_routes, settings_routes, settings_api
+from .routes import webhook_routes, queue_dashboard, webhook_api, process_routes, data_routes, settings_routes, settings_api, jobs_api, timeseries_api, cube_api
 
 # Configure logging
 logging.basicConfig(
@@ -39,6 +46,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Include routes
@@ -49,6 +57,44 @@ app.include_router(process_routes.router)
 app.include_router(data_routes.router)
 app.include_router(settings_routes.router)
 app.include_router(settings_api.router)
+app.include_router(jobs_api.router)
+app.include_router(timeseries_api.router)
+app.include_router(cube_api.router)
+
+def keep_hot_store_loaded():
+    """Load the hot store from DynamoDB, then reload it every HOT_STORE_REFRESH_SECONDS if set"""
+    while True:
+        try:
+            db.load_hot_store()
+        except Exception as e:
+            logger.warning(f"Failed to load the hot store: {e}")
+        if not HOT_STORE_REFRESH_SECONDS:
+            return
+        time.sleep(HOT_STORE_REFRESH_SECONDS)
+
+def keep_alert_cube_current():
+    """Serve the alert cube from its snapshot, rebuild it from DynamoDB, then snapshot
+    it every ALERT_CUBE_SNAPSHOT_SECONDS and rebuild it every ALERT_CUBE_REFRESH_SECONDS if set"""
+    try:
+        if alert_cube.load_snapshot():
+            logger.info("Loaded the alert cube snapshot")
+    except Exception as e:
+        logger.warning(f"Failed to load the alert cube snapshot: {e}")
+    built_at = None
+    while True:
+        if built_at is None or (ALERT_CUBE_REFRESH_SECONDS and time.time() - built_at >= ALERT_CUBE_REFRESH_SECONDS):
+            try:
+                db.build_alert_cube()
+            except Exception as e:
+                logger.warning(f"Failed to build the alert cube: {e}")
+            built_at = time.time()
+        try:
+            alert_cube.save_snapshot()
+        except Exception as e:
+            logger.warning(f"Failed to snapshot the alert cube: {e}")
+        if not ALERT_CUBE_SNAPSHOT_SECONDS and not ALERT_CUBE_REFRESH_SECONDS:
+            return
+        time.sleep(min(seconds for seconds in (ALERT_CUBE_SNAPSHOT_SECONDS, ALERT_CUBE_REFRESH_SECONDS) if seconds))
 
 # Initialize database on startup
 @app.on_event("startup")
@@ -65,10 +111,21 @@ async def startup_event():
         # Comment out the seed_sample_data call if you're using the external seed_data.py script
         # db.seed_sample_data()
         logger.info("Database initialization complete")
+        # Reads fall back to DynamoDB until the hot store and alert cube are loaded
+        if hot_store.enabled:
+            threading.Thread(target=keep_hot_store_loaded, name="hot-store", daemon=True).start()
+        if alert_cube.enabled:
+            threading.Thread(target=keep_alert_cube_current, name="alert-cube", daemon=True).start()
     except Exception as e:
         logger.error(f"Error initializing database: {e}")
         # Continue anyway - might be using AWS DynamoDB
 
+@app.on_event("shutdown")
+def shutdown_event():
+    """Snapshot the alert cube so the next start serves it straight away"""
+    if alert_cube.enabled:
+        alert_cube.save_snapshot()
+
 # API Routes
 @app.get("/", response_class=HTMLResponse)
 async def get_dashboard():
@@ -140,6 +197,18 @@ async def get_dashboard():
         </div>
         
         <script>
+            // Poll a background job until it finishes
+            function waitForJob(jobId) {
+                return fetch(`/api/jobs/${jobId}`)
+                    .then(response => response.json())
+                    .then(job => {
+                        if (['succeeded', 'failed', 'cancelled'].includes(job.status)) {
+                            return job;
+                        }
+                        return new Promise(resolve => setTimeout(resolve, 1000)).then(() => waitForJob(jobId));
+                    });
+            }
+            
             function loadSampleAlerts() {
                 if (confirm('Load sample alert data? This will replace any existing alerts.')) {
                     fetch('/api/data/seed/alerts', {
@@ -149,8 +218,9 @@ async def get_dashboard():
                         }
                     })
                     .then(response => response.json())
-                    .then(data => {
-                        alert(data.message);
+                    .then(data => waitForJob(data.job_id))
+                    .then(job => {
+                        alert(job.status === 'succeeded' ? job.result.message : `Job ${job.status}: ${job.error || ''}`);
                         // Reload the page to show updated data
                         window.location.reload();
                     })
@@ -170,8 +240,9 @@ async def get_dashboard():
                         }
                     })
                     .then(response => response.json())
-                    .then(data => {
-                        alert(data.message);
+                    .then(data => waitForJob(data.job_id))
+                    .then(job => {
+                        alert(job.status === 'succeeded' ? job.result.message : `Job ${job.status}: ${job.error || ''}`);
                         // Reload the page to show updated data
                         window.location.reload();
                     })
@@ -210,6 +281,12 @@ async def get_dashboard():
                 <canvas id="severityChart"></canvas>
             </div>
         </div>
+        <div class="chart-container">
+            <div class="chart-box">
+                <div class="chart-title">Alert Rate <span id="trend-resolution"></span></div>
+                <canvas id="trendChart"></canvas>
+            </div>
+        </div>
         
         <h2>Account & Service Summary</h2>
         <div class="filter-controls">
@@ -231,6 +308,22 @@ async def get_dashboard():
                     <option value="all">All Regions</option>
                 </select>
             </div>
+            <div class="filter-group">
+                <label for="count-mode">Count:</label>
+                <select id="count-mode">
+                    <option value="occurrences">All Occurrences</option>
+                    <option value="distinct">Distinct Alerts</option>
+                </select>
+            </div>
+            <div class="filter-group">
+                <label for="time-window">Window:</label>
+                <select id="time-window">
+                    <option value="">All Time</option>
+                    <option value="1h">Last Hour</option>
+                    <option value="24h">Last 24 Hours</option>
+                    <option value="7d">Last 7 Days</option>
+                </select>
+            </div>
         </div>
         <table id="summary-table">
             <thead>
@@ -301,7 +394,7 @@ async def get_dashboard():
             
             // Function to show all alerts of a specific severity
             function showAllSeverityAlerts(severity) {
-                fetch(`/api/summary/${severity}`)
+                fetch(`/api/summary/${severity}` + (timeWindow() ? `?window=${timeWindow()}` : ''))
                     .then(response => response.json())
                     .then(data => {
                         if (data.length === 0) {
@@ -330,6 +423,7 @@ async def get_dashboard():
                                             <p><strong>Resource:</strong> ${alert.resource_id}</p>
                                             <p><strong>Alert Type:</strong> ${alert.alert_type}</p>
                                             <p><strong>Timestamp:</strong> ${timestamp}</p>
+                                            ${alert.occurrence_count > 1 ? `<p><strong>Occurrences:</strong> ${alert.occurrence_count} (last seen ${new Date(alert.last_seen).toLocaleString()})</p>` : ''}
                                             <p><strong>Message:</strong> ${alert.message}</p>
                                             <div class="remediation">
                                                 <h4>Recommended Action:</h4>
@@ -371,6 +465,7 @@ async def get_dashboard():
                                         <p><strong>Resource:</strong> ${alert.resource_id}</p>
                                         <p><strong>Alert Type:</strong> ${alert.alert_type}</p>
                                         <p><strong>Timestamp:</strong> ${timestamp}</p>
+                                        ${alert.occurrence_count > 1 ? `<p><strong>Occurrences:</strong> ${alert.occurrence_count} (last seen ${new Date(alert.last_seen).toLocaleString()})</p>` : ''}
                                         <p><strong>Message:</strong> ${alert.message}</p>
                                         <div class="remediation">
                                             <h4>Recommended Action:</h4>
@@ -412,6 +507,33 @@ async def get_dashboard():
             let currentSortField = 'account';
             let currentSortOrder = 'asc';
             
+            // Count every occurrence of a repeating alert, or each alert once
+            function countMode() {
+                return document.getElementById('count-mode').value;
+            }
+            
+            // Recent window to count (1h, 24h, 7d), or '' for all time
+            function timeWindow() {
+                return document.getElementById('time-window').value;
+            }
+            
+            // Count mode and time window query parameters for the summary and drill-downs
+            function countQuery() {
+                return `count=${countMode()}` + (timeWindow() ? `&window=${timeWindow()}` : '');
+            }
+            
+            // Reload the summary when switching between occurrences and distinct alerts
+            function reloadSummary() {
+                document.getElementById('details').style.display = 'none';
+                document.getElementById('resource-details').style.display = 'none';
+                fetch(`/api/summary?${countQuery()}`)
+                    .then(response => response.json())
+                    .then(data => {
+                        summaryData = data;
+                        applyFilters();
+                    });
+            }
+            
             // Function to initialize charts
             function initializeCharts(data) {
                 // Process data for charts
@@ -531,6 +653,56 @@ async def get_dashboard():
                 window.severityChart = severityChart;
             }
             
+            // Alert rate over the selected window (24 hours for all time) from the server-side
+            // time series, for the selected service, or else account
+            function loadTrendChart() {
+                const service = document.getElementById('service-filter').value;
+                const account = document.getElementById('account-filter').value;
+                let url = `/api/timeseries?window=${timeWindow() || '24h'}`;
+                if (service !== 'all') {
+                    url += `&service=${encodeURIComponent(service)}`;
+                } else if (account !== 'all') {
+                    url += `&account=${encodeURIComponent(account)}`;
+                }
+                fetch(url)
+                    .then(response => response.json())
+                    .then(data => {
+                        const labels = data.points.map(point => point.time.replace('T', ' ').slice(0, 16));
+                        const datasets = [
+                            ['Medium', 'medium_alerts', 'rgba(255, 206, 86, 0.6)'],
+                            ['High', 'high_alerts', 'rgba(255, 159, 64, 0.6)'],
+                            ['Critical', 'critical_alerts', 'rgba(255, 99, 132, 0.6)']
+                        ].map(([label, field, color]) => ({
+                            label: label,
+                            data: data.points.map(point => point[field]),
+                            backgroundColor: color,
+                            borderColor: color,
+                            fill: true,
+                            pointRadius: 0
+                        }));
+                        document.getElementById('trend-resolution').textContent =
+                            `(per ${data.step_seconds >= 3600 ? data.step_seconds / 3600 + 'h' : data.step_seconds / 60 + 'm'})`;
+                        if (window.trendChart) {
+                            window.trendChart.data.labels = labels;
+                            window.trendChart.data.datasets = datasets;
+                            window.trendChart.update();
+                            return;
+                        }
+                        window.trendChart = new Chart(document.getElementById('trendChart').getContext('2d'), {
+                            type: 'line',
+                            data: { labels: labels, datasets: datasets },
+                            options: {
+                                responsive: true,
+                                maintainAspectRatio: false,
+                                scales: {
+                                    x: { ticks: { maxTicksLimit: 12 } },
+                                    y: { beginAtZero: true, stacked: true }
+                                }
+                            }
+                        });
+                    });
+            }
+            
             // Function to update charts when filters change
             function updateCharts(data) {
                 if (!window.serviceChart || !window.severityChart) {
@@ -574,7 +746,7 @@ async def get_dashboard():
             }
             
             // Load summary data
-            fetch('/api/summary')
+            fetch(`/api/summary?${countQuery()}`)
                 .then(response => response.json())
                 .then(data => {
                     console.log("Received data:", data); // Debug log
@@ -622,6 +794,11 @@ async def get_dashboard():
                     document.getElementById('account-filter').addEventListener('change', applyFilters);
                     document.getElementById('service-filter').addEventListener('change', applyFilters);
                     document.getElementById('region-filter').addEventListener('change', applyFilters);
+                    document.getElementById('count-mode').addEventListener('change', reloadSummary);
+                    document.getElementById('time-window').addEventListener('change', reloadSummary);
+                    ['account-filter', 'service-filter', 'time-window'].forEach(id =>
+                        document.getElementById(id).addEventListener('change', loadTrendChart));
+                    loadTrendChart();
                     
                     // Add click handlers for table headers
                     document.querySelectorAll('#summary-table th[data-sort]').forEach(header => {
@@ -808,9 +985,9 @@ async def get_dashboard():
                 }
                 document.getElementById('service-title').textContent = title;
                 
-                let url = `/api/service/${accountId}/${service}`;
+                let url = `/api/service/${accountId}/${service}?${countQuery()}`;
                 if (region) {
-                    url += `?region=${region}`;
+                    url += `&region=${region}`;
                 }
                 
                 fetch(url)
@@ -888,7 +1065,7 @@ async def get_dashboard():
                 document.getElementById('resource-title').textContent = `Alert Types for Resource ${resourceId}`;
                 currentResourceId = resourceId;
                 
-                fetch(`/api/resource/${resourceId}`)
+                fetch(`/api/resource/${resourceId}?${countQuery()}`)
                     .then(response => response.json())
                     .then(data => {
                         const tbody = document.getElementById('alerts-body');
@@ -965,6 +1142,7 @@ async def get_dashboard():
                                         <p><strong>Alert ID:</strong> ${alert.id}</p>
                                         <p><strong>Service:</strong> ${alert.service}</p>
                                         <p><strong>Timestamp:</strong> ${timestamp}</p>
+                                        ${alert.occurrence_count > 1 ? `<p><strong>Occurrences:</strong> ${alert.occurrence_count} (last seen ${new Date(alert.last_seen).toLocaleString()})</p>` : ''}
                                         <p><strong>Message:</strong> ${alert.message}</p>
                                         <div class="remediation">
                                             <h4>Recommended Action:</h4>
@@ -993,26 +1171,50 @@ async def get_dashboard():
     html_content = html_content.replace("WEBHOOK_URL_PLACEHOLDER", webhook_url)
     return html_content
 
+def _window_start(window):
+    """Start of a window parameter such as 1h, 24h or 7d, or None without one; 400 if it's invalid"""
+    if not window:
+        return None
+    try:
+        return db.window_since(window)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/api/summary", response_model=list[AlertSummary])
-async def get_summary():
-    """Get summary of alerts by account and service"""
+async def get_summary(count: CountMode = CountMode.OCCURRENCES, window: str = None, since: str = None):
+    """Get summary of alerts by account and service, counting occurrences or distinct alerts.
+    
+    window (e.g. 1h, 24h, 7d) or since limits it to recent occurrences,
+    summed from hourly counters.
+    """
+    since = _window_start(window) or since
     try:
-        logger.info("Fetching account and service summary")
-        result = db.get_account_service_summary()
+        logger.info(f"Fetching account and service summary ({count.value})")
+        result = db.get_account_service_summary(count.value, since)
         logger.info(f"Summary data count: {len(result)}")
         return result
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error fetching summary: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/service/{account_id}/{service}", response_model=list[ResourceSummary])
-async def get_service_resources(account_id: str, service: str, region: str = None):
-    """Get resources for a specific account and service with alert counts"""
+async def get_service_resources(account_id: str, service: str, region: str = None, count: CountMode = CountMode.OCCURRENCES,
+                                since: str = None, until: str = None, window: str = None):
+    """Get resources for a specific account and service with alert counts.
+    
+    window (e.g. 24h), or since and optionally until, counts only the
+    occurrences in that range, from hourly counters.
+    """
+    since = _window_start(window) or since
     try:
         logger.info(f"Fetching resources for account {account_id}, service {service}, region {region}")
-        result = db.get_service_resources(account_id, service, region)
+        result = db.get_service_resources(account_id, service, region, count.value, since, until)
         logger.info(f"Found {len(result)} resources")
         return result
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error fetching service resources: {e}")
         # Return a default item instead of raising an exception
@@ -1027,41 +1229,71 @@ async def get_service_resources(account_id: str, service: str, region: str = Non
         }]
 
 @app.get("/api/summary/{severity}")
-async def get_summary_by_severity(severity: str):
-    """Get all alerts of a specific severity across all accounts and services"""
+async def get_summary_by_severity(severity: str, window: str = None, since: str = None):
+    """Get all alerts of a specific severity across all accounts and services, or with window (e.g. 24h) or since, those seen in it"""
+    since = _window_start(window) or since
     try:
         logger.info(f"Fetching all {severity} alerts")
-        return db.get_alerts_by_severity(severity)
+        return db.get_alerts_by_severity(severity, since)
     except Exception as e:
         logger.error(f"Error fetching alerts by severity: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/resource/{resource_id}", response_model=list[AlertTypeSummary])
-async def get_resource_alerts(resource_id: str):
-    """Get alert types and counts for a specific resource"""
+async def get_resource_alerts(resource_id: str, count: CountMode = CountMode.OCCURRENCES, since: str = None, until: str = None,
+                              window: str = None):
+    """Get alert types and counts for a specific resource; since, until and window as for service resources"""
+    since = _window_start(window) or since
     try:
         logger.info(f"Fetching alerts for resource {resource_id}")
-        return db.get_resource_alerts(resource_id)
+        return db.get_resource_alerts(resource_id, count.value, since, until)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error fetching resource alerts: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _alert_page(response, limit, read):
+    """Run read() for a page of alerts, returning the alerts and putting the
+    next page's cursor, if any, in the X-Next-Cursor header"""
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be at least 1")
+    try:
+        items, next_cursor = read()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return items
+
 @app.get("/api/alerts/{resource_id}/{alert_type}/{severity}")
-async def get_alert_details(resource_id: str, alert_type: str, severity: str):
-    """Get detailed information about specific alerts including remediation actions"""
+async def get_alert_details(resource_id: str, alert_type: str, severity: str, response: Response, since: str = None,
+                            until: str = None, limit: int = None, cursor: str = None):
+    """Get detailed information about specific alerts including remediation actions, most recently seen first.
+    
+    since/until keep the alerts with an occurrence between them; with
+    limit, the X-Next-Cursor header holds the cursor for the next page.
+    """
     try:
         logger.info(f"Fetching alert details for resource {resource_id}, type {alert_type}, severity {severity}")
-        return db.get_alert_details(resource_id, alert_type, severity)
+        return _alert_page(response, limit, lambda: db.get_alert_details(resource_id, alert_type, severity,
+                                                                          since, until, limit, cursor))
     except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
         logger.error(f"Error fetching alert details: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/alerts/filtered")
-async def get_filtered_alerts(account: str, service: str, region: str, severity: str):
-    """Get alerts filtered by account, service, region and severity"""
+async def get_filtered_alerts(account: str, service: str, region: str, severity: str, response: Response,
+                              since: str = None, until: str = None, limit: int = None, cursor: str = None):
+    """Get alerts filtered by account, service, region and severity, most recently seen first; paged like alert details"""
     try:
         logger.info(f"Fetching filtered alerts for account {account}, service {service}, region {region}, severity {severity}")
-        return db.get_filtered_alerts(account, service, region, severity)
+        return _alert_page(response, limit, lambda: db.get_filtered_alerts(account, service, region, severity,
+                                                                            since, until, limit, cursor))
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching filtered alerts: {e}")
         return []
@@ -1069,9 +1301,23 @@ async def get_filtered_alerts(account: str, service: str, region: str, severity:
 @app.post("/api/webhook")
 async def webhook_handler(request: Request):
     """Handle inbound webhook from Postmark"""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_WEBHOOK_BODY_BYTES:
+        raise HTTPException(status_code=413, detail=f"Webhook body is larger than {MAX_WEBHOOK_BODY_BYTES} bytes")
+    
+    parser = InboundParser()
+    stored = False
     try:
-        data = await request.json()
-        logger.info(f"Received webhook data: {data}")
+        # Parse the body as it arrives so attachments go straight to the blob store;
+        # decoding, hashing and blob writes run off the event loop
+        received = 0
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > MAX_WEBHOOK_BODY_BYTES:
+                raise PayloadTooLarge(f"Webhook body is larger than {MAX_WEBHOOK_BODY_BYTES} bytes")
+            await run_in_threadpool(parser.feed, chunk)
+        data = await run_in_threadpool(parser.close)
+        logger.info(f"Received webhook ({received} bytes, {len(parser.attachments)} attachments): {data.get('Subject') if isinstance(data, dict) else None}")
         
         # Store the webhook data in a single table
         webhook_id = str(uuid.uuid4())
@@ -1079,7 +1325,10 @@ async def webhook_handler(request: Request):
         current_date = current_time.strftime("%Y-%m-%d")
         timestamp_iso = current_time.isoformat()
         
-        # Create queue item with pending status and raw data
+        # Pre-classify so critical alerts are picked up first during a backlog
+        priority = classify_priority(data)
+        
+        # Create queue item with pending status; the raw data is stored as its payload
         queue_item = {
             "id": webhook_id,
             "timestamp": timestamp_iso,
@@ -1087,13 +1336,13 @@ async def webhook_handler(request: Request):
             "status": "pending",
             "source": "postmark",
             "processed_at": None,
-            "raw_data": data  # Include raw data directly in the queue item
+            "attempts": 0,
+            **db.pending_schedule(webhook_id, priority, timestamp_iso)
         }
         
-        # Save to queue table
-        dynamodb = db.get_dynamodb_client()
-        queue_table = dynamodb.Table('webhook_queue')
-        queue_table.put_item(Item=queue_item)
+        # Save the payload and the queue item
+        await run_in_threadpool(db.put_webhook, queue_item, data)
+        stored = True
         logger.info(f"Created queue item with pending status: {webhook_id}")
         
         # Process the webhook immediately in the background
@@ -1120,13 +1369,16 @@ async def webhook_handler(request: Request):
             "message": "Webhook received and processing started", 
             "webhook_id": webhook_id
         }
+    except PayloadTooLarge as e:
+        parser.discard()
+        logger.warning(f"Rejected webhook: {str(e)}")
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
+        # Attachments stored before the error belong to no queue item
+        if not stored:
+            parser.discard()
         logger.error(f"Error handling webhook: {str(e)}")
         return {"status": "error", "message": str(e)}
-        
-    except Exception as e:
-        logger.error(f"Error processing webhook: {e}")
-        return {"status": "error", "message": str(e)}
 
 if __name__ == "__main__":
     import uvicorn
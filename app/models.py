@@ -8,6 +8,10 @@ class SeverityLevel(str, Enum):
     HIGH = "high"
     CRITICAL = "critical"
 
+class CountMode(str, Enum):
+    OCCURRENCES = "occurrences"  # every notification, including correlated repeats
+    DISTINCT = "distinct"  # each alert once
+
 class Alert(BaseModel):
     id: str
     account_id: str
@@ -17,6 +21,8 @@ class Alert(BaseModel):
     severity: SeverityLevel
     timestamp: datetime
     message: Optional[str] = None
+    last_seen: Optional[datetime] = None
+    occurrence_count: int = 1
     region: str = "us-east-1"
 
 class AlertDetail(BaseModel):
@@ -29,6 +35,8 @@ class AlertDetail(BaseModel):
     timestamp: datetime
     message: Optional[str] = None
     remediation: Optional[str] = None
+    last_seen: Optional[datetime] = None
+    occurrence_count: int = 1
     region: str = "us-east-1"
 
 class AlertSummary(BaseModel):
@@ -54,4 +62,17 @@ class AlertTypeSummary(BaseModel):
     total_alerts: int
     medium_alerts: int = 0
     high_alerts: int = 0
-    critical_alerts: int = 0
\ No newline at end of file
+    critical_alerts: int = 0
+
+class WebhookBatchGetRequest(BaseModel):
+    ids: List[str]
+    fields: Optional[List[str]] = None  # attributes to return; all when omitted
+
+class WebhookReprocessRequest(BaseModel):
+    ids: Optional[List[str]] = None  # reprocess exactly these; the filters are ignored
+    status: Optional[str] = None
+    date_from: Optional[str] = None  # YYYY-MM-DD, inclusive
+    date_to: Optional[str] = None  # YYYY-MM-DD, inclusive
+    source: Optional[str] = None
+    error_contains: Optional[str] = None
+    process: bool = True  # process each batch right away instead of leaving it to the queue consumer
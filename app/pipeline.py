@@ -0,0 +1,106 @@
+"""
+Batch pipeline engine: runs work items through named, individually timed stages
+"""
+
+import time
+import threading
+
+class Stage:
+    """A named, batch-capable step.
+
+    fn(contexts, lane) updates the per-item context dicts in place; lane is
+    None for stages that run on the whole batch, or when no lanes are used.
+    Lane-local stages run per lane, on that lane's share of the batch.
+    """
+
+    def __init__(self, name, fn, lane_local=False):
+        self.name = name
+        self.fn = fn
+        self.lane_local = lane_local
+
+class Pipeline:
+    """Runs batches of contexts through a sequence of stages.
+
+    Each context is a dict with at least an 'id'. A stage marks items it
+    finishes early by setting 'outcome' (later stages skip those), and
+    routes items to lanes by setting 'key'. Stages up to the first
+    lane-local one run on the whole batch in the caller; the rest run on
+    each lane's partition, in order. on_error(stage_name, contexts, error)
+    is called with the items a raising stage errored.
+    """
+
+    def __init__(self, stages, on_error=None):
+        self.stages = stages
+        self.on_error = on_error
+        self.batch_stages = []
+        self.lane_stages = []
+        for stage in stages:
+            if stage.lane_local or self.lane_stages:
+                self.lane_stages.append(stage)
+            else:
+                self.batch_stages.append(stage)
+        self.started_at = time.monotonic()
+        self.counters_lock = threading.Lock()
+        self.counters = {stage.name: {"batches": 0, "items": 0, "errors": 0, "seconds": 0.0} for stage in stages}
+
+    def run_stage(self, stage, contexts, lane=None):
+        """Run one stage and record its latency; a failing stage errors its pending items"""
+        errors_before = sum(1 for context in contexts if context.get('outcome') == 'error')
+        start = time.perf_counter()
+        try:
+            stage.fn(contexts, lane)
+        except Exception as e:
+            failed = [context for context in contexts if context.get('outcome') is None]
+            for context in failed:
+                context['outcome'] = 'error'
+                context['reason'] = f"{stage.name} stage failed: {e}"
+            if self.on_error and failed:
+                self.on_error(stage.name, failed, e)
+        elapsed = time.perf_counter() - start
+        errors = sum(1 for context in contexts if context.get('outcome') == 'error') - errors_before
+
+        with self.counters_lock:
+            counters = self.counters[stage.name]
+            counters["batches"] += 1
+            counters["items"] += len(contexts)
+            counters["errors"] += errors
+            counters["seconds"] += elapsed
+
+    def _run_lane(self, lane, contexts):
+        for stage in self.lane_stages:
+            self.run_stage(stage, contexts, lane)
+        return contexts
+
+    def run(self, contexts, lanes=None):
+        """Run contexts through every stage and return them"""
+        if not contexts:
+            return contexts
+        for stage in self.batch_stages:
+            self.run_stage(stage, contexts)
+        if lanes is None:
+            self._run_lane(None, contexts)
+        else:
+            lanes.run_partitioned([(context.get('key') or context['id'], context) for context in contexts],
+                                  self._run_lane)
+        return contexts
+
+    def stats(self):
+        """Per-stage counters with average latency and throughput"""
+        with self.counters_lock:
+            counters = {name: dict(values) for name, values in self.counters.items()}
+        result = {}
+        for stage in self.stages:
+            values = counters[stage.name]
+            seconds = values["seconds"]
+            result[stage.name] = {
+                "batches": values["batches"],
+                "items": values["items"],
+                "errors": values["errors"],
+                "seconds": round(seconds, 3),
+                "avg_ms_per_item": round(1000 * seconds / values["items"], 3) if values["items"] else 0.0,
+                "items_per_second": round(values["items"] / seconds, 1) if seconds else 0.0
+            }
+        return {
+            "uptime_seconds": round(time.monotonic() - self.started_at, 1),
+            "stages": result
+        }
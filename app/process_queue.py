@@ -1,14 +1,30 @@
 #!/usr/bin/env python3
 """
-Script to process the webhook queue items.
-This can be run as a scheduled task or triggered manually.
+Long-running consumer for the webhook queue.
+
+Polls the pending index, processes batches on hash-partitioned lanes (events
+for one account/resource stay in order on one lane) and adapts both
+the polling interval (backs off while idle, drains immediately while busy)
+and the batch size (grows while batches finish well inside the latency
+target, shrinks when they overrun it). SIGINT/SIGTERM stop the loop after
+the in-flight batch has finished.
+
+Usage:
+    python -m app.process_queue --workers 4 --batch-size 25
+    python -m app.process_queue --once
 """
 
 import os
+import json
 import time
+import signal
+import argparse
+import threading
 from datetime import datetime
 import logging
 from app import db
+from app.lanes import LanePool
+from app.webhook_processor import ensure_alerts_table, process_webhook_batch, throttle, webhook_pipeline
 
 # Configure logging
 logging.basicConfig(
@@ -17,69 +33,243 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def process_queue_item(item):
-    """Process a single webhook queue item"""
-    try:
-        webhook_id = item['id']
-        raw_data = item['raw_data']
-        logger.info(f"Processing webhook queue item: {webhook_id}")
-        
-        # Here you can implement more sophisticated processing logic
-        # For example, you might:
-        # - Extract different types of data based on webhook content
-        # - Create different types of alerts
-        # - Trigger notifications
-        # - Perform additional validation
-        
-        # For now, we'll just mark it as processed if it wasn't already
-        if item['status'] == 'pending':
-            db.update_webhook_status(webhook_id, 'processed')
-            logger.info(f"Marked webhook {webhook_id} as processed")
-        
-        return True
-    except Exception as e:
-        logger.error(f"Error processing webhook {item.get('id', 'unknown')}: {e}")
-        # Mark as error
-        if 'id' in item:
-            db.update_webhook_status(item['id'], 'error', str(e))
-        return False
-
-def process_queue(batch_size=10, sleep_seconds=1):
-    """Process pending items in the webhook queue"""
-    logger.info("Starting webhook queue processing")
-    
-    # Set AWS environment variables for DynamoDB Local if not set
+# Where the consumer publishes its status (lag, throughput, batch size)
+STATUS_FILE = os.environ.get("QUEUE_CONSUMER_STATUS_FILE", "/tmp/alert-insight-hub-consumer.json")
+
+def use_local_dynamodb_defaults():
+    """Set AWS environment variables for DynamoDB Local if not set"""
     if "AWS_ENDPOINT_URL" not in os.environ:
         os.environ["AWS_ENDPOINT_URL"] = "http://localhost:8001"
         os.environ["AWS_DEFAULT_REGION"] = "us-east-1"
         os.environ["AWS_ACCESS_KEY_ID"] = "fakeAccessKeyId"
         os.environ["AWS_SECRET_ACCESS_KEY"] = "fakeSecretAccessKey"
-    
-    # Get pending items
-    pending_items = db.get_webhook_queue_items(status='pending', limit=batch_size)
-    logger.info(f"Found {len(pending_items)} pending webhook items")
-    
-    processed_count = 0
-    error_count = 0
-    
-    # Process each item
-    for item in pending_items:
-        success = process_queue_item(item)
-        if success:
-            processed_count += 1
-        else:
-            error_count += 1
-        
-        # Sleep briefly between items to avoid overwhelming resources
-        time.sleep(sleep_seconds)
-    
-    logger.info(f"Queue processing complete. Processed: {processed_count}, Errors: {error_count}")
+
+def read_consumer_status(status_file=STATUS_FILE):
+    """Read the last status published by a running consumer, or None"""
+    try:
+        with open(status_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+class QueueConsumer:
+    """Adaptive, long-running webhook queue consumer"""
+
+    def __init__(self, workers=4, batch_size=10, min_batch_size=1, max_batch_size=100,
+                 target_batch_seconds=2.0, min_poll_interval=0.1, max_poll_interval=10.0,
+                 status_file=STATUS_FILE, status_interval=5.0):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.target_batch_seconds = target_batch_seconds
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.poll_interval = min_poll_interval
+        self.status_file = status_file
+        self.status_interval = status_interval
+
+        self.stop_event = threading.Event()
+        self.started_at = None
+        self.last_status_at = 0.0
+        self.stats = {
+            "processed": 0,
+            "errors": 0,
+            "batches": 0,
+            "last_batch_seconds": 0.0,
+            "lag_seconds": 0.0,
+            "oldest_pending": None,
+            "pending_backlog": 0
+        }
+
+        ensure_alerts_table()
+
+    def stop(self, *args):
+        """Request a graceful shutdown once the in-flight batch finishes"""
+        if not self.stop_event.is_set():
+            logger.info("Shutdown requested, finishing in-flight work")
+        self.stop_event.set()
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+    def update_lag(self, items):
+        """Record how far behind the consumer is, based on the oldest pending item"""
+        if not items:
+            self.stats["lag_seconds"] = 0.0
+            self.stats["oldest_pending"] = None
+            return
+        # Items come in priority order, so find the oldest explicitly
+        oldest = min((item.get('timestamp') for item in items if item.get('timestamp')), default=None)
+        self.stats["oldest_pending"] = oldest
+        try:
+            self.stats["lag_seconds"] = round((datetime.now() - datetime.fromisoformat(oldest)).total_seconds(), 3)
+        except (TypeError, ValueError):
+            self.stats["lag_seconds"] = 0.0
+
+    def tune_batch_size(self, fetched, elapsed):
+        """Grow the batch while it finishes well inside the target, shrink when it overruns"""
+        if elapsed > self.target_batch_seconds:
+            self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+        elif fetched >= self.batch_size and elapsed < self.target_batch_seconds / 2:
+            self.batch_size = min(self.max_batch_size, self.batch_size * 2)
+
+    def process_batch(self, lanes, items):
+        """Process a batch on the lanes and return the number of failures"""
+        try:
+            return process_webhook_batch(items, lanes)["error"]
+        except Exception as e:
+            logger.error(f"Error processing batch of {len(items)} webhooks: {e}")
+            return len(items)
+
+    def run_once(self, lanes):
+        """Fetch and process one batch; returns the number of items fetched"""
+        items = db.get_pending_webhooks(limit=self.batch_size)
+        self.update_lag(items)
+        if not items:
+            return 0
+
+        start = time.monotonic()
+        errors = self.process_batch(lanes, items)
+        elapsed = time.monotonic() - start
+
+        self.stats["processed"] += len(items) - errors
+        self.stats["errors"] += errors
+        self.stats["batches"] += 1
+        self.stats["last_batch_seconds"] = round(elapsed, 3)
+        self.tune_batch_size(len(items), elapsed)
+        return len(items)
+
+    def status(self):
+        """Current consumer status, including lag and throughput"""
+        uptime = time.monotonic() - self.started_at if self.started_at else 0.0
+        return {
+            **self.stats,
+            "pid": os.getpid(),
+            "workers": self.workers,
+            "batch_size": self.batch_size,
+            "poll_interval": round(self.poll_interval, 3),
+            "uptime_seconds": round(uptime, 1),
+            "throughput_per_second": round(self.stats["processed"] / uptime, 2) if uptime else 0.0,
+            "throttled": throttle.stats(),
+            "pipeline": webhook_pipeline.stats()["stages"],
+            "running": not self.stop_event.is_set(),
+            "updated_at": datetime.now().isoformat()
+        }
+
+    def publish_status(self, force=False):
+        """Log the consumer status and write it to the status file"""
+        now = time.monotonic()
+        if not force and now - self.last_status_at < self.status_interval:
+            return
+        self.last_status_at = now
+        try:
+            self.stats["pending_backlog"] = db.count_pending_webhooks()
+        except Exception as e:
+            logger.warning(f"Could not count pending webhooks: {e}")
+        status = self.status()
+        logger.info(
+            f"Consumer lag={status['lag_seconds']}s backlog={status['pending_backlog']} "
+            f"batch={status['batch_size']} throughput={status['throughput_per_second']}/s"
+        )
+        if self.status_file:
+            try:
+                tmp_path = f"{self.status_file}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(status, f)
+                os.replace(tmp_path, self.status_file)
+            except OSError as e:
+                logger.warning(f"Could not write consumer status file: {e}")
+
+    def run(self):
+        """Consume the queue until stopped"""
+        logger.info(f"Starting webhook queue consumer with {self.workers} lanes")
+        self.started_at = time.monotonic()
+
+        lanes = LanePool(self.workers)
+        try:
+            while not self.stop_event.is_set():
+                # run_once may retune the batch size; a full batch is judged by the size it asked for
+                batch_size = self.batch_size
+                try:
+                    fetched = self.run_once(lanes)
+                except Exception as e:
+                    logger.error(f"Error fetching or processing batch: {e}")
+                    fetched = 0
+
+                self.publish_status()
+
+                if fetched >= batch_size:
+                    # Busy: drain the backlog without sleeping
+                    self.poll_interval = self.min_poll_interval
+                    continue
+                if fetched:
+                    self.poll_interval = self.min_poll_interval
+                else:
+                    # Idle: back off exponentially up to the maximum interval
+                    self.poll_interval = min(self.max_poll_interval, self.poll_interval * 2)
+                self.stop_event.wait(self.poll_interval)
+        finally:
+            lanes.shutdown()
+
+        self.publish_status(force=True)
+        logger.info(f"Consumer stopped. Processed: {self.stats['processed']}, Errors: {self.stats['errors']}")
+        return self.stats
+
+def process_queue(batch_size=10, workers=1):
+    """Process one batch of pending items in the webhook queue"""
+    logger.info("Starting webhook queue processing")
+
+    use_local_dynamodb_defaults()
+
+    consumer = QueueConsumer(workers=workers, batch_size=batch_size, status_file=None)
+    lanes = LanePool(workers)
+    try:
+        total = consumer.run_once(lanes)
+    finally:
+        lanes.shutdown()
+
+    logger.info(f"Queue processing complete. Processed: {consumer.stats['processed']}, Errors: {consumer.stats['errors']}")
     return {
-        "processed": processed_count,
-        "errors": error_count,
-        "total": len(pending_items)
+        "processed": consumer.stats["processed"],
+        "errors": consumer.stats["errors"],
+        "total": total
     }
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Consume the webhook queue")
+    parser.add_argument("--workers", type=int, default=4, help="Processing lanes; events for one resource always share a lane")
+    parser.add_argument("--batch-size", type=int, default=10, help="Initial batch size")
+    parser.add_argument("--min-batch-size", type=int, default=1)
+    parser.add_argument("--max-batch-size", type=int, default=100)
+    parser.add_argument("--target-batch-seconds", type=float, default=2.0,
+                        help="Batch latency the batch size is tuned towards")
+    parser.add_argument("--min-poll-interval", type=float, default=0.1)
+    parser.add_argument("--max-poll-interval", type=float, default=10.0)
+    parser.add_argument("--status-file", default=STATUS_FILE, help="Where to publish lag and throughput")
+    parser.add_argument("--once", action="store_true", help="Process a single batch and exit")
+    args = parser.parse_args(argv)
+
+    if args.once:
+        result = process_queue(batch_size=args.batch_size, workers=args.workers)
+        print(f"Done! Queue processing complete: {result}")
+        return
+
+    use_local_dynamodb_defaults()
+
+    consumer = QueueConsumer(
+        workers=args.workers,
+        batch_size=args.batch_size,
+        min_batch_size=args.min_batch_size,
+        max_batch_size=args.max_batch_size,
+        target_batch_seconds=args.target_batch_seconds,
+        min_poll_interval=args.min_poll_interval,
+        max_poll_interval=args.max_poll_interval,
+        status_file=args.status_file
+    )
+    consumer.install_signal_handlers()
+    consumer.run()
+
 if __name__ == "__main__":
-    process_queue()
-    print("Done! Queue processing complete.")
\ No newline at end of file
+    main()
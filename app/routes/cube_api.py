@@ -0,0 +1,33 @@
+"""
+API routes for the alert cube
+"""
+
+from fastapi import APIRouter, HTTPException
+from .. import db
+from ..alert_cube import alert_cube, LEVELS
+from ..models import CountMode
+
+router = APIRouter(prefix="/api/cube", tags=["cube"])
+
+@router.get("")
+async def get_cube_node(account: str = None, service: str = None, region: str = None, resource: str = None,
+                        alert_type: str = None, count: CountMode = CountMode.OCCURRENCES):
+    """All-time counts of one node of the account -> service -> region -> resource -> alert type
+    path and of its children; give the levels from the top down (none for the root)"""
+    values = [account, service, region, resource, alert_type]
+    given = [index for index, value in enumerate(values) if value is not None]
+    path = values[:given[-1] + 1] if given else []
+    if None in path:
+        raise HTTPException(status_code=400, detail=f"Give {', '.join(LEVELS[:len(path)])} for this level")
+    if not alert_cube.enabled or not alert_cube.loaded:
+        raise HTTPException(status_code=503, detail="The alert cube is not loaded (set ALERT_CUBE=1)")
+    counts = alert_cube.node(*path)
+    if counts is None:
+        raise HTTPException(status_code=404, detail="No alerts at this node")
+    child_level = LEVELS[len(path)] if len(path) < len(LEVELS) else None
+    return {
+        'path': dict(zip(LEVELS, path)),
+        **db.counted_alerts(counts, count),
+        'children': [{child_level: value, **db.counted_alerts(child_counts, count)}
+                     for value, child_counts in sorted(alert_cube.children(*path).items())]
+    }
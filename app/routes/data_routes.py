@@ -2,7 +2,7 @@
 API routes for sample data management
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter
 import logging
 import boto3
 import os
@@ -16,7 +16,12 @@ import random
 sys.path.append(str(Path(__file__).parent.parent.parent))
 
 # Import seed_data functions
-from app.seed_data import generate_sample_data
+from app.seed_data import generate_sample_data, seed_alerts
+from app import db, payload_store, timeseries
+from app.hot_store import hot_store
+from app.alert_cube import alert_cube
+from app.jobs import job_manager
+from app.routes.jobs_api import job_accepted
 
 router = APIRouter(prefix="/api/data", tags=["data"])
 logger = logging.getLogger(__name__)
@@ -30,178 +35,193 @@ dynamodb = boto3.resource(
     aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY", "fakeSecretAccessKey")
 )
 
+def seed_alerts_job(job):
+    """Job body: replace all alerts with generated sample alerts"""
+    alerts = generate_sample_data()
+    job.set_total(len(alerts))
+    seed_alerts(alerts, progress=job.advance)
+    
+    return {
+        "message": f"Inserted {len(alerts)} sample alerts",
+        "count": len(alerts)
+    }
+
 @router.post("/seed/alerts")
 async def seed_alert_data():
-    """Seed sample alert data"""
-    try:
-        table = dynamodb.Table('alerts')
-        
-        # Clear existing data
-        scan = table.scan()
-        with table.batch_writer() as batch:
-            for item in scan['Items']:
-                batch.delete_item(Key={'id': item['id']})
-        
-        # Generate and insert new data
-        alerts = generate_sample_data()
-        
-        with table.batch_writer() as batch:
-            for alert in alerts:
-                batch.put_item(Item=alert)
-        
-        return {
-            "status": "success",
-            "message": f"Inserted {len(alerts)} sample alerts",
-            "count": len(alerts)
-        }
-    except Exception as e:
-        logger.error(f"Error seeding alert data: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    """Seed sample alert data in a background job"""
+    job = job_manager.submit("seed-alerts", seed_alerts_job, description="Replace alerts with sample data")
+    return job_accepted(job, "Seeding sample alerts")
+
+def clear_alerts_job(job):
+    """Job body: truncate the alerts and their counters"""
+    result = db.truncate_table('alerts', progress=job.advance)
+    counters = db.truncate_table('alert_counters')
+    series = db.truncate_table('alert_timeseries')
+    hot_store.clear()
+    alert_cube.clear()
+    job.set_total(job.done)
+    
+    approx = "" if result["exact"] else "~"
+    seconds = result['seconds'] + counters['seconds'] + series['seconds']
+    return {
+        "message": f"Cleared {approx}{result['count']} alerts in {seconds:.2f}s",
+        "count": result["count"],
+        "truncate": [result, counters, series]
+    }
 
 @router.post("/clear/alerts")
 async def clear_alert_data():
-    """Clear all alert data"""
-    try:
-        table = dynamodb.Table('alerts')
-        
-        # Count items before clearing
-        count = table.scan(Select='COUNT')['Count']
-        
-        # Clear existing data
-        scan = table.scan()
-        with table.batch_writer() as batch:
-            for item in scan['Items']:
-                batch.delete_item(Key={'id': item['id']})
+    """Clear all alert data in a background job"""
+    job = job_manager.submit("clear-alerts", clear_alerts_job, description="Delete all alerts")
+    return job_accepted(job, "Clearing alerts")
+
+def rebuild_counters_job(job):
+    """Job body: recompute the alert counters and time series from the alerts table"""
+    result = db.rebuild_alert_counters(progress=job.advance)
+    job.check_cancelled()
+    series = timeseries.rebuild()
+    job.check_cancelled()
+    cube = db.build_alert_cube()
+    return {
+        "message": f"Rebuilt {result['counters']} counters and {series['points']} time series points from {result['alerts']} alerts",
+        **result,
+        "points": series['points'],
+        "cube_alerts": cube
+    }
+
+@router.post("/rebuild/counters")
+async def rebuild_alert_counters():
+    """Recompute the alert counters and time series, e.g. for alerts stored before them, in a background job"""
+    job = job_manager.submit("rebuild-counters", rebuild_counters_job, description="Rebuild alert counters")
+    return job_accepted(job, "Rebuilding alert counters")
+
+def backfill_indexes_job(job):
+    """Job body: give existing items the keys of indexes added since they were written"""
+    updated = db.backfill_indexes(progress=job.advance)
+    job.set_total(job.done)
+    return {
+        "message": f"Backfilled index keys of {sum(updated.values())} items",
+        "updated": updated
+    }
+
+@router.post("/backfill/indexes")
+async def backfill_indexes():
+    """Index items written before their table's indexes were added, in a background job"""
+    job = job_manager.submit("backfill-indexes", backfill_indexes_job, description="Backfill index keys")
+    return job_accepted(job, "Backfilling index keys")
+
+def seed_webhooks_job(job):
+    """Job body: replace the webhook queue and payloads with sample webhooks"""
+    # Clear existing data
+    db.truncate_table('webhook_queue')
+    db.truncate_table('webhook_history')
+    db.truncate_table('webhook_payloads')
+    db.truncate_table('postmark_data')
+    payload_store.clear_blobs()
+    job.check_cancelled()
+    
+    # Generate sample webhook data
+    now = datetime.now()
+    statuses = ["pending", "processed", "error"]
+    status_weights = [0.4, 0.4, 0.2]  # 40% pending, 40% processed, 20% error
+    
+    # Generate data for the last 7 days
+    sample_data = []
+    for day in range(7):
+        # Generate different number of webhooks for each day
+        num_webhooks = random.randint(5, 15)
         
-        return {
-            "status": "success",
-            "message": f"Cleared {count} alerts",
-            "count": count
-        }
-    except Exception as e:
-        logger.error(f"Error clearing alert data: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        for _ in range(num_webhooks):
+            webhook_id = str(uuid.uuid4())
+            
+            # Generate a random timestamp for this day
+            random_hours = random.randint(0, 23)
+            random_minutes = random.randint(0, 59)
+            timestamp = now - timedelta(days=day, hours=random_hours, minutes=random_minutes)
+            timestamp_iso = timestamp.isoformat()
+            date_str = timestamp.strftime("%Y-%m-%d")
+            
+            # Determine status based on weights
+            status = random.choices(statuses, weights=status_weights)[0]
+            
+            # Create webhook queue item
+            queue_item = {
+                "id": webhook_id,
+                "timestamp": timestamp_iso,
+                "date": date_str,
+                "status": status,
+                "source": "postmark",
+                "processed_at": timestamp_iso if status != "pending" else None
+            }
+            
+            # Pending items are due for pickup straight away
+            if status == "pending":
+                queue_item.update(db.pending_schedule(webhook_id, db.DEFAULT_PRIORITY, timestamp_iso))
+            
+            # Add error message for error status
+            if status == "error":
+                queue_item["error_message"] = random.choice([
+                    "Invalid payload format",
+                    "Missing required fields",
+                    "Processing timeout",
+                    "Database connection error"
+                ])
+            
+            # Create sample payload
+            payload = {
+                "MessageID": f"message-{webhook_id[:8]}",
+                "Subject": random.choice([
+                    "System notification",
+                    "Critical alert detected",
+                    "High CPU usage warning",
+                    "Database backup completed",
+                    "Security alert",
+                    "Scheduled maintenance"
+                ]),
+                "MessageStream": "outbound",
+                "Tag": random.choice(["alert", "notification", "system", "security"]),
+                "ServerID": random.randint(1000, 9999)
+            }
+            
+            sample_data.append((queue_item, payload))
+    
+    # Insert data into tables
+    job.set_total(len(sample_data))
+    for queue_item, payload in sample_data:
+        db.put_webhook(queue_item, payload)
+        job.advance()
+    
+    return {
+        "message": f"Inserted {len(sample_data)} sample webhooks",
+        "count": len(sample_data)
+    }
 
 @router.post("/seed/webhooks")
 async def seed_webhook_data():
-    """Seed sample webhook data"""
-    try:
-        webhook_queue = dynamodb.Table('webhook_queue')
-        postmark_data = dynamodb.Table('postmark_data')
-        
-        # Clear existing data
-        for table in [webhook_queue, postmark_data]:
-            scan = table.scan()
-            with table.batch_writer() as batch:
-                for item in scan['Items']:
-                    batch.delete_item(Key={'id': item['id']})
-        
-        # Generate sample webhook data
-        now = datetime.now()
-        statuses = ["pending", "processed", "error"]
-        status_weights = [0.4, 0.4, 0.2]  # 40% pending, 40% processed, 20% error
-        
-        # Generate data for the last 7 days
-        sample_data = []
-        for day in range(7):
-            # Generate different number of webhooks for each day
-            num_webhooks = random.randint(5, 15)
-            
-            for _ in range(num_webhooks):
-                webhook_id = str(uuid.uuid4())
-                
-                # Generate a random timestamp for this day
-                random_hours = random.randint(0, 23)
-                random_minutes = random.randint(0, 59)
-                timestamp = now - timedelta(days=day, hours=random_hours, minutes=random_minutes)
-                timestamp_iso = timestamp.isoformat()
-                date_str = timestamp.strftime("%Y-%m-%d")
-                
-                # Determine status based on weights
-                status = random.choices(statuses, weights=status_weights)[0]
-                
-                # Create webhook queue item
-                queue_item = {
-                    "id": webhook_id,
-                    "timestamp": timestamp_iso,
-                    "date": date_str,
-                    "status": status,
-                    "source": "postmark",
-                    "processed_at": timestamp_iso if status != "pending" else None
-                }
-                
-                # Add error message for error status
-                if status == "error":
-                    queue_item["error_message"] = random.choice([
-                        "Invalid payload format",
-                        "Missing required fields",
-                        "Processing timeout",
-                        "Database connection error"
-                    ])
-                
-                # Create postmark data item with sample payload
-                payload = {
-                    "MessageID": f"message-{webhook_id[:8]}",
-                    "Subject": random.choice([
-                        "System notification",
-                        "Critical alert detected",
-                        "High CPU usage warning",
-                        "Database backup completed",
-                        "Security alert",
-                        "Scheduled maintenance"
-                    ]),
-                    "MessageStream": "outbound",
-                    "Tag": random.choice(["alert", "notification", "system", "security"]),
-                    "ServerID": random.randint(1000, 9999)
-                }
-                
-                postmark_item = {
-                    "id": webhook_id,
-                    "timestamp": timestamp_iso,
-                    "date": date_str,
-                    "raw_data": payload
-                }
-                
-                sample_data.append((queue_item, postmark_item))
-        
-        # Insert data into tables
-        for queue_item, postmark_item in sample_data:
-            webhook_queue.put_item(Item=queue_item)
-            postmark_data.put_item(Item=postmark_item)
-        
-        return {
-            "status": "success",
-            "message": f"Inserted {len(sample_data)} sample webhooks",
-            "count": len(sample_data)
-        }
-    except Exception as e:
-        logger.error(f"Error seeding webhook data: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    """Seed sample webhook data in a background job"""
+    job = job_manager.submit("seed-webhooks", seed_webhooks_job, description="Replace webhooks with sample data")
+    return job_accepted(job, "Seeding sample webhooks")
+
+def clear_webhooks_job(job):
+    """Job body: truncate the webhook queue, history and payloads, including legacy postmark data"""
+    queue = db.truncate_table('webhook_queue', progress=job.advance)
+    history = db.truncate_table('webhook_history')
+    payloads = db.truncate_table('webhook_payloads')
+    legacy = db.truncate_table('postmark_data')
+    payload_store.clear_blobs()
+    job.set_total(job.done)
+    
+    seconds = queue['seconds'] + history['seconds'] + payloads['seconds'] + legacy['seconds']
+    return {
+        "message": f"Cleared {queue['count']} webhook queue items, {history['count']} history items and {payloads['count'] + legacy['count']} payloads in {seconds:.2f}s",
+        "queue_count": queue["count"],
+        "data_count": payloads["count"] + legacy["count"],
+        "history_count": history["count"],
+        "truncate": [queue, history, payloads, legacy]
+    }
 
 @router.post("/clear/webhooks")
 async def clear_webhook_data():
-    """Clear all webhook data"""
-    try:
-        webhook_queue = dynamodb.Table('webhook_queue')
-        postmark_data = dynamodb.Table('postmark_data')
-        
-        # Count items before clearing
-        queue_count = webhook_queue.scan(Select='COUNT')['Count']
-        data_count = postmark_data.scan(Select='COUNT')['Count']
-        
-        # Clear existing data
-        for table in [webhook_queue, postmark_data]:
-            scan = table.scan()
-            with table.batch_writer() as batch:
-                for item in scan['Items']:
-                    batch.delete_item(Key={'id': item['id']})
-        
-        return {
-            "status": "success",
-            "message": f"Cleared {queue_count} webhook queue items and {data_count} postmark data items",
-            "queue_count": queue_count,
-            "data_count": data_count
-        }
-    except Exception as e:
-        logger.error(f"Error clearing webhook data: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+    """Clear all webhook data in a background job"""
+    job = job_manager.submit("clear-webhooks", clear_webhooks_job, description="Delete all webhook data")
+    return job_accepted(job, "Clearing webhook data")
@@ -0,0 +1,43 @@
+"""
+API routes for background jobs
+"""
+
+from fastapi import APIRouter, HTTPException
+from ..jobs import job_manager
+
+router = APIRouter(prefix="/api/jobs", tags=["jobs"])
+
+def job_accepted(job, message):
+    """Response for an endpoint that submitted a background job"""
+    return {
+        "status": "accepted",
+        "message": message,
+        "job_id": job.id,
+        "job_url": f"/api/jobs/{job.id}"
+    }
+
+@router.get("/")
+async def list_jobs(status: str = None, kind: str = None):
+    """List jobs in this process, newest first"""
+    jobs = [job.to_dict() for job in job_manager.list()]
+    if status:
+        jobs = [job for job in jobs if job["status"] == status]
+    if kind:
+        jobs = [job for job in jobs if job["kind"] == kind]
+    return jobs
+
+@router.get("/{job_id}")
+async def get_job(job_id: str):
+    """Get a job's status, progress, throughput and ETA"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@router.post("/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Cancel a job; running jobs stop at their next progress update"""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
@@ -35,6 +35,7 @@ async def get_queue_dashboard():
             .pending { color: #ff9900; }
             .processed { color: #4CAF50; }
             .error { color: #cc0000; }
+            .dead_letter { color: #7b1fa2; }
             .chart-container { display: flex; gap: 20px; margin-bottom: 20px; }
             .chart-box { flex: 1; background-color: #fff; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); padding: 15px; height: 300px; }
             .chart-title { font-size: 16px; font-weight: bold; margin-bottom: 10px; }
@@ -45,6 +46,7 @@ async def get_queue_dashboard():
             .stat-pending { color: #ff9900; }
             .stat-processed { color: #4CAF50; }
             .stat-error { color: #cc0000; }
+            .stat-dead-letter { color: #7b1fa2; }
             .stat-total { color: #0078d7; }
             .filter-controls { display: flex; flex-wrap: wrap; gap: 15px; margin-bottom: 15px; background-color: #f9f9f9; padding: 10px; border-radius: 4px; }
             .filter-group { display: flex; align-items: center; gap: 5px; }
@@ -68,6 +70,7 @@ async def get_queue_dashboard():
                 <button onclick="window.location.href='/settings'" class="action-btn" style="background-color: #4CAF50;">Settings</button>
                 <button onclick="processWebhooks()" class="action-btn">Process Pending Webhooks</button>
                 <button onclick="loadSampleWebhooks()" class="action-btn">Load Sample Webhooks</button>
+                <button onclick="compactQueue()" class="action-btn">Move Old Webhooks to History</button>
                 <button onclick="clearWebhooks()" class="action-btn danger">Clear Webhooks</button>
             </div>
         </div>
@@ -100,6 +103,10 @@ async def get_queue_dashboard():
                 <div class="stat-title">Error</div>
                 <div class="stat-value stat-error" id="error-count">0</div>
             </div>
+            <div class="stat-box">
+                <div class="stat-title">Dead Letter</div>
+                <div class="stat-value stat-dead-letter" id="dead-letter-count">0</div>
+            </div>
         </div>
         
         <div class="filter-controls">
@@ -113,7 +120,16 @@ async def get_queue_dashboard():
                     <option value="all">All Statuses</option>
                     <option value="pending">Pending</option>
                     <option value="processed">Processed</option>
+                    <option value="discarded">Discarded</option>
                     <option value="error">Error</option>
+                    <option value="dead_letter">Dead Letter</option>
+                </select>
+            </div>
+            <div class="filter-group">
+                <label for="table-filter">Show:</label>
+                <select id="table-filter">
+                    <option value="queue">Active Queue</option>
+                    <option value="history">History</option>
                 </select>
             </div>
             <button id="apply-filters">Apply Filters</button>
@@ -135,6 +151,21 @@ async def get_queue_dashboard():
             <tbody id="queue-body"></tbody>
         </table>
         
+        <h2>Dead Letter Queue</h2>
+        <table id="dlq-table">
+            <thead>
+                <tr>
+                    <th>ID</th>
+                    <th>Timestamp</th>
+                    <th>Attempts</th>
+                    <th>Last Error</th>
+                    <th>Failed At</th>
+                    <th>Actions</th>
+                </tr>
+            </thead>
+            <tbody id="dlq-body"></tbody>
+        </table>
+        
         <script>
             // Global variables
             let queueData = [];
@@ -236,6 +267,7 @@ async def get_queue_dashboard():
                 document.getElementById('pending-count').textContent = stats.pending;
                 document.getElementById('processed-count').textContent = stats.processed;
                 document.getElementById('error-count').textContent = stats.error;
+                document.getElementById('dead-letter-count').textContent = stats.dead_letter || 0;
                 
                 // Update charts if they exist
                 if (statusChart) {
@@ -258,13 +290,14 @@ async def get_queue_dashboard():
             }
             
             // Load queue data
-            function loadQueueData(date = null, status = null) {
+            function loadQueueData(date = null, status = null, history = false) {
                 let url = '/api/webhooks/queue';
                 const params = [];
                 
                 // Only add valid parameters
                 if (date && date.trim() !== '') params.push(`date=${date}`);
                 if (status && status !== 'all') params.push(`status=${status}`);
+                if (history) params.push('history=true');
                 if (params.length > 0) url += '?' + params.join('&');
                 
                 console.log('Loading queue data from:', url);
@@ -359,6 +392,7 @@ async def get_queue_dashboard():
                     if (item.status === 'pending') statusClass = 'pending';
                     else if (item.status === 'processed') statusClass = 'processed';
                     else if (item.status === 'error') statusClass = 'error';
+                    else if (item.status === 'dead_letter') statusClass = 'dead_letter';
                     
                     row.innerHTML = `
                         <td>${item.id.substring(0, 8)}...</td>
@@ -375,10 +409,52 @@ async def get_queue_dashboard():
                 });
             }
             
-            // Load stats data
+            // Load dead-lettered webhooks
+            function loadDeadLetterData() {
+                fetch('/api/webhooks/dlq')
+                    .then(response => response.json())
+                    .then(data => {
+                        const tbody = document.getElementById('dlq-body');
+                        tbody.innerHTML = '';
+                        
+                        if (data.length === 0) {
+                            tbody.innerHTML = `<tr><td colspan="6" style="text-align: center; padding: 20px;">
+                                No dead-lettered webhooks.
+                            </td></tr>`;
+                            return;
+                        }
+                        
+                        data.forEach(item => {
+                            const row = document.createElement('tr');
+                            const timestamp = new Date(item.timestamp).toLocaleString();
+                            const failedAt = item.processed_at ? new Date(item.processed_at).toLocaleString() : '-';
+                            
+                            row.innerHTML = `
+                                <td>${item.id.substring(0, 8)}...</td>
+                                <td>${timestamp}</td>
+                                <td>${item.attempts || 0}</td>
+                                <td class="dead_letter">${item.error_message || '-'}</td>
+                                <td>${failedAt}</td>
+                                <td>
+                                    <button onclick="viewDetails('${item.id}')">View</button>
+                                    <button onclick="reprocess('${item.id}')">Requeue</button>
+                                </td>
+                            `;
+                            tbody.appendChild(row);
+                        });
+                    })
+                    .catch(error => {
+                        console.error('Error loading dead letter queue:', error);
+                    });
+            }
+            
+            // Load stats data, for history when the table shows it
             function loadStatsData(date = null) {
+                const params = [];
+                if (date) params.push(`date=${date}`);
+                if (document.getElementById('table-filter').value === 'history') params.push('history=true');
                 let url = '/api/webhooks/stats';
-                if (date) url += `?date=${date}`;
+                if (params.length) url += `?${params.join('&')}`;
                 
                 fetch(url)
                     .then(response => response.json())
@@ -406,9 +482,23 @@ async def get_queue_dashboard():
                 // Only use date filter if it's not empty
                 const dateParam = dateFilter && dateFilter.trim() !== '' ? dateFilter : null;
                 const statusParam = statusFilter !== 'all' ? statusFilter : null;
+                const history = document.getElementById('table-filter').value === 'history';
                 
-                loadQueueData(dateParam, statusParam);
+                loadQueueData(dateParam, statusParam, history);
                 loadStatsData(dateParam);
+                loadDeadLetterData();
+            }
+            
+            // Poll a background job until it finishes
+            function waitForJob(jobId) {
+                return fetch(`/api/jobs/${jobId}`)
+                    .then(response => response.json())
+                    .then(job => {
+                        if (['succeeded', 'failed', 'cancelled'].includes(job.status)) {
+                            return job;
+                        }
+                        return new Promise(resolve => setTimeout(resolve, 1000)).then(() => waitForJob(jobId));
+                    });
             }
             
             // Load sample webhooks
@@ -423,9 +513,10 @@ async def get_queue_dashboard():
                     }
                     return response.json();
                 })
-                .then(result => {
-                    console.log('Sample webhooks loaded:', result);
-                    if (result.status === 'success') {
+                .then(result => waitForJob(result.job_id))
+                .then(job => {
+                    console.log('Sample webhooks loaded:', job);
+                    if (job.status === 'succeeded') {
                         alert('Sample webhooks loaded successfully');
                         // Reload data with a slight delay to ensure DynamoDB has time to update
                         setTimeout(() => {
@@ -433,7 +524,7 @@ async def get_queue_dashboard():
                             loadStatsData(null);
                         }, 1000);
                     } else {
-                        alert('Error: ' + result.message);
+                        alert('Error: ' + (job.error || job.status));
                     }
                 })
                 .catch(error => {
@@ -469,13 +560,14 @@ async def get_queue_dashboard():
                     method: 'POST'
                 })
                 .then(response => response.json())
-                .then(result => {
-                    if (result.status === 'success') {
-                        alert('Webhooks processed successfully');
+                .then(result => waitForJob(result.job_id))
+                .then(job => {
+                    if (job.status === 'succeeded') {
+                        alert(job.result.message);
                         // Reload data
                         applyFilters();
                     } else {
-                        alert('Error: ' + result.message);
+                        alert('Error: ' + (job.error || job.status));
                     }
                 })
                 .catch(error => {
@@ -484,6 +576,27 @@ async def get_queue_dashboard():
                 });
             }
             
+            // Move old processed and discarded webhooks to history
+            function compactQueue() {
+                fetch('/api/webhooks/compact', {
+                    method: 'POST'
+                })
+                .then(response => response.json())
+                .then(result => waitForJob(result.job_id))
+                .then(job => {
+                    if (job.status === 'succeeded') {
+                        alert(job.result.message);
+                        applyFilters();
+                    } else {
+                        alert('Error: ' + (job.error || job.status));
+                    }
+                })
+                .catch(error => {
+                    console.error('Error compacting queue:', error);
+                    alert('Error compacting queue');
+                });
+            }
+            
             // Clear webhooks
             function clearWebhooks() {
                 if (confirm('Are you sure you want to clear all webhooks?')) {
@@ -491,13 +604,14 @@ async def get_queue_dashboard():
                         method: 'POST'
                     })
                     .then(response => response.json())
-                    .then(result => {
-                        if (result.status === 'success') {
+                    .then(result => waitForJob(result.job_id))
+                    .then(job => {
+                        if (job.status === 'succeeded') {
                             alert('Webhooks cleared successfully');
                             // Reload data
                             applyFilters();
                         } else {
-                            alert('Error: ' + result.message);
+                            alert('Error: ' + (job.error || job.status));
                         }
                     })
                     .catch(error => {
@@ -516,12 +630,14 @@ async def get_queue_dashboard():
                 // Load initial data without any filters
                 loadQueueData(null, null);
                 loadStatsData(null);
+                loadDeadLetterData();
                 
                 // Set up event listeners
                 document.getElementById('apply-filters').addEventListener('click', applyFilters);
                 document.getElementById('reset-filters').addEventListener('click', function() {
                     document.getElementById('date-filter').value = '';
                     document.getElementById('status-filter').value = 'all';
+                    document.getElementById('table-filter').value = 'queue';
                     loadQueueData(null, null);
                     loadStatsData(null);
                 });
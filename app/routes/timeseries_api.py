@@ -0,0 +1,22 @@
+"""
+API routes for alert rate time series
+"""
+
+from fastapi import APIRouter, HTTPException
+from .. import db, timeseries
+
+router = APIRouter(prefix="/api/timeseries", tags=["timeseries"])
+
+@router.get("")
+async def get_timeseries(window: str = "24h", since: str = None, until: str = None, account: str = None,
+                         service: str = None, alert_type: str = None, severity: str = None,
+                         points: int = timeseries.TIMESERIES_MAX_POINTS):
+    """Alert counts over time for the last window (e.g. 1h, 24h, 7d) or since..until,
+    overall or for one account, service or alert type; the resolution is picked from the range"""
+    try:
+        return timeseries.get_series(since or db.window_since(window), until, account, service, alert_type,
+                                     severity, min(points, timeseries.TIMESERIES_MAX_POINTS))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
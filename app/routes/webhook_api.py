@@ -3,26 +3,34 @@ API routes for webhook queue management
 """
 
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
 from datetime import datetime, timedelta
 import uuid
 import json
 import random
-from .. import db
+from .. import db, payload_store, timeseries
+from ..hot_store import hot_store
+from ..alert_cube import alert_cube
+from ..models import WebhookBatchGetRequest, WebhookReprocessRequest
+from ..jobs import job_manager, JobCancelled
+from ..webhook_processor import run_pipeline, count_outcomes, shared_lanes
+from .jobs_api import job_accepted
+from .process_routes import process_all_job
 
 router = APIRouter(prefix="/api/webhooks", tags=["webhooks"])
 
 @router.get("/queue")
-async def get_queue_items(status: str = None, date: str = None, limit: int = 50):
-    """Get webhook queue items, optionally filtered by status and date"""
+async def get_queue_items(status: str = None, date: str = None, limit: int = 50, history: bool = False):
+    """Get webhook queue items, optionally filtered by status and date; history lists compacted webhooks"""
     try:
-        print(f"API: Getting webhook queue items with status={status}, date={date}, limit={limit}")
+        print(f"API: Getting webhook queue items with status={status}, date={date}, limit={limit}, history={history}")
         
         # Validate parameters
         valid_status = status if status and status != "all" else None
         valid_date = date if date and len(date) > 0 else None
         
         # Get items with validated filters
-        items = db.get_webhook_queue_items(valid_status, valid_date, limit)
+        items = db.get_webhook_queue_items(valid_status, valid_date, limit, history=history)
         print(f"API: Found {len(items)} webhook queue items")
         
         # For debugging, print the first item if available
@@ -37,18 +45,35 @@ async def get_queue_items(status: str = None, date: str = None, limit: int = 50)
         print(f"API Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Most ids accepted by one batch-get request
+MAX_BATCH_GET_IDS = 1000
+
+@router.post("/queue/batch-get")
+async def batch_get_queue_items(request: WebhookBatchGetRequest):
+    """Get many webhook queue items by ID, optionally only some fields; compacted ones come from history"""
+    if len(request.ids) > MAX_BATCH_GET_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_GET_IDS} ids per request")
+    try:
+        found = db.batch_get_items('webhook_queue', request.ids, request.fields)
+        missing = [webhook_id for webhook_id in request.ids if webhook_id not in found]
+        if missing:
+            db.ensure_table('webhook_history')
+            found.update(db.batch_get_items('webhook_history', missing, request.fields))
+        return {
+            "items": [found[webhook_id] for webhook_id in dict.fromkeys(request.ids) if webhook_id in found],
+            "missing": [webhook_id for webhook_id in dict.fromkeys(request.ids) if webhook_id not in found]
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/queue/{webhook_id}")
 async def get_queue_item(webhook_id: str):
-    """Get a specific webhook queue item by ID"""
+    """Get a specific webhook queue item by ID, from the queue or history"""
     try:
-        # Get all items and filter by ID
-        # This is inefficient but works for our simple example
-        items = db.get_webhook_queue_items()
-        for item in items:
-            if item['id'] == webhook_id:
-                return item
-        
-        raise HTTPException(status_code=404, detail="Webhook not found")
+        item = db.get_webhook_item(webhook_id)
+        if item is None:
+            raise HTTPException(status_code=404, detail="Webhook not found")
+        return item
     except Exception as e:
         if isinstance(e, HTTPException):
             raise e
@@ -56,39 +81,38 @@ async def get_queue_item(webhook_id: str):
 
 @router.get("/data/{webhook_id}")
 async def get_webhook_data(webhook_id: str):
-    """Get the raw data for a specific webhook"""
+    """Get the raw data and agent interpretation for a specific webhook"""
     try:
-        # Get from webhook_queue table
-        dynamodb = db.get_dynamodb_client()
-        table = dynamodb.Table('webhook_queue')
-        response = table.get_item(Key={'id': webhook_id})
-        
-        if 'Item' not in response:
-            raise HTTPException(status_code=404, detail="Webhook data not found")
-        
-        # Return the item with raw_data field
-        if 'raw_data' not in response['Item']:
+        payload = db.get_webhook_payload(webhook_id)
+        if payload is None:
+            if db.get_webhook_item(webhook_id, fields=['id']) is None:
+                raise HTTPException(status_code=404, detail="Webhook data not found")
             return {"id": webhook_id, "raw_data": {"message": "No raw data available"}}
         
-        return {"id": webhook_id, "raw_data": response['Item']['raw_data']}
+        return {
+            "id": webhook_id,
+            "raw_data": payload.get('raw_data', {"message": "No raw data available"}),
+            "agent_interpretation": payload.get('agent_interpretation')
+        }
     except Exception as e:
         if isinstance(e, HTTPException):
             raise e
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/attachments/{digest}")
+async def get_webhook_attachment(digest: str):
+    """Download an attachment stored by the streaming webhook ingest (its ContentRef)"""
+    path = payload_store.blob_path(digest)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    return FileResponse(path, media_type="application/octet-stream")
+
 @router.post("/queue/{webhook_id}/reprocess")
 async def reprocess_webhook(webhook_id: str):
     """Mark a webhook for reprocessing"""
     try:
-        # Get the webhook item first
-        items = db.get_webhook_queue_items()
-        webhook_item = None
-        for item in items:
-            if item['id'] == webhook_id:
-                webhook_item = item
-                break
-        
-        if not webhook_item:
+        # Make sure the webhook exists first, moving it back from history if it was compacted
+        if db.get_webhook_queue_item(webhook_id, fields=['id']) is None and not db.restore_webhooks([webhook_id]):
             raise HTTPException(status_code=404, detail="Webhook not found")
         
         # Update status to pending for reprocessing
@@ -102,285 +126,336 @@ async def reprocess_webhook(webhook_id: str):
             raise e
         raise HTTPException(status_code=500, detail=str(e))
 
+# Webhooks reset (and processed) per batch by a bulk reprocess
+REPROCESS_PAGE_SIZE = 100
+
+REPROCESS_FILTERS = ('status', 'date_from', 'date_to', 'source', 'error_contains')
+
+def _reprocess_pages(request, cursor):
+    """(ids, cursor) pages for a reprocess request, from cursor on"""
+    if request.get('ids'):
+        ids = request['ids']
+        for offset in range(int((cursor or {}).get('offset', 0)), len(ids), REPROCESS_PAGE_SIZE):
+            yield ids[offset:offset + REPROCESS_PAGE_SIZE], {'offset': offset + REPROCESS_PAGE_SIZE}
+    else:
+        filters = {name: request.get(name) for name in REPROCESS_FILTERS}
+        yield from db.iter_webhook_ids(**filters, cursor=cursor, page_size=REPROCESS_PAGE_SIZE)
+
+def reprocess_job(job, run_id, request, cursor=None, counts=None):
+    """Job body: reset matching webhooks to pending a batch at a time, processing
+    each batch on the shared lanes, and checkpoint after every batch"""
+    counts = counts or {"matched": 0, "reset": 0, "processed": 0, "discarded": 0, "error": 0}
+    if request.get('ids'):
+        job.set_total(len(request['ids']))
+    
+    def checkpoint(status):
+        db.save_checkpoint(run_id, kind="reprocess", status=status, job_id=job.id,
+                           request=request, cursor=cursor, counts=counts)
+    
+    checkpoint("running")
+    try:
+        if request.get('ids') and cursor:
+            job.advance(min(int(cursor['offset']), len(request['ids'])))
+        for webhook_ids, next_cursor in _reprocess_pages(request, cursor):
+            if webhook_ids:
+                reset_ids = db.reset_webhooks_to_pending(webhook_ids)
+                counts["matched"] += len(webhook_ids)
+                counts["reset"] += len(reset_ids)
+                if request.get('process', True) and reset_ids:
+                    outcomes = count_outcomes(run_pipeline(webhook_ids=reset_ids, lanes=shared_lanes(), throttled=False))
+                    for outcome, count in outcomes.items():
+                        counts[outcome] += count
+            cursor = next_cursor
+            checkpoint("running")
+            job.advance(len(webhook_ids))
+    except JobCancelled:
+        checkpoint("cancelled")
+        raise
+    except Exception:
+        checkpoint("failed")
+        raise
+    checkpoint("complete")
+    
+    return {
+        "message": f"Reset {counts['reset']} webhooks; processed {counts['processed']}, discarded {counts['discarded']}, errors: {counts['error']}",
+        "run_id": run_id,
+        "counts": counts
+    }
+
+@router.post("/reprocess")
+async def reprocess_webhooks(request: WebhookReprocessRequest):
+    """Reprocess webhooks matching a filter, or a list of IDs, in a background job"""
+    params = request.dict()
+    if not params['ids'] and not any(params[name] for name in REPROCESS_FILTERS):
+        raise HTTPException(status_code=400, detail="Give ids or at least one filter")
+    
+    run_id = str(uuid.uuid4())
+    job = job_manager.submit("reprocess", reprocess_job, run_id, params, description="Reprocess matching webhooks")
+    response = job_accepted(job, "Reprocessing webhooks")
+    response["run_id"] = run_id
+    return response
+
+@router.get("/reprocess/{run_id}")
+async def get_reprocess_run(run_id: str):
+    """Get the checkpoint of a bulk reprocess run"""
+    try:
+        checkpoint = db.get_checkpoint(run_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if checkpoint is None:
+        raise HTTPException(status_code=404, detail="Reprocess run not found")
+    return checkpoint
+
+@router.post("/reprocess/{run_id}/resume")
+async def resume_reprocess_run(run_id: str):
+    """Resume a cancelled or failed (or interrupted) bulk reprocess from its checkpoint"""
+    checkpoint = db.get_checkpoint(run_id)
+    if checkpoint is None:
+        raise HTTPException(status_code=404, detail="Reprocess run not found")
+    if checkpoint['status'] == "complete":
+        raise HTTPException(status_code=409, detail="Reprocess run already complete")
+    running = job_manager.get(checkpoint.get('job_id'))
+    if running is not None and running.status in ("queued", "running"):
+        raise HTTPException(status_code=409, detail=f"Reprocess run is still running as job {running.id}")
+    
+    counts = {name: int(value) for name, value in checkpoint['counts'].items()}
+    job = job_manager.submit("reprocess", reprocess_job, run_id, checkpoint['request'], checkpoint.get('cursor'), counts,
+                             description="Resume reprocessing matching webhooks")
+    response = job_accepted(job, "Resuming reprocess")
+    response["run_id"] = run_id
+    return response
+
 @router.get("/stats")
-async def get_webhook_stats(date: str = None):
-    """Get webhook queue statistics, optionally filtered by date"""
+async def get_webhook_stats(date: str = None, history: bool = False):
+    """Get webhook queue statistics, optionally filtered by date; history covers compacted webhooks"""
     try:
-        stats = db.get_webhook_stats(date)
+        stats = db.get_webhook_stats(date, history=history)
         return stats
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/load-samples")
-async def load_sample_webhooks():
-    """Load sample webhook data"""
+@router.get("/payload-stats")
+async def get_payload_storage_stats():
+    """Payload compression and offload counts, with the bytes and WCUs saved, in this process"""
+    return payload_store.storage_stats()
+
+@router.get("/dlq")
+async def get_dead_letter_queue(limit: int = 50):
+    """Get webhooks that exhausted their retries"""
     try:
-        # Generate sample webhook data
-        sample_data = []
-        now = datetime.now()
+        return db.get_dead_letter_webhooks(limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/consumer")
+async def get_consumer_status():
+    """Get lag and throughput published by the queue consumer daemon"""
+    from ..process_queue import read_consumer_status
+
+    status = read_consumer_status()
+    if status is None:
+        return {"running": False, "message": "No queue consumer status available"}
+    return status
+
+# Sample webhooks created by load-samples
+SAMPLE_WEBHOOK_COUNT = 20
+
+def load_samples_job(job):
+    """Job body: replace the queue and alerts with sample webhooks and their alerts"""
+    # Generate sample webhook data
+    sample_data = []
+    now = datetime.now()
+    
+    # Clear existing data first
+    cleared = [db.truncate_table(table_name) for table_name in ('webhook_queue', 'webhook_history', 'webhook_payloads', 'alerts', 'alert_counters', 'alert_timeseries')]
+    payload_store.clear_blobs()
+    hot_store.clear()
+    alert_cube.clear()
+    job.check_cancelled()
+    
+    # Create the tables if they don't exist
+    dynamodb = db.get_dynamodb_client()
+    queue_table = db.ensure_table('webhook_queue', dynamodb)
+    alerts_table = db.ensure_table('alerts', dynamodb)
+    job.set_total(SAMPLE_WEBHOOK_COUNT)
+    alert_items = []
+    
+    # Generate sample webhooks
+    for i in range(SAMPLE_WEBHOOK_COUNT):
+        webhook_id = str(uuid.uuid4())
         
-        # Clear existing data first
-        dynamodb = db.get_dynamodb_client()
-        queue_table = dynamodb.Table('webhook_queue')
+        # Use current date for all webhooks to ensure they show up
+        date_str = now.strftime("%Y-%m-%d")
         
-        # Check if table exists and create it if it doesn't
-        existing_tables = [table.name for table in dynamodb.tables.all()]
-        if 'webhook_queue' not in existing_tables:
-            print("Creating webhook_queue table as it doesn't exist")
-            queue_table = dynamodb.create_table(
-                TableName='webhook_queue',
-                KeySchema=[
-                    {'AttributeName': 'id', 'KeyType': 'HASH'},
-                ],
-                AttributeDefinitions=[
-                    {'AttributeName': 'id', 'AttributeType': 'S'},
-                    {'AttributeName': 'status', 'AttributeType': 'S'},
-                    {'AttributeName': 'timestamp', 'AttributeType': 'S'},
-                    {'AttributeName': 'date', 'AttributeType': 'S'},
-                ],
-                GlobalSecondaryIndexes=[
-                    {
-                        'IndexName': 'status-timestamp-index',
-                        'KeySchema': [
-                            {'AttributeName': 'status', 'KeyType': 'HASH'},
-                            {'AttributeName': 'timestamp', 'KeyType': 'RANGE'}
-                        ],
-                        'Projection': {'ProjectionType': 'ALL'},
-                        'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-                    },
-                    {
-                        'IndexName': 'date-index',
-                        'KeySchema': [
-                            {'AttributeName': 'date', 'KeyType': 'HASH'},
-                        ],
-                        'Projection': {'ProjectionType': 'ALL'},
-                        'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-                    }
-                ],
-                ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-            )
-            # Wait for table to be created
-            queue_table.meta.client.get_waiter('table_exists').wait(TableName='webhook_queue')
-            print("webhook_queue table created successfully")
-            queue_table = dynamodb.Table('webhook_queue')
+        # All sample webhooks should be pending for processing
+        status = "pending"
         
-        # Scan and delete existing items
-        queue_items = queue_table.scan().get('Items', [])
+        # Create AWS SNS-like message
+        accounts = ["123456789012", "987654321098", "456789012345"]
+        account_id = random.choice(accounts)
         
-        # Delete all items from webhook_queue
-        with queue_table.batch_writer() as batch:
-            for item in queue_items:
-                batch.delete_item(Key={'id': item['id']})
+        aws_services = ["EC2", "RDS", "S3", "Lambda", "CloudWatch"]
+        service = random.choice(aws_services)
         
-        print(f"Cleared {len(queue_items)} existing webhook items")
+        alert_types = {
+            "EC2": ["CPU", "Memory", "Disk", "Network"],
+            "RDS": ["CPU", "Memory", "Storage", "IOPS", "Connections"],
+            "S3": ["Storage", "Access", "Replication"],
+            "Lambda": ["Error", "Timeout", "Throttle", "Memory"],
+            "CloudWatch": ["Alarm", "Event", "Log"]
+        }
         
-        # Check if alerts table exists and create if needed
-        if 'alerts' not in existing_tables:
-            print("Creating alerts table as it doesn't exist")
-            alerts_table = dynamodb.create_table(
-                TableName='alerts',
-                KeySchema=[
-                    {'AttributeName': 'id', 'KeyType': 'HASH'},
-                ],
-                AttributeDefinitions=[
-                    {'AttributeName': 'id', 'AttributeType': 'S'},
-                    {'AttributeName': 'account_id', 'AttributeType': 'S'},
-                    {'AttributeName': 'service', 'AttributeType': 'S'},
-                    {'AttributeName': 'resource_id', 'AttributeType': 'S'},
-                ],
-                GlobalSecondaryIndexes=[
-                    {
-                        'IndexName': 'account-service-index',
-                        'KeySchema': [
-                            {'AttributeName': 'account_id', 'KeyType': 'HASH'},
-                            {'AttributeName': 'service', 'KeyType': 'RANGE'}
-                        ],
-                        'Projection': {'ProjectionType': 'ALL'},
-                        'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-                    },
-                    {
-                        'IndexName': 'resource-index',
-                        'KeySchema': [
-                            {'AttributeName': 'resource_id', 'KeyType': 'HASH'},
-                        ],
-                        'Projection': {'ProjectionType': 'ALL'},
-                        'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-                    }
-                ],
-                ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-            )
-            # Wait for table to be created
-            alerts_table.meta.client.get_waiter('table_exists').wait(TableName='alerts')
-            print("alerts table created successfully")
-        else:
-            alerts_table = dynamodb.Table('alerts')
-            
-        # Clear existing alerts
-        alert_items = alerts_table.scan().get('Items', [])
-        with alerts_table.batch_writer() as batch:
-            for item in alert_items:
-                batch.delete_item(Key={'id': item['id']})
+        alert_type = random.choice(alert_types.get(service, ["Alert"]))
+        severity_levels = ["medium", "high", "critical"]
+        severity = random.choice(severity_levels)
         
-        print(f"Cleared {len(alert_items)} existing alert items")
+        regions = ["us-east-1", "us-west-2", "eu-west-1", "ap-southeast-1"]
+        region = random.choice(regions)
         
-        # Generate 20 sample webhooks
-        for i in range(20):
-            webhook_id = str(uuid.uuid4())
-            
-            # Use current date for all webhooks to ensure they show up
-            date_str = now.strftime("%Y-%m-%d")
-            
-            # All sample webhooks should be pending for processing
-            status = "pending"
-            
-            # Create AWS SNS-like message
-            accounts = ["123456789012", "987654321098", "456789012345"]
-            account_id = random.choice(accounts)
-            
-            aws_services = ["EC2", "RDS", "S3", "Lambda", "CloudWatch"]
-            service = random.choice(aws_services)
-            
-            alert_types = {
-                "EC2": ["CPU", "Memory", "Disk", "Network"],
-                "RDS": ["CPU", "Memory", "Storage", "IOPS", "Connections"],
-                "S3": ["Storage", "Access", "Replication"],
-                "Lambda": ["Error", "Timeout", "Throttle", "Memory"],
-                "CloudWatch": ["Alarm", "Event", "Log"]
-            }
-            
-            alert_type = random.choice(alert_types.get(service, ["Alert"]))
-            severity_levels = ["medium", "high", "critical"]
-            severity = random.choice(severity_levels)
-            
-            regions = ["us-east-1", "us-west-2", "eu-west-1", "ap-southeast-1"]
-            region = random.choice(regions)
-            
-            # Create AWS SNS-like message
-            subject = f"AWS {service} {alert_type} {severity.upper()} Alert"
-            
-            # Generate resource ID based on service
-            resource_id = ""
-            if service == "EC2":
-                resource_id = f"i-{uuid.uuid4().hex[:8]}"
-            elif service == "RDS":
-                resource_id = f"db-instance-{uuid.uuid4().hex[:8]}"
-            elif service == "S3":
-                resource_id = f"my-bucket-{uuid.uuid4().hex[:8]}"
-            elif service == "Lambda":
-                resource_id = f"function-{uuid.uuid4().hex[:8]}"
-            else:
-                resource_id = f"resource-{uuid.uuid4().hex[:8]}"
-            
-            # Create message body
-            message_body = {
-                "Type": "Notification",
-                "MessageId": f"message-{uuid.uuid4().hex}",
-                "TopicArn": f"arn:aws:sns:{region}:{account_id}:aws-alerts",
-                "Subject": subject,
-                "Message": f"AWS {service} resource {resource_id} has a {severity} {alert_type} alert. Please investigate immediately.",
-                "Timestamp": now.isoformat(),
-                "SignatureVersion": "1",
-                "Signature": "EXAMPLE",
-                "SigningCertURL": "EXAMPLE",
-                "UnsubscribeURL": "EXAMPLE",
-                "MessageAttributes": {
-                    "Service": {"Type": "String", "Value": service},
-                    "ResourceId": {"Type": "String", "Value": resource_id},
-                    "AlertType": {"Type": "String", "Value": alert_type},
-                    "Severity": {"Type": "String", "Value": severity},
-                    "Region": {"Type": "String", "Value": region},
-                    "AccountId": {"Type": "String", "Value": account_id}
-                }
-            }
-            
-            # Create webhook queue item with raw data included
-            webhook_item = {
-                "id": webhook_id,
-                "timestamp": now.isoformat(),
-                "date": date_str,
-                "status": status,
-                "source": "sample",
-                "raw_data": message_body
+        # Create AWS SNS-like message
+        subject = f"AWS {service} {alert_type} {severity.upper()} Alert"
+        
+        # Generate resource ID based on service
+        resource_id = ""
+        if service == "EC2":
+            resource_id = f"i-{uuid.uuid4().hex[:8]}"
+        elif service == "RDS":
+            resource_id = f"db-instance-{uuid.uuid4().hex[:8]}"
+        elif service == "S3":
+            resource_id = f"my-bucket-{uuid.uuid4().hex[:8]}"
+        elif service == "Lambda":
+            resource_id = f"function-{uuid.uuid4().hex[:8]}"
+        else:
+            resource_id = f"resource-{uuid.uuid4().hex[:8]}"
+        
+        # Create message body
+        message_body = {
+            "Type": "Notification",
+            "MessageId": f"message-{uuid.uuid4().hex}",
+            "TopicArn": f"arn:aws:sns:{region}:{account_id}:aws-alerts",
+            "Subject": subject,
+            "Message": f"AWS {service} resource {resource_id} has a {severity} {alert_type} alert. Please investigate immediately.",
+            "Timestamp": now.isoformat(),
+            "SignatureVersion": "1",
+            "Signature": "EXAMPLE",
+            "SigningCertURL": "EXAMPLE",
+            "UnsubscribeURL": "EXAMPLE",
+            "MessageAttributes": {
+                "Service": {"Type": "String", "Value": service},
+                "ResourceId": {"Type": "String", "Value": resource_id},
+                "AlertType": {"Type": "String", "Value": alert_type},
+                "Severity": {"Type": "String", "Value": severity},
+                "Region": {"Type": "String", "Value": region},
+                "AccountId": {"Type": "String", "Value": account_id}
             }
-            
-            sample_data.append(webhook_item)
-            
-            # Save to DynamoDB
-            queue_table.put_item(Item=webhook_item)
-            
-            # Create corresponding alert directly (matching the format in seed_data.py)
-            alert_id = str(uuid.uuid4())
-            alert_item = {
-                "id": alert_id,
-                "account_id": account_id,
-                "service": service,
-                "resource_id": resource_id,
-                "alert_type": alert_type,
-                "severity": severity,
-                "timestamp": now.isoformat(),
-                "message": f"{severity.capitalize()} {alert_type} alert for {service} resource {resource_id}",
-                "region": region,
-                "webhook_id": webhook_id,  # Reference to the webhook queue item
-                "remediation": db.get_remediation_action(service, alert_type, severity)
+        }
+        
+        # Create webhook queue item; the message goes to the payload table
+        webhook_item = {
+            "id": webhook_id,
+            "timestamp": now.isoformat(),
+            "date": date_str,
+            "status": status,
+            "source": "sample",
+            **db.pending_schedule(webhook_id, db.DEFAULT_PRIORITY, now.isoformat())
+        }
+        
+        sample_data.append(webhook_item)
+        
+        # Save to DynamoDB
+        db.put_webhook(webhook_item, message_body)
+        
+        # Create corresponding alert directly (matching the format in seed_data.py)
+        alert_id = str(uuid.uuid4())
+        alert_item = {
+            "id": alert_id,
+            "account_id": account_id,
+            "service": service,
+            "resource_id": resource_id,
+            "alert_type": alert_type,
+            "severity": severity,
+            "timestamp": now.isoformat(),
+            "message": f"{severity.capitalize()} {alert_type} alert for {service} resource {resource_id}",
+            "region": region,
+            "webhook_id": webhook_id,  # Reference to the webhook queue item
+            "remediation": db.get_remediation_action(service, alert_type, severity)
+        }
+        
+        # Save alert directly to alerts table
+        alerts_table.put_item(Item={**alert_item, **db.alert_index_keys(alert_item)})
+        alert_items.append(alert_item)
+        
+        # Update webhook status to processed
+        queue_table.update_item(
+            Key={"id": webhook_id},
+            UpdateExpression="SET #status = :status, status_shard = :status_shard, processed_at = :processed_at, alert_id = :alert_id REMOVE next_attempt_at, schedule_key, pending_shard",
+            ExpressionAttributeNames={"#status": "status"},
+            ExpressionAttributeValues={
+                ":status": "processed",
+                ":status_shard": db.status_shard(webhook_id, "processed"),
+                ":processed_at": now.isoformat(),
+                ":alert_id": alert_id
             }
-            
-            # Save alert directly to alerts table
-            alerts_table.put_item(Item=alert_item)
-            
-            # Update webhook status to processed
-            queue_table.update_item(
-                Key={"id": webhook_id},
-                UpdateExpression="SET #status = :status, processed_at = :processed_at, alert_id = :alert_id",
-                ExpressionAttributeNames={"#status": "status"},
-                ExpressionAttributeValues={
-                    ":status": "processed",
-                    ":processed_at": now.isoformat(),
-                    ":alert_id": alert_id
-                }
-            )
-            
-            print(f"Created webhook item {i+1}: {webhook_id} with status 'processed' and alert {alert_id}")
+        )
         
-        return {"status": "success", "message": f"Loaded {len(sample_data)} sample webhooks and created matching alerts"}
-    except Exception as e:
-        print(f"Error loading sample webhooks: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        print(f"Created webhook item {i+1}: {webhook_id} with status 'processed' and alert {alert_id}")
+        job.advance()
+    db.count_alerts(alert_items)
+    timeseries.record((alert, alert['timestamp'], 1) for alert in alert_items)
+    hot_store.add((alert, alert['timestamp'], 1, None) for alert in alert_items)
+    alert_cube.add((alert, 1, None) for alert in alert_items)
+    
+    return {
+        "message": f"Loaded {len(sample_data)} sample webhooks and created matching alerts",
+        "count": len(sample_data),
+        "cleared": cleared
+    }
+
+@router.post("/load-samples")
+async def load_sample_webhooks():
+    """Load sample webhook data in a background job"""
+    job = job_manager.submit("load-samples", load_samples_job, description="Replace webhooks and alerts with sample data")
+    return job_accepted(job, "Loading sample webhooks")
 
 @router.post("/process")
 async def process_webhooks():
-    """Process pending webhooks"""
-    try:
-        # Import the webhook processor
-        from ..webhook_processor import process_pending_webhooks
-        
-        # Process all pending webhooks
-        result = process_pending_webhooks()
-        
-        # Return the results
-        return {
-            "status": "success", 
-            "message": f"Processed {result['processed']} webhooks, discarded {result['discarded']}, errors: {result['error']}",
-            "details": result
-        }
-    except Exception as e:
-        print(f"Error processing webhooks: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    """Process pending webhooks in a background job"""
+    job = job_manager.submit("process-all", process_all_job, description="Process all pending webhooks")
+    return job_accepted(job, "Processing pending webhooks")
+
+def clear_webhooks_job(job):
+    """Job body: truncate the webhook queue, its history and their payloads"""
+    result = db.truncate_table('webhook_queue', progress=job.advance)
+    history = db.truncate_table('webhook_history')
+    payloads = db.truncate_table('webhook_payloads')
+    payload_store.clear_blobs()
+    job.set_total(job.done)
+    
+    approx = "" if result["exact"] else "~"
+    return {
+        "message": f"Cleared {approx}{result['count']} webhooks in {result['seconds']}s",
+        "count": result["count"],
+        "truncate": [result, history, payloads]
+    }
+
+def compact_job(job, older_than_hours):
+    """Job body: move old processed and discarded webhooks to history"""
+    job.set_total(db.count_compactable_webhooks(older_than_hours))
+    result = db.compact_webhook_queue(older_than_hours, progress=job.advance)
+    result["message"] = f"Moved {result['moved']} webhooks older than {older_than_hours}h to history in {result['seconds']}s"
+    return result
+
+@router.post("/compact")
+async def compact_webhook_queue(older_than_hours: float = db.HISTORY_AFTER_HOURS):
+    """Move processed and discarded webhooks older than older_than_hours out of the queue, in a background job"""
+    if older_than_hours < 0:
+        raise HTTPException(status_code=400, detail="older_than_hours must not be negative")
+    job = job_manager.submit("compact-queue", compact_job, older_than_hours,
+                             description=f"Move processed and discarded webhooks older than {older_than_hours}h to history")
+    return job_accepted(job, "Compacting webhook queue")
 
 @router.post("/clear")
 async def clear_webhooks():
-    """Clear all webhook data"""
-    try:
-        dynamodb = db.get_dynamodb_client()
-        queue_table = dynamodb.Table('webhook_queue')
-        
-        # Scan all items from the table
-        queue_items = queue_table.scan().get('Items', [])
-        
-        # Delete all items from webhook_queue
-        with queue_table.batch_writer() as batch:
-            for item in queue_items:
-                batch.delete_item(Key={'id': item['id']})
-        
-        return {"status": "success", "message": f"Cleared {len(queue_items)} webhooks"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+    """Clear all webhook data in a background job"""
+    job = job_manager.submit("clear-webhooks", clear_webhooks_job, description="Delete all webhook queue items")
+    return job_accepted(job, "Clearing webhooks")
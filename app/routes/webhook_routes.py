@@ -8,26 +8,22 @@ from .. import db
 router = APIRouter(prefix="/api/webhooks", tags=["webhooks"])
 
 @router.get("/queue")
-async def get_queue_items(status: str = None, limit: int = 50):
-    """Get webhook queue items, optionally filtered by status"""
+async def get_queue_items(status: str = None, limit: int = 50, history: bool = False):
+    """Get webhook queue items, optionally filtered by status; history lists compacted webhooks"""
     try:
-        items = db.get_webhook_queue_items(status, limit)
+        items = db.get_webhook_queue_items(status=status, limit=limit, history=history)
         return items
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/queue/{webhook_id}")
 async def get_queue_item(webhook_id: str):
-    """Get a specific webhook queue item by ID"""
+    """Get a specific webhook queue item by ID, from the queue or history"""
     try:
-        # Get all items and filter by ID
-        # This is inefficient but works for our simple example
-        items = db.get_webhook_queue_items()
-        for item in items:
-            if item['id'] == webhook_id:
-                return item
-        
-        raise HTTPException(status_code=404, detail="Webhook not found")
+        item = db.get_webhook_item(webhook_id)
+        if item is None:
+            raise HTTPException(status_code=404, detail="Webhook not found")
+        return item
     except Exception as e:
         if isinstance(e, HTTPException):
             raise e
@@ -37,15 +33,8 @@ async def get_queue_item(webhook_id: str):
 async def reprocess_webhook(webhook_id: str):
     """Mark a webhook for reprocessing"""
     try:
-        # Get the webhook item first
-        items = db.get_webhook_queue_items()
-        webhook_item = None
-        for item in items:
-            if item['id'] == webhook_id:
-                webhook_item = item
-                break
-        
-        if not webhook_item:
+        # Make sure the webhook exists first, moving it back from history if it was compacted
+        if db.get_webhook_queue_item(webhook_id, fields=['id']) is None and not db.restore_webhooks([webhook_id]):
             raise HTTPException(status_code=404, detail="Webhook not found")
         
         # Update status to pending for reprocessing
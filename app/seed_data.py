@@ -1,8 +1,10 @@
-import boto3
 import uuid
 from datetime import datetime, timedelta
 import random
 import os
+from app import db, timeseries
+from app.hot_store import hot_store
+from app.alert_cube import alert_cube
 
 # Set AWS environment variables for DynamoDB Local
 os.environ["AWS_ENDPOINT_URL"] = "http://localhost:8001"
@@ -10,121 +12,6 @@ os.environ["AWS_DEFAULT_REGION"] = "us-east-1"
 os.environ["AWS_ACCESS_KEY_ID"] = "fakeAccessKeyId"
 os.environ["AWS_SECRET_ACCESS_KEY"] = "fakeSecretAccessKey"
 
-# Connect to DynamoDB
-dynamodb = boto3.resource(
-    'dynamodb',
-    endpoint_url=os.environ.get("AWS_ENDPOINT_URL"),
-    region_name=os.environ.get("AWS_DEFAULT_REGION"),
-    aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY")
-)
-
-# Create table if it doesn't exist
-def create_table():
-    existing_tables = [table.name for table in dynamodb.tables.all()]
-    
-    if 'alerts' not in existing_tables:
-        table = dynamodb.create_table(
-            TableName='alerts',
-            KeySchema=[
-                {'AttributeName': 'id', 'KeyType': 'HASH'},
-            ],
-            AttributeDefinitions=[
-                {'AttributeName': 'id', 'AttributeType': 'S'},
-                {'AttributeName': 'account_id', 'AttributeType': 'S'},
-                {'AttributeName': 'service', 'AttributeType': 'S'},
-                {'AttributeName': 'resource_id', 'AttributeType': 'S'},
-            ],
-            GlobalSecondaryIndexes=[
-                {
-                    'IndexName': 'account-service-index',
-                    'KeySchema': [
-                        {'AttributeName': 'account_id', 'KeyType': 'HASH'},
-                        {'AttributeName': 'service', 'KeyType': 'RANGE'}
-                    ],
-                    'Projection': {'ProjectionType': 'ALL'},
-                    'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-                },
-                {
-                    'IndexName': 'resource-index',
-                    'KeySchema': [
-                        {'AttributeName': 'resource_id', 'KeyType': 'HASH'},
-                    ],
-                    'Projection': {'ProjectionType': 'ALL'},
-                    'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-                }
-            ],
-            ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-        )
-        print("Table created:", table.table_name)
-    else:
-        print("Table 'alerts' already exists")
-    
-    # Create postmark data table
-    if 'postmark_data' not in existing_tables:
-        postmark_table = dynamodb.create_table(
-            TableName='postmark_data',
-            KeySchema=[
-                {'AttributeName': 'id', 'KeyType': 'HASH'},
-            ],
-            AttributeDefinitions=[
-                {'AttributeName': 'id', 'AttributeType': 'S'},
-                {'AttributeName': 'date', 'AttributeType': 'S'},
-            ],
-            GlobalSecondaryIndexes=[
-                {
-                    'IndexName': 'date-index',
-                    'KeySchema': [
-                        {'AttributeName': 'date', 'KeyType': 'HASH'},
-                    ],
-                    'Projection': {'ProjectionType': 'ALL'},
-                    'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-                }
-            ],
-            ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-        )
-        print("Table created:", postmark_table.table_name)
-    else:
-        print("Table 'postmark_data' already exists")
-    
-    # Create webhook queue table
-    if 'webhook_queue' not in existing_tables:
-        queue_table = dynamodb.create_table(
-            TableName='webhook_queue',
-            KeySchema=[
-                {'AttributeName': 'id', 'KeyType': 'HASH'},
-            ],
-            AttributeDefinitions=[
-                {'AttributeName': 'id', 'AttributeType': 'S'},
-                {'AttributeName': 'status', 'AttributeType': 'S'},
-                {'AttributeName': 'timestamp', 'AttributeType': 'S'},
-                {'AttributeName': 'date', 'AttributeType': 'S'},
-            ],
-            GlobalSecondaryIndexes=[
-                {
-                    'IndexName': 'status-timestamp-index',
-                    'KeySchema': [
-                        {'AttributeName': 'status', 'KeyType': 'HASH'},
-                        {'AttributeName': 'timestamp', 'KeyType': 'RANGE'}
-                    ],
-                    'Projection': {'ProjectionType': 'ALL'},
-                    'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-                },
-                {
-                    'IndexName': 'date-index',
-                    'KeySchema': [
-                        {'AttributeName': 'date', 'KeyType': 'HASH'},
-                    ],
-                    'Projection': {'ProjectionType': 'ALL'},
-                    'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-                }
-            ],
-            ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-        )
-        print("Table created:", queue_table.table_name)
-    else:
-        print("Table 'webhook_queue' already exists")
-
 # Generate sample data
 def generate_sample_data():
     # Sample data configuration
@@ -182,36 +69,45 @@ def generate_sample_data():
                     "message": f"{severity.capitalize()} {alert_type} alert for {service} resource {resource}",
                     "region": region
                 }
+                # Keys of the seen indexes
+                alert.update(db.alert_index_keys(alert))
                 
                 alerts.append(alert)
     
     return alerts
 
-# Insert data into DynamoDB
-def seed_data():
-    table = dynamodb.Table('alerts')
-    
-    # Check if data already exists
-    if table.scan(Limit=1)['Items']:
-        print("Data already exists in the table. Clearing existing data...")
-        
-        # Clear existing data
-        scan = table.scan()
-        with table.batch_writer() as batch:
-            for item in scan['Items']:
-                batch.delete_item(Key={'id': item['id']})
+def seed_alerts(alerts, progress=None):
+    """Replace all alerts with the given ones, keeping their counters, time
+    series, hot store and alert cube consistent; progress(count) is called
+    as alerts are written"""
+    # Clear existing data
+    db.truncate_table('alerts')
+    db.truncate_table('alert_counters')
+    db.truncate_table('alert_timeseries')
+    hot_store.clear()
+    alert_cube.clear()
     
-    # Generate and insert new data
-    alerts = generate_sample_data()
-    
-    print(f"Inserting {len(alerts)} sample alerts...")
+    table = db.ensure_table('alerts')
     with table.batch_writer() as batch:
         for alert in alerts:
             batch.put_item(Item=alert)
+            if progress:
+                progress(1)
+    db.count_alerts(alerts)
+    timeseries.record((alert, alert['timestamp'], 1) for alert in alerts)
+    hot_store.add((alert, alert['timestamp'], 1, None) for alert in alerts)
+    alert_cube.add((alert, 1, None) for alert in alerts)
+
+# Insert data into DynamoDB
+def seed_data():
+    alerts = generate_sample_data()
+    
+    print(f"Replacing alerts with {len(alerts)} sample alerts...")
+    seed_alerts(alerts)
     
     print("Sample data inserted successfully")
 
 if __name__ == "__main__":
-    create_table()
+    db.create_tables()
     seed_data()
-    print("Done! You can now access the dashboard at http://localhost:8000/")
\ No newline at end of file
+    print("Done! You can now access the dashboard at http://localhost:8000/")
@@ -0,0 +1,105 @@
+"""
+Write sharding for hot index keys: an item stores a hot key value with a
+bounded shard suffix derived from its id, and reads query every shard in
+parallel and merge the results by sort key
+"""
+
+import os
+import heapq
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Shards per hot key value. Raising it is safe, since reads cover every
+# lower suffix too; lowering it hides items stored under the dropped ones
+WRITE_SHARDS = int(os.environ.get("WRITE_SHARDS", "4"))
+
+# Shard queries run at the same time, across all callers
+SHARD_QUERY_WORKERS = int(os.environ.get("SHARD_QUERY_WORKERS", "16"))
+
+_executor = ThreadPoolExecutor(max_workers=max(1, SHARD_QUERY_WORKERS), thread_name_prefix="shard-query")
+
+def shard_of(item_id, shards=WRITE_SHARDS):
+    """Shard number of an item; crc32 rather than hash() so every process agrees"""
+    return zlib.crc32(item_id.encode('utf-8')) % shards
+
+def sharded_key(value, item_id, shards=WRITE_SHARDS):
+    """Index key an item stores for a hot value, e.g. "2026-10-18#3" """
+    return f"{value}#{shard_of(item_id, shards)}"
+
+def shard_keys(value, shards=WRITE_SHARDS):
+    """Every index key a hot value is spread over"""
+    return [f"{value}#{shard}" for shard in range(shards)]
+
+def _query(client, table_name, index_name, hash_attr, key, sort_attr, sort_condition, values, extra):
+    names = {'#shard': hash_attr, **extra.pop('ExpressionAttributeNames', {})}
+    condition = "#shard = :shard"
+    if sort_condition:
+        names['#sort'] = sort_attr
+        condition += f" AND {sort_condition}"
+    return client.query(
+        TableName=table_name,
+        IndexName=index_name,
+        KeyConditionExpression=condition,
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues={':shard': key, **(values or {})},
+        **extra
+    )
+
+def page_shards(client, table_name, index_name, hash_attr, keys, sort_attr=None, sort_condition=None,
+                values=None, start_keys=None, **extra):
+    """Read the index under every key a page at a time, all keys in parallel.
+
+    sort_condition is a key condition on the sort attribute, written with
+    "#sort" for its name (e.g. "#sort < :cutoff", with values
+    {":cutoff": ...}); extra goes to every query (Limit, ScanIndexForward,
+    ProjectionExpression, ...). Yields (responses, start_keys) per round,
+    where responses maps each key read to its response and start_keys
+    (key -> ExclusiveStartKey, or None to start from the beginning) resumes
+    after the round; keys that are exhausted are left out of it. client
+    must be thread-safe, e.g. a resource's meta.client.
+    """
+    start_keys = dict(start_keys) if start_keys is not None else {key: None for key in keys}
+    while start_keys:
+        futures = {}
+        for key, start_key in start_keys.items():
+            query_extra = dict(extra, **({'ExclusiveStartKey': start_key} if start_key else {}))
+            futures[key] = _executor.submit(_query, client, table_name, index_name, hash_attr, key,
+                                            sort_attr, sort_condition, values, query_extra)
+        responses = {key: future.result() for key, future in futures.items()}
+        for key, response in responses.items():
+            if 'LastEvaluatedKey' in response:
+                start_keys[key] = response['LastEvaluatedKey']
+            else:
+                del start_keys[key]
+        yield responses, dict(start_keys)
+
+def query_shards(client, table_name, index_name, hash_attr, keys, sort_attr, sort_condition=None,
+                 values=None, forward=True, limit=None, **extra):
+    """Items under every key, merged in sort_attr order (descending unless forward).
+
+    With limit, reads at most limit items per key and returns the first
+    limit of the merged result; otherwise reads every page.
+    """
+    per_key = {key: [] for key in keys}
+    start_keys = {key: None for key in keys}
+    if limit:
+        extra['Limit'] = limit
+    while start_keys:
+        rounds = page_shards(client, table_name, index_name, hash_attr, keys, sort_attr, sort_condition, values,
+                             start_keys, ScanIndexForward=forward, **extra)
+        responses, start_keys = next(rounds)
+        for key, response in responses.items():
+            per_key[key].extend(response.get('Items', []))
+        if limit:
+            # A key with limit items already has every item that can make the cut
+            start_keys = {key: start_key for key, start_key in start_keys.items() if len(per_key[key]) < limit}
+    merged = heapq.merge(*per_key.values(), key=lambda item: item.get(sort_attr, ''), reverse=not forward)
+    items = list(merged)
+    return items[:limit] if limit else items
+
+def count_shards(client, table_name, index_name, hash_attr, keys, sort_attr=None, sort_condition=None, values=None):
+    """Number of items under every key"""
+    return sum(response.get('Count', 0)
+               for responses, _ in page_shards(client, table_name, index_name, hash_attr, keys, sort_attr,
+                                               sort_condition, values, Select='COUNT')
+               for response in responses.values())
@@ -0,0 +1,105 @@
+"""
+Token-bucket throttling of alert storms by source, account and resource
+"""
+
+import os
+import time
+import threading
+
+def _limit(name, rate, burst):
+    """(tokens per second, bucket size) for a scope from the environment; a rate of 0 disables it"""
+    return (
+        float(os.environ.get(f"THROTTLE_{name}_RATE", rate)),
+        float(os.environ.get(f"THROTTLE_{name}_BURST", burst))
+    )
+
+# Throttle scopes, checked in this order. Every webhook of an integration
+# shares its source, so the source scope is a global cap and is off by default
+THROTTLE_LIMITS = {
+    'source': _limit("SOURCE", "0", "500"),
+    'account': _limit("ACCOUNT", "20", "200"),
+    'resource': _limit("RESOURCE", "1", "20"),
+}
+
+# Events this much older than the newest one a bucket has seen are replays
+# (reprocessed or long-queued webhooks), not a live storm, and pass its check
+THROTTLE_LATE_SECONDS = float(os.environ.get("THROTTLE_LATE_SECONDS", "300"))
+
+# Buckets kept before idle (full) ones are dropped
+MAX_BUCKETS = 10000
+
+class TokenBucket:
+    """Holds up to burst tokens, refilled at rate tokens per second of event time.
+
+    Events older than the newest one seen refill nothing, so out-of-order
+    events can't earn tokens twice.
+    """
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+class Throttle:
+    """Per-key token buckets for each throttle scope.
+
+    Buckets refill on when events happened (their epoch timestamps), not on
+    when they are processed, so a backlog drained late is throttled as it
+    arrived. Buckets live in the process, so each consumer and the web app
+    throttle independently.
+    """
+
+    def __init__(self, limits=THROTTLE_LIMITS, late_seconds=THROTTLE_LATE_SECONDS):
+        self.limits = {scope: limit for scope, limit in limits.items() if limit[0] > 0}
+        self.late_seconds = late_seconds
+        self.buckets = {}  # (scope, key) -> TokenBucket
+        self.throttled = {scope: 0 for scope in limits}
+        self.lock = threading.Lock()
+
+    def admit(self, keys, at=None):
+        """Take a token for each scope in keys (scope -> key) for an event at
+        epoch seconds at (default now).
+
+        Returns None when every bucket had a token, otherwise the first
+        exhausted (scope, key); no tokens are taken in that case.
+        """
+        now = time.time() if at is None else at
+        with self.lock:
+            buckets = []
+            for scope, key in keys.items():
+                if scope not in self.limits:
+                    continue
+                bucket = self.buckets.get((scope, key))
+                if bucket is None:
+                    if len(self.buckets) >= MAX_BUCKETS:
+                        self._prune(now)
+                    rate, burst = self.limits[scope]
+                    bucket = self.buckets[(scope, key)] = TokenBucket(rate, burst, now)
+                if now < bucket.updated - self.late_seconds:
+                    continue
+                bucket.refill(now)
+                if bucket.tokens < 1:
+                    self.throttled[scope] += 1
+                    return scope, key
+                buckets.append(bucket)
+            for bucket in buckets:
+                bucket.tokens -= 1
+        return None
+
+    def _prune(self, now):
+        """Drop buckets that have refilled completely; they behave like new ones"""
+        for bucket_key, bucket in list(self.buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self.buckets[bucket_key]
+
+    def stats(self):
+        """Number of events throttled per scope"""
+        with self.lock:
+            return dict(self.throttled)
@@ -0,0 +1,195 @@
+"""
+Alert rate time series: per-minute, per-hour and per-day occurrence counts,
+overall and by account, service and alert type, each point split by severity.
+
+Points are added as alerts are committed. Minute and hour points expire as
+they age (DynamoDB TTL on expires_at), leaving the coarser resolutions for
+older ranges, and reads pick the resolution from the requested range.
+"""
+
+import os
+import math
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from boto3.dynamodb.conditions import Key
+from . import db
+
+# Resolution -> (point length, point key format, days points are kept; 0 keeps them)
+RESOLUTIONS = {
+    'minute': (timedelta(minutes=1), "%Y-%m-%dT%H:%M", int(os.environ.get("TIMESERIES_MINUTE_DAYS", "2"))),
+    'hour': (timedelta(hours=1), "%Y-%m-%dT%H", int(os.environ.get("TIMESERIES_HOUR_DAYS", "90"))),
+    'day': (timedelta(days=1), "%Y-%m-%d", 0),
+}
+
+# Most points a response holds; stored points are merged to stay under it
+TIMESERIES_MAX_POINTS = int(os.environ.get("TIMESERIES_MAX_POINTS", "300"))
+
+# Most stored points read for one response; longer ranges use a coarser resolution
+TIMESERIES_MAX_READ = int(os.environ.get("TIMESERIES_MAX_READ", "1500"))
+
+# Filter parameter -> (series prefix, alert attribute)
+DIMENSIONS = {
+    'account': ('A', 'account_id'),
+    'service': ('S', 'service'),
+    'alert_type': ('T', 'alert_type'),
+}
+
+SEVERITIES = ('medium', 'high', 'critical')
+
+def series_names(alert):
+    """Series an alert's occurrences are counted in: overall and one per dimension"""
+    return ['ALL'] + [f"{prefix}#{alert[attribute]}" for prefix, attribute in DIMENSIONS.values()]
+
+def _parse_time(value):
+    when = datetime.fromisoformat(value)
+    if when.tzinfo:
+        when = when.astimezone().replace(tzinfo=None)
+    return when
+
+def _point_update(series, time, bumps, expires_at):
+    names = {}
+    values = {}
+    adds = []
+    for i, (field, amount) in enumerate(sorted(bumps.items())):
+        names[f"#c{i}"] = field
+        values[f":c{i}"] = amount
+        adds.append(f"#c{i} :c{i}")
+    update = "ADD " + ", ".join(adds)
+    if expires_at:
+        update += " SET expires_at = :expires_at"
+        values[':expires_at'] = expires_at
+    return {
+        'TableName': 'alert_timeseries',
+        'Key': {'series': series, 't': time},
+        'UpdateExpression': update,
+        'ExpressionAttributeNames': names,
+        'ExpressionAttributeValues': values
+    }
+
+def record(occurrences):
+    """Add occurrences, an iterable of (alert, ISO timestamp, count), to every
+    resolution of their series. Returns the number of points updated."""
+    points = {}
+    for alert, timestamp, count in occurrences:
+        at = _parse_time(timestamp)
+        severity = alert.get('severity', 'medium')
+        for resolution, (_, key_format, _) in RESOLUTIONS.items():
+            time = at.strftime(key_format)
+            for series in series_names(alert):
+                bumps = points.setdefault((resolution, series, time), {})
+                bumps['total_alerts'] = bumps.get('total_alerts', 0) + count
+                bumps[f"{severity}_alerts"] = bumps.get(f"{severity}_alerts", 0) + count
+    if not points:
+        return 0
+
+    client = db.ensure_table('alert_timeseries').meta.client
+
+    def update(point):
+        resolution, series, time = point
+        length, key_format, keep_days = RESOLUTIONS[resolution]
+        expires_at = None
+        if keep_days:
+            expires_at = int((datetime.strptime(time, key_format) + timedelta(days=keep_days)).timestamp())
+        client.update_item(**_point_update(f"{resolution}#{series}", time, points[point], expires_at))
+
+    with ThreadPoolExecutor(max_workers=8, thread_name_prefix="timeseries") as executor:
+        list(executor.map(update, points))
+    return len(points)
+
+def pick_resolution(start, end, now=None):
+    """Finest resolution still kept for start that covers start..end in at most TIMESERIES_MAX_READ points"""
+    now = now or datetime.now()
+    for resolution, (length, _, keep_days) in RESOLUTIONS.items():
+        if keep_days and start < now - timedelta(days=keep_days):
+            continue
+        if (end - start) / length <= TIMESERIES_MAX_READ:
+            return resolution
+    return 'day'
+
+def get_series(since, until=None, account=None, service=None, alert_type=None, severity=None,
+               max_points=TIMESERIES_MAX_POINTS):
+    """Alert counts from since to until (default now), at most max_points of them.
+
+    Filter by at most one of account, service or alert_type. Each point has
+    time (its start), total and per-severity counts, and count: the total,
+    or the severity's count when one is given. Gaps are filled with zeros.
+    Raises ValueError for invalid arguments.
+    """
+    filters = [(name, value) for name, value in
+               (('account', account), ('service', service), ('alert_type', alert_type)) if value]
+    if len(filters) > 1:
+        raise ValueError("Filter by one of account, service or alert_type")
+    if severity and severity not in SEVERITIES:
+        raise ValueError(f"Invalid severity {severity!r}")
+    if max_points < 1:
+        raise ValueError("points must be at least 1")
+    start = _parse_time(since)
+    end = _parse_time(until) if until else datetime.now()
+    if end <= start:
+        raise ValueError("until must be after since")
+
+    series = 'ALL'
+    if filters:
+        name, value = filters[0]
+        series = f"{DIMENSIONS[name][0]}#{value}"
+    resolution = pick_resolution(start, end)
+    length, key_format, _ = RESOLUTIONS[resolution]
+    first = datetime.strptime(start.strftime(key_format), key_format)
+    last = datetime.strptime(end.strftime(key_format), key_format)
+
+    table = db.ensure_table('alert_timeseries')
+    query_kwargs = {
+        'KeyConditionExpression': Key('series').eq(f"{resolution}#{series}") &
+                                  Key('t').between(first.strftime(key_format), last.strftime(key_format))
+    }
+    stored = {}
+    while True:
+        response = table.query(**query_kwargs)
+        for item in response.get('Items', []):
+            stored[item['t']] = item
+        if 'LastEvaluatedKey' not in response:
+            break
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    # Merge consecutive stored points so the response stays under max_points
+    slots = int((last - first) / length) + 1
+    step = max(1, math.ceil(slots / max_points))
+    count_field = f"{severity}_alerts" if severity else 'total_alerts'
+    points = []
+    slot = first
+    while slot <= last:
+        point = {'time': slot.isoformat(), 'total_alerts': 0, **{f"{name}_alerts": 0 for name in SEVERITIES}}
+        for i in range(step):
+            item = stored.get((slot + i * length).strftime(key_format))
+            if item:
+                for field in ('total_alerts', *(f"{name}_alerts" for name in SEVERITIES)):
+                    point[field] += int(item.get(field, 0))
+        point['count'] = point[count_field]
+        points.append(point)
+        slot += step * length
+
+    return {
+        'series': series,
+        'resolution': resolution,
+        'step_seconds': int((step * length).total_seconds()),
+        'since': first.isoformat(),
+        'until': last.isoformat(),
+        'points': points
+    }
+
+def rebuild():
+    """Recompute the time series from the alerts table, counting each alert's
+    occurrences at its timestamp (points past their resolution's retention
+    are written but expire). Returns {alerts, points}."""
+    db.truncate_table('alert_timeseries')
+    table = db.ensure_table('alerts')
+    alerts = []
+    scan_kwargs = {}
+    while True:
+        response = table.scan(**scan_kwargs)
+        alerts.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    points = record((alert, alert['timestamp'], int(alert.get('occurrence_count', 1))) for alert in alerts)
+    return {'alerts': len(alerts), 'points': points}
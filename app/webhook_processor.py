@@ -2,15 +2,50 @@
 Webhook processor for handling incoming webhooks
 """
 
+import os
 import json
 import uuid
 from datetime import datetime
 import re
 import logging
-from . import db
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from . import db, timeseries
+from .hot_store import hot_store
+from .alert_cube import alert_cube
+from .correlation import Correlator
+from .html_text import html_to_text
+from .lanes import LanePool
+from .pipeline import Pipeline, Stage
+from .throttle import Throttle
 
 logger = logging.getLogger(__name__)
 
+# Used when processing outside a lane; lanes keep their own correlators
+correlator = Correlator()
+
+# Alert storm throttle, shared by every batch in this process
+throttle = Throttle()
+
+# Pending ids read per page when processing the whole backlog
+PENDING_PAGE_SIZE = int(os.environ.get("PENDING_PAGE_SIZE", "100"))
+
+# Alert type of the aggregate alerts that throttled notifications are counted on
+STORM_ALERT_TYPE = "Storm"
+
+def classify_priority(webhook_data):
+    """Cheap ingest-time priority from the subject and message, before full extraction"""
+    if not isinstance(webhook_data, dict):
+        return db.DEFAULT_PRIORITY
+    subject = str(webhook_data.get('Subject', '')).lower()
+    message = webhook_data.get('TextBody', '') or webhook_data.get('Message', '')
+    text = f"{subject} {message if isinstance(message, str) else ''}".lower()
+    if 'critical' in text:
+        return db.PRIORITY_CRITICAL
+    if 'high' in subject or 'warning' in subject or 'alarm' in subject:
+        return db.PRIORITY_HIGH
+    return db.PRIORITY_NORMAL
+
 def is_aws_sns_alert(webhook_data):
     """Check if the webhook data is from AWS SNS"""
     # Check for common SNS fields
@@ -143,156 +178,368 @@ def extract_alert_info(webhook_data):
     
     return alert_info
 
-def process_pending_webhooks():
-    """Process all pending webhooks"""
-    # Get all pending webhooks
-    dynamodb = db.get_dynamodb_client()
-    webhook_table = dynamodb.Table('webhook_queue')
+def storm_alert_info(alert_info, throttled_by):
+    """Alert info for the storm aggregate a throttled alert is counted on.
     
-    # Query for pending webhooks
-    response = webhook_table.scan(
-        FilterExpression="#status = :status",
-        ExpressionAttributeNames={"#status": "status"},
-        ExpressionAttributeValues={":status": "pending"}
+    Storm alerts keep the account, service, resource and severity of the
+    throttled alerts so summary counts stay complete (a source storm, which
+    spans resources, uses "*"), and correlation folds each storm into a
+    single alert.
+    """
+    scope, key = throttled_by
+    return dict(
+        alert_info,
+        resource_id='*' if scope == 'source' else alert_info['resource_id'],
+        alert_type=STORM_ALERT_TYPE,
+        message=f"Alert storm: {scope} {key} exceeded its throttle limit. Latest: {alert_info['message']}"
     )
+
+def ensure_alerts_table(dynamodb=None):
+    """Create the alerts table if it doesn't exist and return it"""
+    return db.ensure_table('alerts', dynamodb)
+
+def record_failure(webhook_id, error_message, attempts=None, priority=None):
+    """Schedule a failed webhook for retry with backoff, or dead-letter it"""
+    try:
+        status = db.record_webhook_failure(webhook_id, error_message, attempts, priority)
+    except Exception as e:
+        logger.error(f"Could not record failure for webhook {webhook_id}: {e}")
+        return
+    if status == 'dead_letter':
+        logger.error(f"Webhook {webhook_id} dead-lettered after repeated failures: {error_message}")
+    else:
+        logger.warning(f"Webhook {webhook_id} failed, retry scheduled: {error_message}")
+
+# Pipeline stages. Each takes the batch's contexts (one dict per webhook) and
+# the lane it runs on, and skips contexts that already have an outcome.
+
+def _pending(contexts):
+    return [context for context in contexts if context.get('outcome') is None]
+
+def _discard(context, message, reason=None):
+    context['outcome'] = 'discarded'
+    context['message'] = message
+    context['reason'] = reason
+
+def fetch_stage(contexts, lane=None):
+    """Load queue items given only by id, and their payloads from the payload store"""
+    missing = [context for context in _pending(contexts) if context.get('webhook') is None]
+    if missing:
+        items = db.batch_get_items('webhook_queue', [context['id'] for context in missing])
+        for context in missing:
+            context['webhook'] = items.get(context['id'])
+            if context['webhook'] is None:
+                context['outcome'] = 'missing'
     
-    pending_webhooks = response.get('Items', [])
-    logger.info(f"Found {len(pending_webhooks)} pending webhooks to process")
-    
-    # Check if alerts table exists, create if not
-    existing_tables = [table.name for table in dynamodb.tables.all()]
-    if 'alerts' not in existing_tables:
-        logger.info("Creating alerts table")
-        alerts_table = dynamodb.create_table(
-            TableName='alerts',
-            KeySchema=[
-                {'AttributeName': 'id', 'KeyType': 'HASH'},
-            ],
-            AttributeDefinitions=[
-                {'AttributeName': 'id', 'AttributeType': 'S'},
-                {'AttributeName': 'account_id', 'AttributeType': 'S'},
-                {'AttributeName': 'service', 'AttributeType': 'S'},
-                {'AttributeName': 'resource_id', 'AttributeType': 'S'},
-            ],
-            GlobalSecondaryIndexes=[
-                {
-                    'IndexName': 'account-service-index',
-                    'KeySchema': [
-                        {'AttributeName': 'account_id', 'KeyType': 'HASH'},
-                        {'AttributeName': 'service', 'KeyType': 'RANGE'}
-                    ],
-                    'Projection': {'ProjectionType': 'ALL'},
-                    'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-                },
-                {
-                    'IndexName': 'resource-index',
-                    'KeySchema': [
-                        {'AttributeName': 'resource_id', 'KeyType': 'HASH'},
-                    ],
-                    'Projection': {'ProjectionType': 'ALL'},
-                    'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-                }
-            ],
-            ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-        )
-        # Wait for table to be created
-        alerts_table.meta.client.get_waiter('table_exists').wait(TableName='alerts')
-        logger.info("Alerts table created successfully")
-    
-    alerts_table = dynamodb.Table('alerts')
+    # Items queued before payloads were split out still carry raw_data inline
+    unloaded = [context for context in _pending(contexts) if 'raw_data' not in context['webhook']]
+    if unloaded:
+        payloads = db.get_webhook_payloads([context['id'] for context in unloaded])
+        for context in unloaded:
+            payload = payloads.get(context['id'])
+            if payload is None:
+                context['outcome'] = 'error'
+                context['reason'] = f"No payload found for webhook ID: {context['id']}"
+            else:
+                context['webhook']['raw_data'] = payload.get('raw_data', {})
+                if 'html_text' in payload:
+                    context['html_text'] = payload['html_text']
+
+def text_stage(contexts, lane=None):
+    """Give HTML-only emails a text body, extracting it once per webhook.
     
-    processed_count = 0
-    discarded_count = 0
-    error_count = 0
+    Text extracted from HtmlBody stands in for a missing TextBody in the
+    later stages, and is cached on the webhook's payload so reprocessing
+    reuses it.
+    """
+    extracted = {}
+    for context in _pending(contexts):
+        raw_data = context['webhook'].get('raw_data')
+        if not isinstance(raw_data, dict) or raw_data.get('TextBody') or raw_data.get('Message'):
+            continue
+        html = raw_data.get('HtmlBody')
+        if not html or not isinstance(html, str):
+            continue
+        text = context.get('html_text')
+        if text is None:
+            text = extracted[context['id']] = html_to_text(html)
+        # Copied so the payload as stored is left as it was
+        context['webhook']['raw_data'] = dict(raw_data, TextBody=text)
+    if extracted:
+        try:
+            db.save_webhook_texts(extracted)
+        except Exception as e:
+            # Only the cache is lost; the next run extracts again
+            logger.warning(f"Could not cache text for {len(extracted)} HTML webhooks: {e}")
+
+def classify_stage(contexts, lane=None):
+    """Discard webhooks that aren't AWS alerts"""
+    for context in _pending(contexts):
+        if not is_aws_sns_alert(context['webhook'].get('raw_data', {})):
+            _discard(context, "Webhook discarded - not an AWS alert")
+
+def extract_stage(contexts, lane=None):
+    """Extract alert information and route each alert to the lane for its account/resource"""
+    for context in _pending(contexts):
+        alert_info = extract_alert_info(context['webhook'].get('raw_data', {}))
+        if alert_info['service'] == 'Unknown':
+            _discard(context, "Webhook discarded - Unknown service", "Service is Unknown")
+            continue
+        context['alert_info'] = alert_info
+        context['key'] = f"{alert_info['account_id']}/{alert_info['resource_id']}"
+
+def _event_time(webhook):
+    """Epoch seconds a webhook was received, for the throttle; None if unknown"""
+    try:
+        return datetime.fromisoformat(webhook['timestamp']).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def dedup_stage(contexts, lane=None):
+    """Fold storms and repeats: throttle, then correlate with open alerts.
     
-    for webhook in pending_webhooks:
-        webhook_id = webhook['id']
-        raw_data = webhook.get('raw_data', {})
+    Runs before enrichment so throttled and repeated alerts skip the
+    remediation lookup. Contexts marked 'unthrottled' skip the throttle.
+    """
+    lane_correlator = lane.correlator if lane else correlator
+    for context in _pending(contexts):
+        webhook = context['webhook']
+        alert_info = context['alert_info']
+        
+        # Throttle alert storms before the remediation lookup and alert write,
+        # on when the webhook arrived rather than when it is processed
+        throttled_by = None
+        if not context.get('unthrottled'):
+            throttled_by = throttle.admit({
+                'source': webhook.get('source', 'unknown'),
+                'account': alert_info['account_id'],
+                'resource': f"{alert_info['account_id']}/{alert_info['resource_id']}"
+            }, _event_time(webhook))
+        if throttled_by:
+            # Count it on the storm alert instead
+            alert_info = context['alert_info'] = storm_alert_info(alert_info, throttled_by)
+            context['throttled_by'] = throttled_by
+        
+        timestamp = datetime.now().isoformat()
+        alert = {
+            "id": str(uuid.uuid4()),
+            "account_id": alert_info['account_id'],
+            "service": alert_info['service'],
+            "resource_id": alert_info['resource_id'],
+            "alert_type": alert_info['alert_type'],
+            "severity": alert_info['severity'],
+            "timestamp": timestamp,
+            "last_seen": timestamp,
+            "occurrence_count": 1,
+            "message": alert_info['message'],
+            "region": alert_info['region'],
+            "webhook_id": context['id']
+        }
+        if throttled_by:
+            alert["storm_scope"] = f"{throttled_by[0]}:{throttled_by[1]}"
         
         try:
-            # Check if this is an AWS SNS alert
-            if is_aws_sns_alert(raw_data):
-                # Extract alert information
-                alert_info = extract_alert_info(raw_data)
-                
-                # Skip alerts with Unknown service
-                if alert_info['service'] == 'Unknown':
-                    # Mark as discarded
-                    db.update_webhook_status(webhook_id, "discarded", "Service is Unknown")
-                    discarded_count += 1
-                    logger.info(f"Discarded webhook {webhook_id} with Unknown service")
-                    continue
-                
-                # Generate alert ID
-                alert_id = str(uuid.uuid4())
-                
-                # Get remediation recommendation
-                remediation = db.get_remediation_action(
-                    alert_info['service'], 
-                    alert_info['alert_type'], 
-                    alert_info['severity']
-                )
-                
-                # Create alert item
-                alert_item = {
-                    "id": alert_id,
-                    "account_id": alert_info['account_id'],
-                    "service": alert_info['service'],
-                    "resource_id": alert_info['resource_id'],
-                    "alert_type": alert_info['alert_type'],
-                    "severity": alert_info['severity'],
-                    "timestamp": datetime.now().isoformat(),
-                    "message": alert_info['message'],
-                    "region": alert_info['region'],
-                    "webhook_id": webhook_id,
-                    "remediation": remediation
-                }
-                
-                # Save alert to DynamoDB
-                alerts_table.put_item(Item=alert_item)
-                
-                # Add agent interpretation to the webhook data
-                agent_interpretation = {
-                    "alert_id": alert_id,
-                    "interpreted_service": alert_info['service'],
-                    "interpreted_resource_id": alert_info['resource_id'],
-                    "interpreted_alert_type": alert_info['alert_type'],
-                    "interpreted_severity": alert_info['severity'],
-                    "interpreted_region": alert_info['region'],
-                    "interpreted_account_id": alert_info['account_id'],
-                    "interpreted_message": alert_info['message'],
-                    "ai_recommendation": remediation
-                }
-                
-                # Update webhook with processed information
-                webhook_table.update_item(
-                    Key={'id': webhook_id},
-                    UpdateExpression="SET #status = :status, processed_at = :processed_at, agent_interpretation = :agent_interpretation",
-                    ExpressionAttributeNames={'#status': 'status'},
-                    ExpressionAttributeValues={
-                        ':status': 'processed',
-                        ':processed_at': datetime.now().isoformat(),
-                        ':agent_interpretation': agent_interpretation
-                    }
-                )
-                
-                processed_count += 1
-                logger.info(f"Processed webhook {webhook_id} as alert {alert_id}")
-            else:
-                # Not an AWS alert, mark as discarded
-                db.update_webhook_status(webhook_id, "discarded")
-                discarded_count += 1
-                logger.info(f"Discarded non-AWS webhook {webhook_id}")
+            repeat_of = lane_correlator.correlate(alert)
         except Exception as e:
-            # Update webhook status to error
-            error_message = str(e)
-            db.update_webhook_status(webhook_id, "error", error_message)
-            error_count += 1
-            logger.error(f"Error processing webhook {webhook_id}: {error_message}")
+            # Better a duplicate alert than a lost one
+            logger.warning(f"Correlation lookup failed for webhook {context['id']}: {e}")
+            repeat_of = None
+        lane_correlator.remember(alert['fingerprint'], repeat_of or alert['id'], alert['last_seen'])
+        context['alert'] = alert
+        context['repeat_of'] = repeat_of
+
+def enrich_stage(contexts, lane=None):
+    """Add remediation to new alerts and build the agent interpretation"""
+    for context in _pending(contexts):
+        alert = context['alert']
+        alert_info = context['alert_info']
+        throttled_by = context.get('throttled_by')
+        
+        if throttled_by:
+            remediation = (f"Alert storm on {throttled_by[0]} {throttled_by[1]}: investigate the underlying "
+                           f"incident. Throttled notifications are counted on this alert.")
+        elif context['repeat_of']:
+            # The open alert already has its recommendation
+            remediation = None
+        else:
+            remediation = db.get_remediation_action(alert['service'], alert['alert_type'], alert['severity'])
+        if remediation is not None:
+            alert["remediation"] = remediation
+        
+        context['agent_interpretation'] = {
+            "alert_id": context['repeat_of'] or alert['id'],
+            "interpreted_service": alert_info['service'],
+            "interpreted_resource_id": alert_info['resource_id'],
+            "interpreted_alert_type": alert_info['alert_type'],
+            "interpreted_severity": alert_info['severity'],
+            "interpreted_region": alert_info['region'],
+            "interpreted_account_id": alert_info['account_id'],
+            "interpreted_message": alert_info['message'],
+            "ai_recommendation": remediation
+        }
+        if context['repeat_of']:
+            context['agent_interpretation']["correlated"] = True
+        if throttled_by:
+            context['agent_interpretation']["throttled_by"] = alert["storm_scope"]
+
+def persist_stage(contexts, lane=None):
+    """Write outcomes: alerts in grouped transactions, discards as status updates, errors as retries"""
+    lane_correlator = lane.correlator if lane else correlator
+    commits = []
+    for context in contexts:
+        webhook = context.get('webhook') or {}
+        if context.get('outcome') == 'discarded':
+            db.update_webhook_status(context['id'], "discarded", context['reason'])
+            logger.info(f"Discarded webhook {context['id']}: {context['message']}")
+        elif context.get('outcome') == 'error' and not context.get('failure_recorded'):
+            record_failure(context['id'], context['reason'], webhook.get('attempts', 0), webhook.get('priority'))
+        elif context.get('outcome') is None:
+            commit = {
+                'alert': context['alert'],
+                'webhook_id': context['id'],
+                'agent_interpretation': context['agent_interpretation']
+            }
+            if context['repeat_of']:
+                commit['repeat_of'] = context['repeat_of']
+            commits.append((context, commit))
+    
+    if not commits:
+        return
+    results = db.commit_alerts([commit for _, commit in commits])
+    for context, commit in commits:
+        status = results[context['id']]
+        if status.startswith("error"):
+            context['outcome'] = 'error'
+            context['reason'] = status[len("error: "):]
+            lane_correlator.forget(commit['alert']['fingerprint'], commit.get('repeat_of') or commit['alert']['id'])
+            record_failure(context['id'], context['reason'], context['webhook'].get('attempts', 0),
+                           context['webhook'].get('priority'))
+        else:
+            context['outcome'] = status
+            logger.info(f"Committed webhook {context['id']}: {status}")
+    
+    # Alert rate series are derived data; a failed update doesn't fail the webhooks
+    try:
+        timeseries.record((commit['alert'], commit['alert']['last_seen'], 1)
+                          for context, commit in commits if context['outcome'] == "processed")
+    except Exception as e:
+        logger.warning(f"Failed to update alert time series: {e}")
+    hot_store.add((commit['alert'], commit['alert']['last_seen'], 1, commit.get('repeat_of'))
+                  for context, commit in commits if context['outcome'] == "processed")
+    alert_cube.add((commit['alert'], 1, commit.get('repeat_of'))
+                   for context, commit in commits if context['outcome'] == "processed")
+
+def stage_failed(stage_name, contexts, error):
+    """Schedule retries for the webhooks a raising stage errored, so they back off
+    (and eventually dead-letter) like any other failure; persist skips them after"""
+    for context in contexts:
+        webhook = context.get('webhook')
+        if webhook is None:
+            # Not fetched yet: record_failure reads attempts and priority from the item
+            record_failure(context['id'], context['reason'])
+        else:
+            record_failure(context['id'], context['reason'], webhook.get('attempts', 0), webhook.get('priority'))
+        context['failure_recorded'] = True
+
+# fetch -> text -> classify -> extract run on the whole batch; dedup, enrich and
+# persist run on the lane for each alert's account/resource
+webhook_pipeline = Pipeline([
+    Stage("fetch", fetch_stage),
+    Stage("text", text_stage),
+    Stage("classify", classify_stage),
+    Stage("extract", extract_stage),
+    Stage("dedup", dedup_stage, lane_local=True),
+    Stage("enrich", enrich_stage, lane_local=True),
+    Stage("persist", persist_stage, lane_local=True),
+], on_error=stage_failed)
+
+# Lanes shared by the web app's background tasks and /process/all
+_shared_lanes = None
+_shared_lanes_lock = threading.Lock()
+
+def shared_lanes():
+    """The process-wide lane pool, created on first use"""
+    global _shared_lanes
+    with _shared_lanes_lock:
+        if _shared_lanes is None:
+            _shared_lanes = LanePool()
+        return _shared_lanes
+
+def run_pipeline(webhooks=(), webhook_ids=(), lanes=None, throttled=True):
+    """Run queue items and/or ids (fetched by the pipeline) through the webhook pipeline.
+    
+    Items are processed in arrival order within each lane. throttled=False
+    skips the storm throttle, for operator runs over a backlog or history
+    (process all, reprocess). Returns the contexts; each has the webhook
+    'id' and an 'outcome' of "processed", "duplicate", "discarded", "error"
+    or "missing".
+    """
+    contexts = [{'id': webhook['id'], 'webhook': webhook}
+                for webhook in sorted(webhooks, key=lambda webhook: webhook.get('timestamp') or '')]
+    contexts.extend({'id': webhook_id, 'webhook': None} for webhook_id in webhook_ids)
+    if not throttled:
+        for context in contexts:
+            context['unthrottled'] = True
+    return webhook_pipeline.run(contexts, lanes)
+
+def count_outcomes(contexts):
+    """Counts of processed, discarded and errored webhooks"""
+    counts = {"processed": 0, "discarded": 0, "error": 0}
+    for context in contexts:
+        # An already-committed alert means the webhook was processed before
+        outcome = "processed" if context['outcome'] == "duplicate" else context['outcome']
+        if outcome in counts:
+            counts[outcome] += 1
+    return counts
+
+def process_webhook_batch(webhooks, lanes=None):
+    """Process a batch of webhook queue items.
+    
+    With lanes, each lane deduplicates, enriches and commits its share in
+    order while lanes run in parallel; without them the batch runs in the
+    caller. Returns counts of processed, discarded and errored webhooks.
+    """
+    return count_outcomes(run_pipeline(webhooks, lanes=lanes))
+
+def process_webhook_id(webhook_id, lanes=None):
+    """Fetch and process one webhook by id; returns its pipeline context"""
+    return run_pipeline(webhook_ids=[webhook_id], lanes=lanes or shared_lanes())[0]
+
+def process_pending_webhooks(page_size=PENDING_PAGE_SIZE, lanes=None, on_page=None):
+    """Process all pending webhooks, streaming them a page at a time.
+    
+    Pending ids that are due are read page by page from the pending index,
+    and the next page is read while the current one is processed; items
+    still backing off after a failure are left for the consumer. Payloads are only
+    loaded (by the pipeline's fetch stage) for the page being processed.
+    on_page(count) is called after each page; an exception it raises stops
+    the run there. The backlog is not throttled: it is read in schedule
+    order, not the order it arrived in.
+    """
+    lanes = lanes or shared_lanes()
+    counts = {"processed": 0, "discarded": 0, "error": 0}
+    total = 0
+    pages = db.iter_pending_webhook_ids(page_size)
+    
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="pending-reader") as reader:
+        next_page = reader.submit(next, pages, None)
+        while True:
+            webhook_ids = next_page.result()
+            if not webhook_ids:
+                break
+            next_page = reader.submit(next, pages, None)
+            
+            page_counts = count_outcomes(run_pipeline(webhook_ids=webhook_ids, lanes=lanes, throttled=False))
+            for outcome, count in page_counts.items():
+                counts[outcome] += count
+            total += len(webhook_ids)
+            logger.info(f"Processed page of {len(webhook_ids)} pending webhooks ({total} so far)")
+            if on_page:
+                on_page(len(webhook_ids))
     
     return {
-        "processed": processed_count,
-        "discarded": discarded_count,
-        "error": error_count,
-        "total": len(pending_webhooks)
-    }
\ No newline at end of file
+        "processed": counts["processed"],
+        "discarded": counts["discarded"],
+        "error": counts["error"],
+        "total": total
+    }
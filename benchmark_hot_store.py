@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark the hot store's group-bys against the dict loops of the DynamoDB read path.
+
+Generates alerts across accounts, services, regions and resources over the
+last days, then times the account/service summary, a service's resources
+and a resource's alert types both ways. The loops run on items already in
+memory (the drill-downs on just the matching ones, as the index queries
+return), so the DynamoDB reads they need on top are not counted. Needs numpy.
+
+Usage: python benchmark_hot_store.py [--alerts 200000] [--rounds 5]
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from app.db import alert_weight
+from app.hot_store import HotStore
+
+def generate(count, seed=0):
+    rng = random.Random(seed)
+    now = datetime.now()
+    accounts = [f"{rng.randrange(10**11, 10**12)}" for _ in range(20)]
+    services = ['EC2', 'RDS', 'Lambda', 'DynamoDB', 'ECS', 'S3', 'SQS', 'ELB']
+    regions = ['us-east-1', 'us-west-2', 'eu-west-1', 'ap-southeast-2']
+    alert_types = ['CPU', 'Memory', 'Disk', 'Latency', 'Errors', 'Throttles']
+    alerts = []
+    for i in range(count):
+        timestamp = (now - timedelta(minutes=rng.randrange(7 * 24 * 60))).isoformat()
+        alerts.append({
+            'id': f"alert-{i}",
+            'account_id': rng.choice(accounts),
+            'service': rng.choice(services),
+            'region': rng.choice(regions),
+            'resource_id': f"res-{rng.randrange(count // 20 or 1)}",
+            'alert_type': rng.choice(alert_types),
+            'severity': rng.choice(['medium', 'high', 'critical']),
+            'timestamp': timestamp,
+            'occurrence_count': rng.choice([1, 1, 1, 2, 5])
+        })
+    return alerts
+
+def loop_group(items, by):
+    """The read path's aggregation: one dict row per group, weighted by occurrences"""
+    summary = {}
+    for item in items:
+        key = tuple(item.get(name, 'us-east-1') for name in by)
+        row = summary.setdefault(key, {'total_alerts': 0, 'medium_alerts': 0, 'high_alerts': 0, 'critical_alerts': 0})
+        weight = alert_weight(item)
+        row['total_alerts'] += weight
+        row[f"{item.get('severity', 'medium')}_alerts"] += weight
+    return summary
+
+def timed(label, fn, rounds):
+    best = min(_elapsed(fn) for _ in range(rounds))
+    print(f"{label:<34} {best * 1000:>10.2f} ms")
+
+def _elapsed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--alerts', type=int, default=200000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    store = HotStore(days=0, enabled=True)
+    if not store.enabled:
+        raise SystemExit("benchmark_hot_store.py needs numpy: pip install numpy")
+    alerts = generate(args.alerts)
+    start = time.perf_counter()
+    store.load(alerts, None)
+    print(f"{args.alerts} alerts loaded into the hot store in {time.perf_counter() - start:.2f}s\n")
+
+    sample = alerts[0]
+    account, service, resource = sample['account_id'], sample['service'], sample['resource_id']
+    service_items = [item for item in alerts if item['account_id'] == account and item['service'] == service]
+    resource_items = [item for item in alerts if item['resource_id'] == resource]
+
+    timed("summary, dict loop", lambda: loop_group(alerts, ('account_id', 'service', 'region')), args.rounds)
+    timed("summary, hot store", lambda: store.summarize(('account_id', 'service', 'region')), args.rounds)
+    timed("service resources, dict loop", lambda: loop_group(service_items, ('resource_id', 'region')), args.rounds)
+    timed("service resources, hot store", lambda: store.summarize(('resource_id', 'region'), account_id=account,
+                                                                   service=service), args.rounds)
+    timed("resource alert types, dict loop", lambda: loop_group(resource_items, ('alert_type',)), args.rounds)
+    timed("resource alert types, hot store", lambda: store.summarize(('alert_type',), resource_id=resource),
+          args.rounds)
+    since = (datetime.now() - timedelta(hours=24)).isoformat()
+    timed("24h summary, hot store", lambda: store.summarize(('account_id', 'service', 'region'), since=since),
+          args.rounds)
+
+if __name__ == "__main__":
+    main()
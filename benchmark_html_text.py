@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Benchmark HTML-to-text extraction on a generated corpus of alert emails.
+
+The corpus mimics the HTML that monitoring tools send: inline CSS, a
+header/footer layout table, a details table per metric and links, at the
+sizes those emails come in (roughly 10 KB to 300 KB). Compares
+app.html_text.html_to_text with a stdlib HTMLParser baseline, and the text
+stage with and without a cached result.
+
+Usage: python benchmark_html_text.py [--emails 200] [--rounds 3]
+"""
+
+import argparse
+import random
+import time
+from html.parser import HTMLParser
+from app.html_text import html_to_text
+from app import webhook_processor
+
+STYLE = "<style>" + "".join(f".c{i}{{font-family:Arial;color:#{i:06x};padding:{i % 9}px}}" for i in range(120)) + "</style>"
+
+def alert_email(rows, seed):
+    """One alert email with a details table of the given number of rows"""
+    rng = random.Random(seed)
+    service = rng.choice(['EC2', 'RDS', 'Lambda', 'DynamoDB', 'ECS'])
+    instance = f"i-{rng.getrandbits(68):017x}"
+    account = f"{rng.randrange(10**11, 10**12)}"
+    details = "".join(
+        f"<tr><td class=\"c{i % 120}\" style=\"border:1px solid #ddd\">Metric&nbsp;{i}</td>"
+        f"<td class=\"c{(i + 7) % 120}\"><b>{rng.random() * 100:.2f}</b>&#37; at {rng.randrange(24):02d}:{rng.randrange(60):02d} UTC</td>"
+        f"<td><a href=\"https://console.aws.amazon.com/cloudwatch/home?region=us-east-1#alarm:{i}\">view</a></td></tr>\n"
+        for i in range(rows)
+    )
+    return (
+        f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>Alarm</title>{STYLE}</head><body>"
+        f"<!-- generated by monitoring --><table width=\"100%\"><tr><td>"
+        f"<h1 class=\"c1\">ALARM: &quot;{service} CPU critical&quot; in US East (N. Virginia)</h1>"
+        f"<p>You are receiving this email because your Amazon CloudWatch Alarm for {service} "
+        f"resource <b>{instance}</b> in account {account}, region us-east-1, entered the ALARM state.</p>"
+        f"<table class=\"details\">{details}</table>"
+        f"<script>window.track && track('{instance}');</script>"
+        f"<p class=\"footer\">&copy; Amazon Web Services &mdash; unsubscribe</p></td></tr></table></body></html>"
+    )
+
+def corpus(count):
+    sizes = [20, 60, 150, 400, 1200]
+    return [alert_email(sizes[i % len(sizes)], i) for i in range(count)]
+
+class _BaselineParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('script', 'style', 'head'):
+            self.skip += 1
+        elif tag in ('p', 'div', 'br', 'tr', 'h1', 'li'):
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style', 'head'):
+            self.skip -= 1
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.parts.append(data)
+
+def baseline_to_text(html):
+    parser = _BaselineParser()
+    parser.feed(html)
+    parser.close()
+    return ''.join(parser.parts)
+
+def timed(label, fn, emails, total_bytes, rounds):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for html in emails:
+            fn(html)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label:<28} {len(emails) / best:>10.0f} emails/s {total_bytes / best / 1e6:>8.1f} MB/s")
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--emails', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    emails = corpus(args.emails)
+    total_bytes = sum(len(html) for html in emails)
+    print(f"{len(emails)} emails, {total_bytes / 1e6:.1f} MB of HTML "
+          f"({min(map(len, emails)) // 1024}-{max(map(len, emails)) // 1024} KB each)\n")
+
+    timed("HTMLParser baseline", baseline_to_text, emails, total_bytes, args.rounds)
+    timed("html_to_text", html_to_text, emails, total_bytes, args.rounds)
+    timed("html_to_text (no cap)", lambda html: html_to_text(html, max_chars=10**9, max_input=10**9),
+          emails, total_bytes, args.rounds)
+
+    # The pipeline's text stage, first run versus a reprocess with cached text
+    # (without the cache write to DynamoDB)
+    webhook_processor.db.save_webhook_texts = lambda texts: None
+    def stage(cached):
+        contexts = []
+        for i, html in enumerate(emails):
+            context = {'id': str(i), 'webhook': {'raw_data': {'Subject': 'ALARM', 'HtmlBody': html}}}
+            if cached:
+                context['html_text'] = 'cached'
+            contexts.append(context)
+        start = time.perf_counter()
+        webhook_processor.text_stage(contexts)
+        return time.perf_counter() - start
+    for label, cached in (("text stage, first run", False), ("text stage, reprocess", True)):
+        best = min(stage(cached) for _ in range(args.rounds))
+        print(f"{label:<28} {len(emails) / best:>10.0f} emails/s")
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,7 @@ import uuid
 from datetime import datetime, timedelta
 import random
 import json
-import boto3
+from app import db, payload_store
 
 # Set AWS environment variables for DynamoDB Local
 os.environ["AWS_ENDPOINT_URL"] = "http://localhost:8001"
@@ -16,66 +16,18 @@ os.environ["AWS_DEFAULT_REGION"] = "us-east-1"
 os.environ["AWS_ACCESS_KEY_ID"] = "fakeAccessKeyId"
 os.environ["AWS_SECRET_ACCESS_KEY"] = "fakeSecretAccessKey"
 
-# Connect to DynamoDB
-dynamodb = boto3.resource(
-    'dynamodb',
-    endpoint_url=os.environ.get("AWS_ENDPOINT_URL"),
-    region_name=os.environ.get("AWS_DEFAULT_REGION"),
-    aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY")
-)
-
 def seed_webhook_data():
     """Seed sample webhook data for the queue dashboard"""
-    # Check if table exists
-    existing_tables = [table.name for table in dynamodb.tables.all()]
-    if 'webhook_queue' not in existing_tables:
-        print("Creating webhook_queue table...")
-        webhook_queue = dynamodb.create_table(
-            TableName='webhook_queue',
-            KeySchema=[
-                {'AttributeName': 'id', 'KeyType': 'HASH'},
-            ],
-            AttributeDefinitions=[
-                {'AttributeName': 'id', 'AttributeType': 'S'},
-                {'AttributeName': 'status', 'AttributeType': 'S'},
-                {'AttributeName': 'timestamp', 'AttributeType': 'S'},
-                {'AttributeName': 'date', 'AttributeType': 'S'},
-            ],
-            GlobalSecondaryIndexes=[
-                {
-                    'IndexName': 'status-timestamp-index',
-                    'KeySchema': [
-                        {'AttributeName': 'status', 'KeyType': 'HASH'},
-                        {'AttributeName': 'timestamp', 'KeyType': 'RANGE'}
-                    ],
-                    'Projection': {'ProjectionType': 'ALL'},
-                    'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-                },
-                {
-                    'IndexName': 'date-index',
-                    'KeySchema': [
-                        {'AttributeName': 'date', 'KeyType': 'HASH'},
-                    ],
-                    'Projection': {'ProjectionType': 'ALL'},
-                    'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-                }
-            ],
-            ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-        )
-        # Wait for table to be created
-        webhook_queue.meta.client.get_waiter('table_exists').wait(TableName='webhook_queue')
-        print("webhook_queue table created successfully")
-    else:
-        webhook_queue = dynamodb.Table('webhook_queue')
+    # Tables with every index the app reads, as the app creates them
+    webhook_queue = db.ensure_table('webhook_queue')
+    webhook_payloads = db.ensure_table('webhook_payloads')
     
-    # Check if data already exists
-    if webhook_queue.scan(Limit=1)['Items']:
-        print("Data already exists in webhook_queue table. Clearing existing data...")
-        scan = webhook_queue.scan()
-        with webhook_queue.batch_writer() as batch:
-            for item in scan['Items']:
-                batch.delete_item(Key={'id': item['id']})
+    # Clear existing data, with its payloads and compacted history
+    print("Clearing existing webhook data...")
+    db.truncate_table('webhook_queue')
+    db.truncate_table('webhook_history')
+    db.truncate_table('webhook_payloads')
+    payload_store.clear_blobs()
     
     # Generate sample webhook data
     now = datetime.now()
@@ -124,17 +76,23 @@ def seed_webhook_data():
                 "Headers": [{"Name": "X-Test-Header", "Value": "test-value"}]
             }
             
-            # Create webhook queue item with raw data included
+            # Create webhook queue item; the email goes to the payload table
             queue_item = {
                 "id": webhook_id,
                 "timestamp": timestamp_iso,
                 "date": date_str,
                 "status": status,
                 "source": "postmark",
-                "processed_at": timestamp_iso if status != "pending" else None,
-                "raw_data": email_data  # Include raw data directly in the queue item
+                "processed_at": timestamp_iso if status != "pending" else None
             }
             
+            # Sharded status and date index keys, from the same helpers the app uses
+            queue_item.update(db.webhook_shard_keys(queue_item))
+            
+            # Pending items are due for pickup straight away
+            if status == "pending":
+                queue_item.update(db.pending_schedule(webhook_id, db.PRIORITY_NORMAL, timestamp_iso))
+            
             # Add error message for error status
             if status == "error":
                 queue_item["error_message"] = random.choice([
@@ -144,14 +102,18 @@ def seed_webhook_data():
                     "Database connection error"
                 ])
             
-            sample_data.append(queue_item)
+            sample_data.append((queue_item, email_data))
     
     # Insert data into table
     print(f"Inserting {len(sample_data)} sample webhook items...")
     
+    with webhook_payloads.batch_writer() as batch:
+        for queue_item, email_data in sample_data:
+            batch.put_item(Item={"id": queue_item["id"], "raw_data": email_data})
+    
     with webhook_queue.batch_writer() as batch:
-        for item in sample_data:
-            batch.put_item(Item=item)
+        for queue_item, email_data in sample_data:
+            batch.put_item(Item=queue_item)
     
     print("Sample webhook data inserted successfully")
 